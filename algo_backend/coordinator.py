@@ -0,0 +1,101 @@
+##########################################################################
+### Single snapshot shared by every server process, refreshed by one ###
+##########################################################################
+
+import fcntl
+import glob
+import hashlib
+import os
+from typing import Optional
+
+from .data_structure import Timetable
+from .preprocessing import load_gtfs_data
+from .snapshot import gtfs_version, read_header, write_snapshot, load_snapshot
+
+"""Every worker of the server memory-maps the same snapshot file: the time columns are stored once in the page cache whatever the number of workers.
+    The snapshot directory holds:
+        - timetable-<version digest>.bin: one snapshot per GTFS version, never modified once written
+        - current: name of the snapshot in use, replaced atomically (os.replace) when a new version is published
+        - coordinator.lock: locked (flock) by the only process allowed to download the data and publish snapshots
+    Workers never build a snapshot themselves: they poll the 'current' file and switch to the new snapshot when it changes.
+    The lock is released by the kernel when its owner exits, so another worker can take over."""
+
+POINTER_NAME = 'current'
+LOCK_NAME = 'coordinator.lock'
+SNAPSHOT_PATTERN = 'timetable-*.bin'
+
+
+class Coordinator:
+    """Election of the coordinator among the server processes, with an exclusive lock on a file of the snapshot directory."""
+
+    def __init__(self, snapshot_dir: str):
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.lock_file = open(os.path.join(snapshot_dir, LOCK_NAME), mode='a')
+        self.owned = False
+
+    def try_acquire(self) -> bool:
+        """Takes the lock if no other process holds it. Outputs whether this process is the coordinator."""
+        if not self.owned:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.owned = True
+            except BlockingIOError:
+                pass
+        return self.owned
+
+
+def snapshot_name(version: str) -> str:
+    return f"timetable-{hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]}.bin"
+
+
+def current_snapshot(snapshot_dir: str) -> Optional[str]:
+    """Path of the snapshot in use, or None if none was published yet."""
+    try:
+        with open(os.path.join(snapshot_dir, POINTER_NAME), mode='r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(snapshot_dir, name) if name else None
+
+
+def publish_snapshot(gtfs_dir: str, snapshot_dir: str) -> str:
+    """Builds the snapshot of the GTFS data (unless this version already has one), then makes it the current snapshot.
+        To be called by the coordinator only. The previous snapshot is kept for the workers still switching from it, older ones are deleted:
+        a worker still mapping a deleted file keeps reading it until it switches. Outputs the path of the snapshot."""
+    version = gtfs_version(gtfs_dir)
+    path = os.path.join(snapshot_dir, snapshot_name(version))
+
+    header = read_header(path)
+    if header is None or header['version'] != version:
+        timetable = load_gtfs_data(gtfs_dir)
+        timetable.version = version
+        write_snapshot(timetable, path)
+
+    previous = current_snapshot(snapshot_dir)
+    if previous != path:
+        pointer = os.path.join(snapshot_dir, POINTER_NAME)
+        with open(pointer + '.tmp', mode='w', encoding='utf-8') as f:
+            f.write(os.path.basename(path))
+        os.replace(pointer + '.tmp', pointer)
+
+    for old_path in glob.glob(os.path.join(snapshot_dir, SNAPSHOT_PATTERN)):
+        if old_path not in (path, previous):
+            os.remove(old_path)
+
+    return path
+
+
+def attach_snapshot(snapshot_dir: str, timetable: Optional[Timetable] = None) -> Optional[Timetable]:
+    """Maps the current snapshot, read-only. If 'timetable' is already the current version, it is returned as is.
+        Outputs None if no snapshot was published yet."""
+    path = current_snapshot(snapshot_dir)
+    if path is None:
+        return timetable
+
+    header = read_header(path)
+    if header is None:
+        return timetable
+    if timetable is not None and timetable.version == header['version']:
+        return timetable
+
+    return load_snapshot(path)
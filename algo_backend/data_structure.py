@@ -3,8 +3,15 @@
 ######################################################
 
 from __future__ import annotations
+import threading
+from array import array
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Union
+from datetime import date, timedelta
+from typing import Dict, FrozenSet, List, Sequence, Tuple, Union
+
+# All times are stored as integer seconds from midnight (int32 in the typed arrays)
+UNREACHED = 2**31 - 1 # Largest int32: arrival time of a stop that can not be reached (yet)
 
 @dataclass
 class Stop:
@@ -14,7 +21,7 @@ class Stop:
     id: str
     lat: float
     lon: float
-    min_transfer_time: int = 2 # in minutes 
+    min_transfer_time: int = 120 # in seconds 
     index_in_list: int = None
 
 
@@ -26,18 +33,66 @@ class Route:
     stop_index_list: List[int] = None # CAUTION : To be constructed before running the algorithm
     index_in_list: int = None
     trips: List[Trip] = None # CAUTION: trips must be in chronological order!
+    departure_columns: List[array] = None # departure_columns[rank][i] = departure time (int32 seconds) of the i-th trip at this rank. Built by build_columns()
+    arrival_columns: List[array] = None # Same for arrival times
+    no_pickup: List[FrozenSet[int]] = None # no_pickup[rank] = positions of the trips that can not be boarded at this rank
+    no_drop_off: List[FrozenSet[int]] = None # Same for trips that can not be left at this rank
+    trip_ids: List[str] = None # trip_ids[i] = id of the i-th trip, the only trip data needed once the columns are built
+    trip_services: array = None # trip_services[i] = index of the service of the i-th trip in the ServiceCalendar
+    time_offset: int = 0 # in seconds, added to every time of the columns. Set on the previous/next day views of a service window
 
     def add_trip(self,trip: Trip):
         if self.trips is None:
             self.trips = []
         self.trips.append(trip)
 
+    def build_columns(self):
+        """Stores the trip times column by column (one typed array per stop rank) for binary searches in RAPTOR.
+            CAUTION: trips need to be sorted and FIFO beforehand, so that every column is sorted."""
+        trips = self.trips or []
+        num_ranks = len(self.stop_list)
+
+        self.trip_ids = [trip.id for trip in trips]
+        self.trip_services = array('i', (trip.service for trip in trips))
+
+        self.departure_columns = [array('i', (trip.departure_times[rank] for trip in trips)) for rank in range(num_ranks)]
+        self.arrival_columns = [array('i', (trip.arrival_times[rank] for trip in trips)) for rank in range(num_ranks)]
+
+        self.no_pickup = [set() for _ in range(num_ranks)]
+        self.no_drop_off = [set() for _ in range(num_ranks)]
+        for position, trip in enumerate(trips):
+            for rank in trip.no_pickup:
+                self.no_pickup[rank].add(position)
+            for rank in trip.no_drop_off:
+                self.no_drop_off[rank].add(position)
+
+        self.no_pickup = [frozenset(positions) for positions in self.no_pickup]
+        self.no_drop_off = [frozenset(positions) for positions in self.no_drop_off]
+
+    def filter_trips(self, positions: List[int]) -> Route:
+        """Copy of the route keeping only the trips at the given positions (in increasing order), so that every column stays sorted."""
+        route = Route(self.id, self.stop_list, self.stop_index_list, self.index_in_list)
+        route.trip_ids = [self.trip_ids[i] for i in positions]
+        route.trip_services = array('i', (self.trip_services[i] for i in positions))
+
+        route.departure_columns = [array('i', (column[i] for i in positions)) for column in self.departure_columns]
+        route.arrival_columns = [array('i', (column[i] for i in positions)) for column in self.arrival_columns]
+
+        new_positions = {old: new for new, old in enumerate(positions)}
+        route.no_pickup = [frozenset(new_positions[i] for i in blocked if i in new_positions) for blocked in self.no_pickup]
+        route.no_drop_off = [frozenset(new_positions[i] for i in blocked if i in new_positions) for blocked in self.no_drop_off]
+
+        return route
+
 @dataclass
 class Trip:
     """A particular instance of a route, with specific departure and arrival times"""
     id: str
-    arrival_times: List[float]
-    departure_times: List[float]
+    arrival_times: Sequence[int] # in seconds from midnight. Stored as array('i') by the preprocessing
+    departure_times: Sequence[int]
+    no_pickup: Tuple[int, ...] = () # ranks of the stops where boarding is not allowed
+    no_drop_off: Tuple[int, ...] = () # ranks of the stops where leaving the train is not allowed
+    service: int = 0 # index of the service (days on which the trip runs) in the ServiceCalendar
 
 
 def map_index(object_list: List[Union[Route,Stop]]):
@@ -62,3 +117,317 @@ def map_stop_to_routes(stop_list, route_list) -> List[List[int]]:
             stop_to_routes[stop_index].append(route.index_in_list)
 
     return stop_to_routes
+
+
+@dataclass
+class ServiceCalendar:
+    """Days on which every service runs, built from calendar.txt and calendar_dates.txt.
+        Each service is a bitset stored as a Python int: bit d is set if the service runs d days after start_date."""
+    start_date: date
+    num_days: int
+    service_ids: List[str] # service index -> GTFS service_id
+    days: List[int] # service index -> bitset of the days the service runs
+
+    def active_services(self, day: date) -> List[bool]:
+        """Outputs, for every service, whether it runs on the given day (False for every service outside of the calendar)."""
+        offset = (day - self.start_date).days
+        if not 0 <= offset < self.num_days:
+            return [False] * len(self.days)
+        return [bool(days >> offset & 1) for days in self.days]
+
+
+@dataclass
+class Timetable:
+    """Network index built once from the GTFS data and shared by every RAPTOR query.
+        It bundles the stops, routes and trips with the lookup tables the algorithm needs,
+        so that the only per-query work left is the allocation of the labels."""
+    stop_list: List[Stop]
+    route_list: List[Route] # trips are stored in each route, in chronological order, along with their time columns
+    stop_dict: Dict[str, Stop] = None # stop_id -> Stop object
+    stop_route_ranks: List[List[Tuple[int, int]]] = None # stop index -> [(route index, rank of the stop in the route), ...]
+    version: str = None # version of the GTFS data the timetable was built from
+    buffer: object = None # memory-mapped snapshot backing the arrays, when loaded from one (see snapshot.py)
+    calendar: ServiceCalendar = None # None if the GTFS data has no calendar: every trip then runs every day
+    day: date = None # set on the views returned by timetable_for_day()
+    day_views: OrderedDict = None # cache of the views returned by timetable_for_day(), most recently used last
+    window: Timetable = None # service window built on a day view by service_window(), cached with it
+    footpaths: TransferGraph = None # walking transfers between stops, None if there is none
+    snapshot_path: str = None # file of the memory-mapped snapshot, so that other processes can map it too
+
+
+class StopRouteIndex:
+    """Read-only stop -> [(route index, rank), ...] index stored in CSR form: the pairs of stop i are at positions offsets[i] to offsets[i+1].
+        Used instead of a list of lists when the timetable is memory-mapped from a snapshot."""
+
+    def __init__(self, offsets: Sequence[int], routes: Sequence[int], ranks: Sequence[int]):
+        self.offsets = offsets
+        self.routes = routes
+        self.ranks = ranks
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, stop_index: int) -> List[Tuple[int, int]]:
+        start, end = self.offsets[stop_index], self.offsets[stop_index + 1]
+        return list(zip(self.routes[start:end], self.ranks[start:end]))
+
+
+class TransferGraph:
+    """Footpaths between stops stored in CSR form: the footpaths leaving stop i are at positions offsets[i] to offsets[i+1]
+        of 'targets' (stop reached) and 'durations' (walking time in seconds). Built once by the preprocessing (see build_footpaths)."""
+
+    def __init__(self, offsets: Sequence[int], targets: Sequence[int], durations: Sequence[int]):
+        self.offsets = offsets
+        self.targets = targets
+        self.durations = durations
+        self.reversed = None # cache of reverse()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, stop_index: int) -> List[Tuple[int, int]]:
+        start, end = self.offsets[stop_index], self.offsets[stop_index + 1]
+        return list(zip(self.targets[start:end], self.durations[start:end]))
+
+    def reverse(self) -> TransferGraph:
+        """Graph of the same footpaths walked backwards (from their target to their origin), used by arrive-by queries.
+            Built once and cached: footpaths may not be symmetric (see transfers.txt)."""
+        if self.reversed is None:
+            self.reversed = TransferGraph.from_durations(len(self), {(self.targets[i], stop_index): self.durations[i]
+                                                                     for stop_index in range(len(self))
+                                                                     for i in range(self.offsets[stop_index], self.offsets[stop_index + 1])})
+        return self.reversed
+
+    @classmethod
+    def from_durations(cls, num_stops: int, durations: Dict[Tuple[int, int], int]) -> TransferGraph:
+        """Builds the graph from a {(from stop index, to stop index): walking time} dictionnary."""
+        offsets = array('i', [0])
+        targets = array('i')
+        times = array('i')
+        footpaths = sorted(durations.items())
+        i = 0
+        for stop_index in range(num_stops):
+            while i < len(footpaths) and footpaths[i][0][0] == stop_index:
+                (_, target), duration = footpaths[i]
+                targets.append(target)
+                times.append(duration)
+                i += 1
+            offsets.append(len(targets))
+        return cls(offsets, targets, times)
+
+
+def build_timetable(stop_list: List[Stop], route_list: List[Route], stop_dict: Dict[str, Stop] = None,
+                    calendar: ServiceCalendar = None, footpaths: TransferGraph = None) -> Timetable:
+    """Function to precompute every lookup table used by RAPTOR. To be called once, after the GTFS data is loaded.
+        CAUTION: stop_index_list needs to be constructed for every route beforehand !!"""
+    if stop_dict is None:
+        stop_dict = {stop.id: stop for stop in stop_list}
+
+    map_index(stop_list)
+    map_index(route_list)
+
+    for route in route_list:
+        route.build_columns()
+
+    stop_route_ranks = [[] for _ in range(len(stop_list))]
+    for route in route_list:
+        for rank, stop_index in enumerate(route.stop_index_list):
+            stop_route_ranks[stop_index].append((route.index_in_list, rank))
+
+    return Timetable(stop_list, route_list, stop_dict, stop_route_ranks,
+                     calendar=calendar, footpaths=footpaths)
+
+
+DAY_VIEW_CACHE_SIZE = 7 # number of days kept in the cache of each timetable
+# Guards the day views and service windows cached on the timetables: searches run on several threads when there is no process pool.
+# Reentrant, as service_window() builds its day views while holding it. A view is built once, by the first search asking for it
+_day_views_lock = threading.RLock()
+
+
+def timetable_for_day(timetable: Timetable, day: date) -> Timetable:
+    """View of the timetable restricted to the trips running on the given day, to be used by RAPTOR instead of the full timetable.
+        Stops and lookup tables are shared with the full timetable: only the routes are filtered, and a route whose trips all run that day is not copied.
+        Routes keep their index, even with no trip left, so the stop -> route index stays valid. Views are cached per day."""
+    if timetable.calendar is None:
+        return timetable
+
+    with _day_views_lock:
+        return _timetable_for_day(timetable, day)
+
+
+def _timetable_for_day(timetable: Timetable, day: date) -> Timetable:
+    if timetable.day_views is None:
+        timetable.day_views = OrderedDict()
+
+    view = timetable.day_views.get(day)
+    if view is not None:
+        timetable.day_views.move_to_end(day)
+        return view
+
+    active = timetable.calendar.active_services(day)
+    route_list = []
+    for route in timetable.route_list:
+        positions = [i for i, service in enumerate(route.trip_services) if active[service]]
+        route_list.append(route if len(positions) == len(route.trip_ids) else route.filter_trips(positions))
+
+    view = Timetable(timetable.stop_list, route_list, timetable.stop_dict, timetable.stop_route_ranks,
+                     timetable.version, timetable.buffer, timetable.calendar, day,
+                     footpaths=timetable.footpaths, snapshot_path=timetable.snapshot_path)
+
+    timetable.day_views[day] = view
+    if len(timetable.day_views) > DAY_VIEW_CACHE_SIZE:
+        timetable.day_views.popitem(last=False)
+
+    return view
+
+
+DAY = 24 * 3600 # in seconds
+
+
+def shift_route(route: Route, index_in_list: int, time_offset: int) -> Route:
+    """View of a route on another service day: the columns are shared with the route, only its index and time offset change."""
+    return Route(route.id, route.stop_list, route.stop_index_list, index_in_list, None,
+                 route.departure_columns, route.arrival_columns, route.no_pickup, route.no_drop_off,
+                 route.trip_ids, route.trip_services, time_offset)
+
+
+class ServiceWindowIndex:
+    """Stop -> [(route index, rank), ...] index of a service window, computed on the fly from the index of the timetable.
+        With n routes, the routes of the day keep their index, the previous day views are numbered from n and the next day views from 2n.
+        Only the previous day routes running past midnight are listed: the others can not be boarded on the current day."""
+
+    def __init__(self, stop_route_ranks: Sequence[List[Tuple[int, int]]], num_routes: int, overnight_routes: FrozenSet[int]):
+        self.stop_route_ranks = stop_route_ranks
+        self.num_routes = num_routes
+        self.overnight_routes = overnight_routes
+
+    def __len__(self) -> int:
+        return len(self.stop_route_ranks)
+
+    def __getitem__(self, stop_index: int) -> List[Tuple[int, int]]:
+        pairs = list(self.stop_route_ranks[stop_index])
+        n = self.num_routes
+        previous_day = [(route_index + n, rank) for route_index, rank in pairs if route_index in self.overnight_routes]
+        next_day = [(route_index + 2 * n, rank) for route_index, rank in pairs]
+        return pairs + previous_day + next_day
+
+
+def service_window(timetable: Timetable, day: date) -> Timetable:
+    """View of the previous, current and next service days of the timetable on a single time axis, in seconds from midnight of the given day.
+        Trips of the previous day are shifted by -24h (a trip leaving at 25:10:00 the day before can be caught at 01:10),
+        and trips of the next day by +24h, so that a search late in the evening carries on the next morning.
+        No column is copied: the day views of the three days are shared through shift_route(). The window is cached on the day view."""
+    with _day_views_lock:
+        return _service_window(timetable, day)
+
+
+def _service_window(timetable: Timetable, day: date) -> Timetable:
+    current = timetable_for_day(timetable, day)
+    if current.window is not None:
+        return current.window
+
+    previous = timetable_for_day(timetable, day - timedelta(days=1))
+    following = timetable_for_day(timetable, day + timedelta(days=1))
+    n = len(current.route_list)
+
+    # With FIFO routes, the last arrival of a route is the last value of its last arrival column
+    overnight_routes = frozenset(route.index_in_list for route in previous.route_list
+                                 if route.trip_ids and route.arrival_columns[-1][-1] >= DAY)
+
+    route_list = (current.route_list
+                  + [shift_route(route, route.index_in_list + n, -DAY) for route in previous.route_list]
+                  + [shift_route(route, route.index_in_list + 2 * n, DAY) for route in following.route_list])
+
+    current.window = Timetable(current.stop_list, route_list, current.stop_dict,
+                               stop_route_ranks=ServiceWindowIndex(current.stop_route_ranks, n, overnight_routes),
+                               version=current.version, buffer=current.buffer, calendar=current.calendar, day=day,
+                               footpaths=current.footpaths, snapshot_path=current.snapshot_path)
+    return current.window
+
+
+NO_PARENT = -1 # Value of the parent buffers for labels that were not reached by a trip
+
+
+class Labels:
+    """Labels computed by RAPTOR, stored in flat typed buffers rather than in matrices of Python objects.
+        The label of a stop at a given round is at index: stop_index * (max_rounds + 1) + round.
+        The buffers are allocated once and can be reset in place between two queries."""
+
+    def __init__(self, num_stops: int, max_rounds: int):
+        self.num_stops = num_stops
+        self.max_rounds = max_rounds
+        self.width = max_rounds + 1 # number of labels per stop (round 0 included)
+        size = num_stops * self.width
+
+        self.arrival = array('i', [UNREACHED]) * size # τk(p) in the paper, in seconds
+        self.best = array('i', [UNREACHED]) * num_stops # τ*(p)
+
+        # Parent of each label, to backtrack the path: the trip taken (route index, position of the trip in the route) and the rank where it was boarded
+        self.route = array('i', [NO_PARENT]) * size
+        self.trip = array('i', [NO_PARENT]) * size
+        self.board_rank = array('i', [NO_PARENT]) * size
+        # Stop a label was reached from by walking, if its best arrival at this round is a footpath.
+        # The trip parent of the label is kept apart: the walks of a stop start from the arrival of its trip, not from another walk
+        self.walk_from = array('i', [NO_PARENT]) * size
+        # Arrival of the trip parent. It is compared to the other trips only: a trip arriving after a walk is still walked from,
+        # as the footpaths are not chained and the walk may not reach the same stops
+        self.trip_arrival = array('i', [UNREACHED]) * size
+
+        self._blank_times = array('i', self.arrival)
+        self._blank_best = array('i', self.best)
+        self._blank_parents = array('i', self.route)
+
+    def reset(self):
+        """Resets every label in place, without any new allocation."""
+        self.arrival[:] = self._blank_times
+        self.best[:] = self._blank_best
+        self.route[:] = self._blank_parents
+        self.trip[:] = self._blank_parents
+        self.board_rank[:] = self._blank_parents
+        self.walk_from[:] = self._blank_parents
+        self.trip_arrival[:] = self._blank_times
+
+    def rounds(self, stop_index: int) -> array:
+        """Arrival times at a stop for every round (copy of the row of τ for this stop)."""
+        start = stop_index * self.width
+        return self.arrival[start:start + self.width]
+
+
+class RaptorStats:
+    """Counters of the RAPTOR scans it is passed to, by round, summed over every scan (each departure of a range query is one scan).
+        Round 0 is the walk from the source. The counters of round k are:
+            - marked_stops: stops improved at the previous round, whose routes are scanned
+            - routes: routes queued
+            - stop_visits: stops traversed along these routes
+            - trip_probes: searches of the earliest trip catchable at a stop (earliest_trip_at_stop)
+            - improved_labels: labels of the round improved by a trip (a label improved by several trips counts once), or by a footpath
+            - route_time, footpath_time: wall time of the two phases of the round, in seconds
+        Counting only costs a few operations per round, except for the probes, which go through a counting function.
+        Without stats, the scans only test it once per round."""
+    COUNTERS = ('marked_stops', 'routes', 'stop_visits', 'trip_probes', 'improved_labels', 'route_time', 'footpath_time')
+
+    def __init__(self):
+        self.scans = 0
+        self.rounds: List[Dict[str, float]] = [] # round k -> {counter: value}
+
+    def record(self, k: int, **counters):
+        while len(self.rounds) <= k:
+            self.rounds.append(dict.fromkeys(self.COUNTERS, 0))
+        for name, value in counters.items():
+            self.rounds[k][name] += value
+
+    def merge(self, other: RaptorStats):
+        self.scans += other.scans
+        for k, counters in enumerate(other.rounds):
+            self.record(k, **counters)
+
+    def totals(self) -> Dict[str, float]:
+        return {name: sum(counters[name] for counters in self.rounds) for name in self.COUNTERS}
+
+    def as_dict(self) -> Dict:
+        """JSON-ready counters, with the times in milliseconds."""
+        def readable(counters):
+            return {name: round(value * 1000, 3) if name.endswith('_time') else value for name, value in counters.items()}
+        return {"scans": self.scans,
+                "totals": readable(self.totals()),
+                "rounds": [readable(counters) for counters in self.rounds]}
@@ -0,0 +1,163 @@
+####################################################################
+### Travel time matrices between many stations, across processes ###
+####################################################################
+
+import argparse
+import gc
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import List, Optional, Sequence, Tuple
+
+from .data_structure import Timetable, Labels, UNREACHED, service_window
+from .raptor import RAPTOR
+from .snapshot import load_timetable
+
+NO_PATH = -1 # travel time of the pairs with no path
+
+# State of a worker process. The timetable is set by the parent before the pool is created, and inherited through fork:
+# the memory-mapped snapshot and the Python objects are shared with the parent (copy-on-write), nothing is reloaded nor pickled
+_timetable: Timetable = None
+_task: Tuple = None # (targets, departure_times, max_rounds, max_duration), same for every source
+_labels: Labels = None # reused by every RAPTOR of the worker
+
+
+def source_row(timetable: Timetable, source_index: int, targets: Sequence[int], departure_times: Sequence[int],
+               max_rounds: int = 5, max_duration: Optional[int] = None, labels: Optional[Labels] = None) -> array:
+    """Travel times from a source to every target, with a single RAPTOR without target per departure time (not one per pair).
+        'max_duration' (in seconds) stops the search once it is exceeded: the farther targets have NO_PATH.
+        Output: int32 travel times in seconds, departure time by departure time (len(departure_times) * len(targets) values)."""
+    source = timetable.stop_list[source_index]
+    row = array('i')
+
+    for departure_time in departure_times:
+        end_time = departure_time + max_duration if max_duration is not None else None
+        labels = RAPTOR(source, source, departure_time, timetable, max_rounds=max_rounds, labels=labels, end_time=end_time)
+        best = labels.best
+        row.extend(best[target] - departure_time if best[target] != UNREACHED else NO_PATH for target in targets)
+
+    return row
+
+
+def _init_worker(task: Tuple):
+    global _task
+    _task = task
+
+
+def _compute_row(source_index: int) -> array:
+    global _labels
+    targets, departure_times, max_rounds, max_duration = _task
+    if _labels is None:
+        _labels = Labels(len(_timetable.stop_list), max_rounds)
+    return source_row(_timetable, source_index, targets, departure_times, max_rounds, max_duration, _labels)
+
+
+def travel_time_matrix(timetable: Timetable, sources: Sequence[int], targets: Sequence[int], departure_times: Sequence[int],
+                       max_rounds: int = 5, max_duration: Optional[int] = None, workers: Optional[int] = None) -> array:
+    """Batch computation of the travel times from every source to every target (stop indices), for every departure time.
+        The sources are spread across a pool of 'workers' processes (one per CPU by default), each one running the RAPTOR of a source.
+        Workers are forked from the current process, so they share the read-only timetable instead of loading or receiving a copy of it:
+        the only data sent back is the row of each source. Without fork (Windows), the sources are processed in this process.
+
+        Output: int32 travel times in seconds (NO_PATH if unreachable), flattened in (departure time, source, target) order."""
+    global _timetable, _labels
+
+    task = (array('i', targets), array('i', departure_times), max_rounds, max_duration)
+    num_targets = len(targets)
+    matrix = array('i', [NO_PATH]) * (len(departure_times) * len(sources) * num_targets)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        _init_worker(task)
+        _timetable = timetable
+        rows = map(_compute_row, sources)
+        executor = None
+    else:
+        _timetable = timetable
+        gc.freeze() # Objects created before the fork are left alone by the garbage collector of the workers, so their pages stay shared
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"), initializer=_init_worker, initargs=(task,))
+        rows = executor.map(_compute_row, sources, chunksize=max(1, len(sources) // (4 * workers)))
+
+    try:
+        for i, row in enumerate(rows):
+            for t in range(len(departure_times)):
+                start = (t * len(sources) + i) * num_targets
+                matrix[start:start + num_targets] = row[t * num_targets:(t + 1) * num_targets]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+            gc.unfreeze()
+        _timetable = _labels = None
+
+    return matrix
+
+
+def write_npy(file_path: str, data: array, shape: Tuple[int, ...]):
+    """Writes a typed array to a NumPy .npy file (format 1.0), without depending on NumPy: np.load(file_path) reads it back."""
+    kind = 'f' if data.typecode in 'fd' else 'u' if data.typecode.isupper() else 'i'
+    descr = f"<{kind}{data.itemsize}"
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': {tuple(shape)!r}, }}"
+    header += " " * (-(len(header) + 11) % 64) + "\n" # The data starts at a multiple of 64 bytes
+
+    if sys.byteorder == "big":
+        data = array(data.typecode, data)
+        data.byteswap()
+
+    with open(file_path, "wb") as f:
+        f.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1"))
+        data.tofile(f)
+
+
+def read_stations(file_path: str, timetable: Timetable) -> List[int]:
+    """Reads a list of stations, one stop_id or station name per line, and outputs their indices."""
+    name_to_index = {stop.name: stop.index_in_list for stop in timetable.stop_list}
+    indices = []
+    with open(file_path, mode='r', encoding='utf-8') as f:
+        for line in f:
+            station = line.strip()
+            if not station:
+                continue
+            if station in timetable.stop_dict:
+                indices.append(timetable.stop_dict[station].index_in_list)
+            elif station in name_to_index:
+                indices.append(name_to_index[station])
+            else:
+                raise ValueError(f"Unknown station: {station}")
+    return indices
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Travel time matrix between stations, written to a .npy file of shape "
+                                                 "(departure times, stations, stations), in seconds (-1 if no path).")
+    parser.add_argument("stations", help="text file with one stop_id or station name per line (order of the matrix)")
+    parser.add_argument("output", help=".npy file to write")
+    parser.add_argument("--gtfs-dir", default=os.path.dirname(__file__) + "/../gtfs_sncf")
+    parser.add_argument("--date", default=date.today().isoformat(), help="day of the departures (YYYY-MM-DD)")
+    parser.add_argument("--times", nargs="+", default=["08:00"], help="departure times (HH:MM)")
+    parser.add_argument("--rounds", type=int, default=5, help="maximum number of trips")
+    parser.add_argument("--max-duration", type=float, default=None, help="in hours, longer travels are not searched")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (one per CPU by default)")
+    args = parser.parse_args(argv)
+
+    timetable = load_timetable(args.gtfs_dir)
+    day = date.fromisoformat(args.date)
+    window = service_window(timetable, day)
+    stations = read_stations(args.stations, timetable)
+    departure_times = [hour * 3600 + minute * 60 for hour, minute in (map(int, t.split(":")) for t in args.times)]
+    max_duration = int(args.max_duration * 3600) if args.max_duration is not None else None
+
+    start = time.perf_counter()
+    matrix = travel_time_matrix(window, stations, stations, departure_times, args.rounds, max_duration, args.workers)
+    elapsed = time.perf_counter() - start
+
+    write_npy(args.output, matrix, (len(departure_times), len(stations), len(stations)))
+    print(f"{len(departure_times)} x {len(stations)} x {len(stations)} travel times computed in {elapsed:.1f}s "
+          f"({len(departure_times) * len(stations) / elapsed:.1f} RAPTOR/s), written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
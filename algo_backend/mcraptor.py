@@ -0,0 +1,378 @@
+#######################################################################
+### Multi-criteria RAPTOR (McRAPTOR), keeping Pareto bags of labels ###
+### Section 4 of the article: https://www.microsoft.com/en-us/research/wp-content/uploads/2012/01/raptor_alenex.pdf
+#######################################################################
+
+from algo_backend.data_structure import Stop, Route, Timetable, NO_PARENT, UNREACHED
+from algo_backend.raptor import earliest_trip_at_stop, collect_routes
+from algo_backend.postprocessing import TRAIN_TYPES, train_type
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+class Criterion:
+    """Criterion optimized by McRAPTOR besides the arrival time and the number of trips (one per round).
+        Values are integers: set to 'initial' at the source, then updated by every trip boarded and every footpath walked.
+        CAUTION: a value must never get better along a journey, otherwise the pruning would discard optimal journeys."""
+    name = None
+    initial = 0
+
+    def board(self, value: int, route: Route, trip: int) -> int:
+        """Value after boarding the trip at this position of the route.
+            It may only depend on the kind of train of the trip: McRAPTOR boards the earliest trip of each kind only (see boardable_trips)."""
+        return value
+
+    def walk(self, value: int, duration: int) -> int:
+        """Value after walking 'duration' seconds."""
+        return value
+
+    def dominates(self, a: int, b: int) -> bool:
+        """Whether a is at least as good as b. Smaller is better by default."""
+        return a <= b
+
+    def describe(self, value: int):
+        """Value returned along with the journeys."""
+        return value
+
+
+@lru_cache(maxsize=1 << 17)
+def train_type_bit(trip_id: str) -> int:
+    """Bit of the kind of train of a trip in the masks of TrainTypes. Cached: a trip id is parsed only once."""
+    return 1 << TRAIN_TYPES.index(train_type(trip_id))
+
+
+def train_types_mask(train_types: Iterable[str]) -> int:
+    """Helper converting kinds of trains (see postprocessing.TRAIN_TYPES) to a bitmask."""
+    return sum(1 << TRAIN_TYPES.index(kind) for kind in set(train_types))
+
+
+class TrainTypes(Criterion):
+    """Kinds of trains taken (see postprocessing.train_type), stored as a bitmask.
+        A journey is only dominated by journeys taking a subset of its kinds of trains:
+        a slower journey avoiding the OUIGO is kept along with a faster one taking it."""
+    name = "train_types"
+
+    def board(self, value: int, route: Route, trip: int) -> int:
+        return value | train_type_bit(route.trip_ids[trip])
+
+    def dominates(self, a: int, b: int) -> bool:
+        return a & ~b == 0
+
+    def describe(self, value: int) -> List[str]:
+        return [kind for i, kind in enumerate(TRAIN_TYPES) if value >> i & 1]
+
+
+class WalkingTime(Criterion):
+    """Total time walked between stations, in seconds (only relevant if the timetable has footpaths)."""
+    name = "walking_time"
+
+    def walk(self, value: int, duration: int) -> int:
+        return value + duration
+
+
+class Bags:
+    """Labels of McRAPTOR. Each label is stored once, at the index it gets when created: its stop, arrival time and parent
+        (the label it was reached from, with the trip taken: route index, position of the trip, rank where it was boarded,
+        or NO_PARENT as route for a footpath) in flat typed buffers, and its criteria values in a tuple.
+        Bags only hold label indices:
+            - round_bags[k][stop]: Pareto set of the labels of the stop at round k
+            - best[stop]: Pareto set of the labels of the stop at every round so far (B* in the paper), used for pruning
+        Target pruning compares labels to the bound of their values: the earliest arrival at the target with values at least as good.
+        Criteria values take few distinct values, so the bounds are cached until the target gets a new label."""
+
+    def __init__(self, criteria: Sequence[Criterion], max_rounds: int, target_index: int):
+        self.criteria = criteria
+        self.checks = [criterion.dominates for criterion in criteria]
+        self.target_index = target_index
+        self.target_bounds: Dict[Tuple[int, ...], int] = {}
+
+        self.stop = array('i')
+        self.arrival = array('i')
+        self.values: List[Tuple[int, ...]] = []
+        self.parent = array('i')
+        self.route = array('i')
+        self.trip = array('i')
+        self.board_rank = array('i')
+
+        self.round_bags: List[Dict[int, List[int]]] = [{} for _ in range(max_rounds + 1)]
+        self.best: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.arrival)
+
+    def values_dominate(self, a: Tuple[int, ...], b: Tuple[int, ...]) -> bool:
+        """Whether the criteria values a are at least as good as b."""
+        for check, value_a, value_b in zip(self.checks, a, b):
+            if not check(value_a, value_b):
+                return False
+        return True
+
+    def dominated(self, arrival: int, values: Tuple[int, ...], labels: Iterable[int], trips_only: bool = False) -> bool:
+        """Whether one of the labels (the ones not reached by a footpath, if 'trips_only') is at least as good as (arrival, values) on every criterion."""
+        arrivals = self.arrival
+        label_values = self.values
+        for label in labels:
+            if arrivals[label] <= arrival and self.values_dominate(label_values[label], values) and not (trips_only and self.walked(label)):
+                return True
+        return False
+
+    def target_bound(self, values: Tuple[int, ...]) -> int:
+        """Earliest arrival at the target with criteria values at least as good (UNREACHED if none): a label arriving later is dominated."""
+        bound = self.target_bounds.get(values)
+        if bound is None:
+            bound = min((self.arrival[label] for label in self.best.get(self.target_index, ()) if self.values_dominate(self.values[label], values)),
+                        default=UNREACHED)
+            self.target_bounds[values] = bound
+        return bound
+
+    def merge(self, k: int, stop_index: int, arrival: int, values: Tuple[int, ...],
+              parent: int, route_index: int, trip: int, board_rank: int) -> bool:
+        """Adds a label to the bag of the stop at round k, unless it is dominated by a label of the stop (local pruning)
+            or of the target (target pruning). The labels it dominates are removed from the bags.
+            Away from the target, a label reached by a trip is only compared to the other trips: the footpaths are not chained,
+            so it is still walked from if a walk reaches the stop earlier (see raptor.scan_rounds).
+            Outputs whether the label was added."""
+        walks_apart = stop_index != self.target_index
+        walk = route_index == NO_PARENT and parent != NO_PARENT
+        best = self.best.get(stop_index)
+        if best is None:
+            best = self.best[stop_index] = []
+        elif self.dominated(arrival, values, best, trips_only=walks_apart and not walk):
+            return False
+        if stop_index == self.target_index:
+            self.target_bounds.clear()
+        elif arrival >= self.target_bound(values):
+            return False
+
+        label = len(self.arrival)
+        self.stop.append(stop_index)
+        self.arrival.append(arrival)
+        self.values.append(values)
+        self.parent.append(parent)
+        self.route.append(route_index)
+        self.trip.append(trip)
+        self.board_rank.append(board_rank)
+
+        bag = self.round_bags[k].setdefault(stop_index, [])
+        removed = {other for other in best if arrival <= self.arrival[other] and self.values_dominate(values, self.values[other])
+                   and not (walks_apart and walk and not self.walked(other))}
+        if removed:
+            best[:] = [other for other in best if other not in removed]
+            bag[:] = [other for other in bag if other not in removed]
+
+        best.append(label)
+        bag.append(label)
+        return True
+
+    def walked(self, label: int) -> bool:
+        """Whether the label was reached by a footpath."""
+        return self.route[label] == NO_PARENT and self.parent[label] != NO_PARENT
+
+
+def trips_by_train_type(route: Route, allowed_types: Optional[int]) -> List[array]:
+    """Positions of the trips of a route grouped by kind of train, in increasing order.
+        Only the kinds in the 'allowed_types' mask (if any) are kept."""
+    groups: Dict[int, array] = {}
+    for position, trip_id in enumerate(route.trip_ids):
+        kind = train_type_bit(trip_id)
+        if allowed_types is None or kind & allowed_types:
+            groups.setdefault(kind, array('i')).append(position)
+    return list(groups.values())
+
+
+def boardable_trips(route: Route, stop_rank: int, time_at_stop: int, trip_groups: List[array]) -> List[int]:
+    """Positions of the earliest trip of each kind of train that can be boarded at this rank from the given time, earliest first
+        (see raptor.earliest_trip_at_stop). With FIFO routes, a later trip of the same kind arrives later everywhere, with the same
+        criteria values (see Criterion.board): it is never needed. 'trip_groups' are the trips of each kind (see trips_by_train_type)."""
+    position = earliest_trip_at_stop(route, stop_rank, time_at_stop)
+    if position is None:
+        return []
+
+    no_pickup = route.no_pickup[stop_rank]
+    trips = []
+    for positions in trip_groups:
+        i = bisect_left(positions, position)
+        while i < len(positions) and positions[i] in no_pickup:
+            i += 1
+        if i < len(positions):
+            trips.append(positions[i])
+    trips.sort()
+    return trips
+
+
+def relax_footpaths(stops: Set[int], k: int, bags: Bags, timetable: Timetable) -> Set[int]:
+    """Footpath phase of round k: every label of the stops reached at this round is extended to the stops nearby.
+        As in raptor.relax_footpaths, footpaths are not chained. Outputs the stops that got a new label."""
+    footpaths = timetable.footpaths
+    criteria = bags.criteria
+    round_bag = bags.round_bags[k]
+    improved_stops = set()
+
+    # Labels are read before any update: a label added by a walk is not walked from
+    departures = [(stop_index, label) for stop_index in stops for label in round_bag.get(stop_index, ()) if not bags.walked(label)]
+
+    for stop_index, label in departures:
+        arrival_time = bags.arrival[label]
+        values = bags.values[label]
+
+        for target, duration in footpaths[stop_index]:
+            walk_values = tuple(criterion.walk(value, duration) for criterion, value in zip(criteria, values))
+            if bags.merge(k, target, arrival_time + duration, walk_values, label, NO_PARENT, NO_PARENT, NO_PARENT):
+                improved_stops.add(target)
+
+    return improved_stops
+
+
+def reconstruct_journey(bags: Bags, timetable: Timetable, label: int) -> List[Dict]:
+    """Sequence of segments leading to a label, in the format of raptor.reconstruct_path. Parents are followed up to the source."""
+    path = []
+
+    while bags.parent[label] != NO_PARENT:
+        parent = bags.parent[label]
+        route_index = bags.route[label]
+
+        if route_index == NO_PARENT: # Footpath
+            path.append({
+                "stop": bags.stop[label],
+                "route_id": None,
+                "trip_id": None,
+                "board_stop": bags.stop[parent],
+                "board_time": bags.arrival[parent],
+                "arrival_time": bags.arrival[label],
+            })
+        else:
+            route = timetable.route_list[route_index]
+            trip = bags.trip[label]
+            board_rank = bags.board_rank[label]
+            path.append({
+                "stop": bags.stop[label],
+                "route_id": route.id,
+                "trip_id": route.trip_ids[trip],
+                "board_stop": route.stop_index_list[board_rank],
+                "board_time": route.departure_columns[board_rank][trip] + route.time_offset,
+                "arrival_time": bags.arrival[label],
+            })
+
+        label = parent
+
+    path.reverse()
+    return path
+
+
+def McRAPTOR(source_stop: Stop, target_stop: Stop,
+             departure_time: int,
+             timetable: Timetable, max_rounds: int = 5,
+             criteria: Sequence[Criterion] = (TrainTypes(),),
+             train_types: Optional[Iterable[str]] = None) -> List[Dict]:
+    """Multi-criteria variant of RAPTOR: instead of a single arrival time, every stop keeps at each round a bag of labels
+        that are Pareto optimal for the arrival time and the additional 'criteria' (the round being the number of trips).
+        Target and local pruning compare whole labels: a label is discarded if the target or its stop already has a label as good on every criterion.
+
+        Input:
+            - source_stop, target_stop, departure_time, timetable, max_rounds: see raptor.RAPTOR
+            - criteria: The additional criteria (see Criterion). Default is the kinds of trains taken.
+            - train_types: If given, only the trains of these kinds (see postprocessing.TRAIN_TYPES) are boarded.
+                Ex: {"TER"} for TER only, or every kind but "OUIGO" to avoid them.
+
+        Output: The Pareto set of the journeys to the target, ordered by arrival time.
+            Each entry is a dictionnary with the departure and arrival times, the number of transfers,
+            the value of every criterion (by name) and the path itself (see raptor.reconstruct_path)."""
+
+    stop_list = timetable.stop_list
+    route_list = timetable.route_list
+    stop_route_ranks = timetable.stop_route_ranks
+    allowed_types = train_types_mask(train_types) if train_types is not None else None
+    route_trips: Dict[int, List[array]] = {} # trips of each route scanned, by kind of train (see trips_by_train_type)
+
+    ### Initialization
+    source_index = source_stop.index_in_list
+    target_index = target_stop.index_in_list
+    bags = Bags(criteria, max_rounds, target_index)
+    values_dominate = bags.values_dominate
+    bags.merge(0, source_index, departure_time, tuple(criterion.initial for criterion in criteria),
+               NO_PARENT, NO_PARENT, NO_PARENT, NO_PARENT)
+
+    marked_stops = {source_index}
+    if timetable.footpaths is not None:
+        marked_stops |= relax_footpaths(marked_stops, 0, bags, timetable)
+
+    ### Rounds
+    for k in range(1, max_rounds + 1):
+        previous_bags = bags.round_bags[k - 1]
+        route_queue = collect_routes(marked_stops, stop_route_ranks)
+        marked_stops = set()
+
+        for route_index, start_rank in route_queue.items():
+            route = route_list[route_index]
+            time_offset = route.time_offset
+            route_bag = [] # (position of the trip, rank where it was boarded, parent label, criteria values)
+
+            for rank in range(start_rank, len(route.stop_index_list)):
+                stop_index = route.stop_index_list[rank]
+
+                # Traversing the trips of the route bag: their arrivals are merged in the bag of the stop
+                if route_bag:
+                    arrival_column = route.arrival_columns[rank]
+                    no_drop_off = route.no_drop_off[rank]
+                    for trip, board_rank, parent, values in route_bag:
+                        if trip not in no_drop_off and bags.merge(k, stop_index, arrival_column[trip] + time_offset, values,
+                                                                  parent, route_index, trip, board_rank):
+                            marked_stops.add(stop_index)
+
+                # Boarding from the labels of the previous round. With FIFO routes, an earlier trip reaches every later stop earlier:
+                # a trip is dominated by an earlier (or the same) trip with criteria values at least as good.
+                # Later trips are still boarded when they give other values, that is for another kind of train
+                transfer_time = stop_list[stop_index].min_transfer_time if k > 1 else 0
+                departure_column = route.departure_columns[rank]
+                parents = previous_bags.get(stop_index, ())
+                trip_groups = route_trips.get(route_index)
+                if parents and trip_groups is None:
+                    trip_groups = route_trips[route_index] = trips_by_train_type(route, allowed_types)
+                for parent in parents:
+                    parent_values = bags.values[parent]
+                    time_at_stop = bags.arrival[parent] + transfer_time
+
+                    # Nothing to board if the target is already reached as well, or if the trips of the route bag are missed and as good
+                    target_bound = bags.target_bound(parent_values)
+                    if time_at_stop >= target_bound:
+                        continue
+                    if route_bag and any(departure_column[other_trip] + time_offset < time_at_stop and values_dominate(other_values, parent_values)
+                                         for other_trip, _, _, other_values in route_bag):
+                        continue
+
+                    for trip in boardable_trips(route, rank, time_at_stop, trip_groups):
+                        values = tuple(criterion.board(value, route, trip) for criterion, value in zip(criteria, parent_values))
+
+                        if not any(other_trip <= trip and values_dominate(other_values, values) for other_trip, _, _, other_values in route_bag):
+                            route_bag = [entry for entry in route_bag if not (trip <= entry[0] and values_dominate(values, entry[3]))]
+                            route_bag.append((trip, rank, parent, values))
+
+                        # No later trip can do better: it keeps the values of the parent, or it leaves after an arrival at the target as good
+                        if values == parent_values or departure_column[trip] + time_offset >= target_bound:
+                            break
+
+        # Footpath phase: walking from the stops reached at this round
+        if timetable.footpaths is not None:
+            marked_stops |= relax_footpaths(marked_stops, k, bags, timetable)
+
+        # Stopping criterion: no new label means no journey can be improved anymore
+        if not marked_stops:
+            break
+
+    ### Journeys: the bags of the target are Pareto sets, and a label of round k is not dominated by the labels with fewer trips
+    journeys = []
+    for k in range(1, max_rounds + 1):
+        for label in bags.round_bags[k].get(target_index, ()):
+            path = reconstruct_journey(bags, timetable, label)
+            journeys.append({
+                "departure_time": path[0]['board_time'],
+                "arrival_time": bags.arrival[label],
+                "transfers": sum(1 for segment in path if segment['trip_id'] is not None) - 1, # footpaths are not counted
+                "criteria": {criterion.name: criterion.describe(value) for criterion, value in zip(criteria, bags.values[label])},
+                "path": path
+            })
+
+    journeys.sort(key=lambda journey: (journey["arrival_time"], journey["transfers"]))
+    return journeys
@@ -2,9 +2,14 @@
 ### Small mock network to run the unit tests ###
 ################################################
 
-from algo_backend.data_structure import Route, Stop, Trip, map_index
+from algo_backend.data_structure import Route, Stop, Trip, TransferGraph, map_index, build_timetable
+from algo_backend.preprocessing import close_footpaths
 from typing import List, Dict
 
+def minutes(*times: int) -> List[int]:
+    """Times of the mock network are written in minutes for readability, and stored in seconds like the GTFS data."""
+    return [60 * time for time in times]
+
 def build_mock_data() -> Dict[str,List]:
     """
     Generates a small network in order to test the following cases:
@@ -27,14 +32,14 @@ def build_mock_data() -> Dict[str,List]:
 
     # ===== STOPS =====
     stops: List[Stop] = [
-        Stop(name="Stop A", id="A", lat=42.00, lon=42.00, min_transfer_time=2), # lat and lon don't matter here
-        Stop(name="Stop B", id="B", lat=42.00, lon=42.00, min_transfer_time=2), # 2 minutes transfer times
-        Stop(name="Stop C", id="C", lat=42.00, lon=42.00, min_transfer_time=2),
-        Stop(name="Stop D", id="D", lat=42.00, lon=42.00, min_transfer_time=2),
-        Stop(name="Stop E", id="E", lat=42.00, lon=42.00, min_transfer_time=2),
-        Stop(name="Stop F", id="F", lat=42.00, lon=42.00, min_transfer_time=2),
-        Stop(name="Stop G", id="G", lat=42.00, lon=42.00, min_transfer_time=2),
-        Stop(name="Stop H", id="H", lat=42.00, lon=42.00, min_transfer_time=2),        
+        Stop(name="Stop A", id="A", lat=42.00, lon=42.00, min_transfer_time=120), # lat and lon don't matter here
+        Stop(name="Stop B", id="B", lat=42.00, lon=42.00, min_transfer_time=120), # 2 minutes transfer times (in seconds)
+        Stop(name="Stop C", id="C", lat=42.00, lon=42.00, min_transfer_time=120),
+        Stop(name="Stop D", id="D", lat=42.00, lon=42.00, min_transfer_time=120),
+        Stop(name="Stop E", id="E", lat=42.00, lon=42.00, min_transfer_time=120),
+        Stop(name="Stop F", id="F", lat=42.00, lon=42.00, min_transfer_time=120),
+        Stop(name="Stop G", id="G", lat=42.00, lon=42.00, min_transfer_time=120),
+        Stop(name="Stop H", id="H", lat=42.00, lon=42.00, min_transfer_time=120),        
     ]
 
     map_index(stops)
@@ -55,15 +60,15 @@ def build_mock_data() -> Dict[str,List]:
     route1.add_trip(
         Trip(
             id="R1_T1",
-            departure_times=[10, 20, 30, 40],
-            arrival_times=[10, 20, 30, 40],
+            departure_times=minutes(10, 20, 30, 40),
+            arrival_times=minutes(10, 20, 30, 40),
         )
     )
     route1.add_trip(
         Trip(
             id="R1_T2",
-            departure_times=[20, 30, 40, 50],
-            arrival_times=[20, 30, 40, 50],
+            departure_times=minutes(20, 30, 40, 50),
+            arrival_times=minutes(20, 30, 40, 50),
         )
     )
 
@@ -83,16 +88,16 @@ def build_mock_data() -> Dict[str,List]:
     route2.add_trip(
         Trip(
             id="R2_T1",
-            departure_times=[10, 12, 14, 16],
-            arrival_times=[10, 12, 14, 16],
+            departure_times=minutes(10, 12, 14, 16),
+            arrival_times=minutes(10, 12, 14, 16),
         )
     )
 
     route2.add_trip(
         Trip(
             id="R2_T2",
-            departure_times=[12, 14, 16, 18],
-            arrival_times=[12, 14, 16, 18],
+            departure_times=minutes(12, 14, 16, 18),
+            arrival_times=minutes(12, 14, 16, 18),
         )
     )
 
@@ -112,8 +117,8 @@ def build_mock_data() -> Dict[str,List]:
     route3.add_trip(
         Trip(
             id="R3_T1",
-            departure_times=[10, 14, 18, 24],
-            arrival_times=[10, 14, 18, 24],
+            departure_times=minutes(10, 14, 18, 24),
+            arrival_times=minutes(10, 14, 18, 24),
         )
     )
 
@@ -123,5 +128,37 @@ def build_mock_data() -> Dict[str,List]:
 
     return {
         "stop_list": stops,
-        "route_list": routes
+        "route_list": routes,
+        "timetable": build_timetable(stops, routes)
+    }
+
+def build_walk_data() -> Dict[str,List]:
+    """
+    Generates a network where a trip must be followed by a walk, although the stop of the walk is reached earlier by another walk:
+    Route SA: S -> A, arriving at 9:40
+    Route SX: S -> X, arriving at 9:10
+    Route XB: X -> B, from 9:20 to 10:00
+    Footpaths: A <-> B and B <-> C, 10 minutes each. A -> C would take 20 minutes, more than the walks chained by the preprocessing.
+
+    B is reached at 9:50 by walking from A, but this walk does not go on to C: the only way to C is the trip to B, then the walk (10:10).
+    """
+    stops: List[Stop] = [Stop(name=f"Stop {id}", id=id, lat=42.00, lon=42.00, min_transfer_time=60) for id in "SAXBC"]
+    map_index(stops)
+    id_to_index = {s.id: s.index_in_list for s in stops}
+
+    routes = []
+    for stop_ids, times in [("SA", minutes(540, 580)), ("SX", minutes(540, 550)), ("XB", minutes(560, 600))]:
+        route = Route(id=stop_ids, stop_list=list(stop_ids), stop_index_list=[id_to_index[sid] for sid in stop_ids], trips=[])
+        route.add_trip(Trip(id=f"{stop_ids}_T1", departure_times=times, arrival_times=times))
+        routes.append(route)
+    map_index(routes)
+
+    timetable = build_timetable(stops, routes)
+    walks = {(id_to_index[a], id_to_index[b]): 600 for a, b in ["AB", "BA", "BC", "CB"]}
+    timetable.footpaths = TransferGraph.from_durations(len(stops), close_footpaths(walks, set()))
+
+    return {
+        "stop_list": stops,
+        "route_list": routes,
+        "timetable": timetable
     }
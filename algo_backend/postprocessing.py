@@ -40,6 +40,28 @@ def merge(left: List[List[Dict]], right: List[List[Dict]]) -> List[List[Dict]]:
     return result
 
 
+TRAIN_TYPES = ["TGV INOUI", "OUIGO", "TER", "Intercités", "TGV", "Train"] # every value train_type() can return
+
+
+def train_type(trip_id: str) -> str:
+    """
+    Extract the kind of train from complex GTFS ID
+    Ex: "OCESN863040F:TER:..." -> "TER"
+    """
+    if ":OUI:" in trip_id:
+        return "TGV INOUI"
+    elif ":OGO:" in trip_id:
+        return "OUIGO"
+    elif ":TER:" in trip_id:
+        return "TER"
+    elif ":COR:" in trip_id or ":IC:" in trip_id: 
+        return "Intercités"
+    elif "TGV" in trip_id: 
+        return "TGV"
+
+    return "Train"
+
+
 def extract_train_info(trip_id: str) -> str:
     """
     Extract the train type and train number from complex GTFS ID
@@ -53,23 +75,14 @@ def extract_train_info(trip_id: str) -> str:
     numero = match_num.group(1) if match_num else "Inconnu"
 
     # Extraction of the kind of train
-    
-    type_train = "Train"
-    
-    if ":OUI:" in trip_id:
-        type_train = "TGV INOUI"
-    elif ":OGO:" in trip_id:
-        type_train = "OUIGO"
-    elif ":TER:" in trip_id:
-        type_train = "TER"
-    elif ":COR:" in trip_id or ":IC:" in trip_id: 
-        type_train = "Intercités"
-    elif "TGV" in trip_id: 
-        type_train = "TGV"
+    type_train = train_type(trip_id)
 
     return f"{type_train} n°{numero}"
 
 
+WALK_NAME = "Marche à pied" # name of the footpath segments displayed by the frontend
+
+
 def jsonify_paths(paths: List[List[Dict]], stop_list: List[Stop]) -> List[Dict]:
     """Final formatting of the algrith results to be sent to the frontend.
     
@@ -77,7 +90,7 @@ def jsonify_paths(paths: List[List[Dict]], stop_list: List[Stop]) -> List[Dict]:
             A single list containing dictionnaries. One dictionnary = One particular path/itinerary found.
             Each path contains:
                 - Global information: departure and arrival times, first and last station...
-                - A list of 'segments'. Each segment represents a particular trip taken in the global itinerary, with additional metadata."""
+                - A list of 'segments'. Each segment represents a particular trip taken in the global itinerary (or a walk between two stations), with additional metadata."""
 
     final_list = []
 
@@ -100,24 +113,29 @@ def jsonify_paths(paths: List[List[Dict]], stop_list: List[Stop]) -> List[Dict]:
                 stop1 = stop_list[path[i].get('board_stop')]
                 stop2 = stop_list[path[i].get('stop')]
 
-                board_time = path[i].get('board_time')
-                arrival_time = path[i].get('arrival_time')
+                # RAPTOR works in seconds, the frontend expects minutes from midnight
+                board_time = path[i].get('board_time') / 60
+                arrival_time = path[i].get('arrival_time') / 60
 
                 trip = path[i].get('trip_id')
-                trip_name = extract_train_info(trip)
                 route = path[i].get('route_id')
 
-                if trip_name in duplicate_trains_check:
-                    valid = False
-                    continue
+                if trip is None: # Footpath between two stations
+                    trip_name = WALK_NAME
                 else:
-                    duplicate_trains_check.add(trip_name)
+                    trip_name = extract_train_info(trip)
+
+                    if trip_name in duplicate_trains_check:
+                        valid = False
+                        continue
+                    else:
+                        duplicate_trains_check.add(trip_name)
 
                 segments.append({
                     "from": stop1.name,
                     "to": stop2.name,
-                    "dep_coor": (float(stop1.lat), float(stop1.lon)),
-                    "arr_coor": (float(stop2.lat), float(stop2.lon)),
+                    "dep_coor": (stop1.lat, stop1.lon),
+                    "arr_coor": (stop2.lat, stop2.lon),
                     "board_time": board_time,
                     "arrival_time": arrival_time,
                     "trip": trip_name,
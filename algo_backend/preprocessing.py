@@ -3,55 +3,288 @@
 ##########################################################################
 
 import csv 
-from .data_structure import Stop, Route, Trip, map_index
-from typing import List, Dict, Tuple
-import os.path
+from array import array
+from .data_structure import Stop, Route, Trip, Timetable, ServiceCalendar, TransferGraph, map_index, build_timetable
+from .spatial import StopGrid, haversine
+from typing import List, Dict, Set, Tuple, Iterator, Optional
 from collections import defaultdict
+from datetime import date, timedelta
+import heapq
+import os.path
+import resource
+import time
 
-def group_stop_times_by_trip(file_path: str) -> Dict:
-    """Creates a dictionary for grouping temporarily every stop times to the same trip in GTFS data.
-        Structure : { trip_id: [ {data for stop n°1}, {data for stop n°2}, ... ] }"""
-    
-    trips_builder = defaultdict(list) # Using defaultdict to handle missing values
+def read_trips(file_path: str) -> Iterator[Tuple[str, List[str], array, array, Tuple[int, ...], Tuple[int, ...]]]:
+    """Streams stop_times.txt one trip at a time, without ever holding the whole file in memory.
+        CAUTION: Relies on the GTFS rows being grouped by trip_id, as in the SNCF export. A trip appearing twice in the file raises a ValueError.
+        Output: (trip_id, stop ids, arrival times, departure times, ranks with no pickup, ranks with no dropoff) for every trip, in file order"""
+
+    with open(file_path, mode='r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+
+        # Column indices, read once from the header instead of building a dict for every row
+        trip_col = header.index('trip_id')
+        stop_col = header.index('stop_id')
+        seq_col = header.index('stop_sequence')
+        arr_col = header.index('arrival_time')
+        dep_col = header.index('departure_time')
+        pickup_col = header.index('pickup_type') if 'pickup_type' in header else None # By default, we allow pickup/dropoff
+        dropoff_col = header.index('drop_off_type') if 'drop_off_type' in header else None
+
+        seen_trips = set()
+        current_trip = None
+        rows = [] # Rows of the current trip only
 
-    with open(file_path, mode='r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
         for row in reader:
-            trip_id = row['trip_id']
-            trips_builder[trip_id].append({
-                'stop_id': row['stop_id'],
-                'sequence': int(row['stop_sequence']), # The position of this particular stop in the global sequence
-                'arr': row['arrival_time'],
-                'dep': row['departure_time'],
-                'pickup': int(row.get('pickup_type', 0)), # By default, we allow pickup/dropoff 
-                'dropoff': int(row.get('drop_off_type', 0))
-            })
-        
-    for trip_id in trips_builder:
-        trips_builder[trip_id].sort(key=lambda x: x['sequence'])
-    
-    return trips_builder
+            trip_id = row[trip_col]
 
-def hms_to_minutes(hms_str: str) -> float:
+            if trip_id != current_trip:
+                if current_trip is not None:
+                    yield build_trip(current_trip, rows)
+                if trip_id in seen_trips:
+                    raise ValueError(f"{file_path} is not grouped by trip_id: rows of trip {trip_id} are not contiguous")
+                seen_trips.add(trip_id)
+                current_trip = trip_id
+                rows = []
+
+            rows.append((
+                int(row[seq_col]), # The position of this particular stop in the global sequence
+                row[stop_col],
+                row[arr_col],
+                row[dep_col],
+                int(row[pickup_col] or 0) if pickup_col is not None else 0,
+                int(row[dropoff_col] or 0) if dropoff_col is not None else 0
+            ))
+
+        if current_trip is not None:
+            yield build_trip(current_trip, rows)
+
+def build_trip(trip_id: str, rows: List[Tuple]) -> Tuple[str, List[str], array, array, Tuple[int, ...], Tuple[int, ...]]:
+    """Turns the stop_times rows of a single trip into compact arrays, ordered by stop_sequence."""
+    rows.sort(key=lambda x: x[0])
+
+    stop_ids = [row[1] for row in rows]
+
+    # Times are always stored, even when pickup/dropoff is forbidden: the columns used by RAPTOR must stay sorted
+    arr_times = array('i', (hms_to_seconds(row[2]) for row in rows))
+    dep_times = array('i', (hms_to_seconds(row[3]) for row in rows))
+
+    no_pickup = tuple(rank for rank, row in enumerate(rows) if row[4] != 0) # If pickup is not allowed, the trip can not be boarded at this stop
+    no_drop_off = tuple(rank for rank, row in enumerate(rows) if row[5] == 1) # if dropoff is not allowed, the trip never arrives at this stop
+
+    return trip_id, stop_ids, arr_times, dep_times, no_pickup, no_drop_off
+
+def hms_to_seconds(hms_str: str) -> int:
     """
-    Converts GTFS HH:MM:SS to minutes from midnight.
-    Example: "08:30:00" -> 510.0
+    Converts GTFS HH:MM:SS to seconds from midnight.
+    Example: "08:30:00" -> 30600
     """
     h, m, s = hms_str.split(':')
-    return int(h) * 60 + int(m) + int(s) / 60
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+def overtakes(trip: Trip, previous_trip: Trip) -> bool:
+    """Checks if a trip leaving after another one arrives or leaves before it at any stop of the route (e.g. a TGV overtaking an Intercités)."""
+    for rank in range(len(trip.departure_times)):
+        if trip.departure_times[rank] < previous_trip.departure_times[rank] or trip.arrival_times[rank] < previous_trip.arrival_times[rank]:
+            return True
+    return False
+
+
+def split_fifo_routes(route: Route) -> List[Route]:
+    """Splits a route into FIFO sub-routes, in which no trip overtakes another.
+        RAPTOR relies on this property: in each sub-route, the trips are in chronological order at EVERY stop, not only at the first one.
+        Each trip is greedily added to the first sub-route it does not overtake. Sub-routes keep the id and stops of the original route."""
+
+    # CAUTION: Sort trips in a route by chronological order. This is important for the algorithm.
+    route.trips.sort(key=lambda x: (x.departure_times[0], x.arrival_times))
+
+    sub_routes = []
+
+    for trip in route.trips:
+        for sub_route in sub_routes:
+            if not overtakes(trip, sub_route.trips[-1]):
+                sub_route.add_trip(trip)
+                break
+        else: # The trip overtakes the last trip of every sub-route: create a new one
+            sub_route = Route(route.id, route.stop_list, route.stop_index_list)
+            sub_route.add_trip(trip)
+            sub_routes.append(sub_route)
+
+    return sub_routes
+
+
+def gtfs_date(yyyymmdd: str) -> date:
+    """Converts a GTFS date to a date object. Example: "20251231" -> date(2025, 12, 31)"""
+    return date(int(yyyymmdd[:4]), int(yyyymmdd[4:6]), int(yyyymmdd[6:8]))
+
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+def load_calendar(gtfs_dir: str) -> Optional[ServiceCalendar]:
+    """Builds the days on which every service runs: weekly patterns from calendar.txt, then the exceptions of calendar_dates.txt
+        (exception_type 1 = service added on this date, 2 = service removed). Outputs None if the GTFS data has none of these files."""
+    calendar_path = f'{gtfs_dir}/calendar.txt'
+    dates_path = f'{gtfs_dir}/calendar_dates.txt'
+
+    weekly = [] # (service_id, weekdays, start, end)
+    exceptions = [] # (service_id, date, exception_type)
+
+    if os.path.exists(calendar_path):
+        with open(calendar_path, mode='r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                weekdays = [row[day] == '1' for day in WEEKDAYS]
+                weekly.append((row['service_id'], weekdays, gtfs_date(row['start_date']), gtfs_date(row['end_date'])))
+
+    if os.path.exists(dates_path):
+        with open(dates_path, mode='r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                exceptions.append((row['service_id'], gtfs_date(row['date']), int(row['exception_type'])))
+
+    if not weekly and not exceptions:
+        return None
 
+    start_date = min([start for _, _, start, _ in weekly] + [day for _, day, _ in exceptions])
+    end_date = max([end for _, _, _, end in weekly] + [day for _, day, _ in exceptions])
+    num_days = (end_date - start_date).days + 1
 
-def load_gtfs_data(gtfs_dir: str) -> Tuple[List[Stop], List[Route], Dict[str, Stop]]:
-    """Function to tranform GTFS data into lists of our RAPTOR custom objects
+    service_index = {}
+    days = []
+
+    def index_of(service_id: str) -> int:
+        if service_id not in service_index:
+            service_index[service_id] = len(days)
+            days.append(0)
+        return service_index[service_id]
+
+    for service_id, weekdays, start, end in weekly:
+        service = index_of(service_id)
+        for offset in range((start - start_date).days, (end - start_date).days + 1):
+            if weekdays[(start_date + timedelta(days=offset)).weekday()]:
+                days[service] |= 1 << offset
+
+    for service_id, day, exception_type in exceptions:
+        service = index_of(service_id)
+        offset = (day - start_date).days
+        if exception_type == 1:
+            days[service] |= 1 << offset
+        elif exception_type == 2:
+            days[service] &= ~(1 << offset)
+
+    return ServiceCalendar(start_date, num_days, list(service_index), days)
+
+
+MAX_WALKING_DISTANCE = 1000 # in meters, stations closer than this are linked by a footpath (e.g. Paris Gare de Lyon <-> Austerlitz)
+WALKING_SPEED = 4 / 3.6 # in meters per second (4 km/h), applied to the distance as the crow flies
+def walking_time(distance: float) -> int:
+    """Walking time in seconds for a distance in meters."""
+    return round(distance / WALKING_SPEED)
+MAX_CHAINED_WALKING_TIME = walking_time(MAX_WALKING_DISTANCE) # in seconds (15 min), longest walk through several stations kept by close_footpaths
+
+def nearby_stop_pairs(stop_list: List[Stop], max_distance: float) -> Iterator[Tuple[int, int, float]]:
+    """Every pair of stops (by index) closer than max_distance meters, with their distance. Each pair is output once."""
+    grid = StopGrid(stop_list)
+
+    for stop in stop_list:
+        for other, distance in grid.within(stop.lat, stop.lon, max_distance):
+            if other > stop.index_in_list:
+                yield stop.index_in_list, other, distance
+
+def build_footpaths(gtfs_dir: str, stop_list: List[Stop], stop_dict: Dict[str, Stop], parent_dict: Dict[str, str]) -> TransferGraph:
+    """Builds the walking transfers between stations:
+            - A footpath in both directions between every pair of stations closer than MAX_WALKING_DISTANCE, timed at WALKING_SPEED
+            - The transfers of transfers.txt, which take precedence: min_transfer_time is used when given, and transfer_type 3 forbids the transfer.
+            - The footpaths are then transitively closed (see close_footpaths).
+                A transfer from a station to itself sets the min_transfer_time of the station.
+                Transfers restricted to specific routes or trips are ignored: footpaths apply to every train."""
+    durations = {}
+    forbidden = set()
+
+    for stop1, stop2, distance in nearby_stop_pairs(stop_list, MAX_WALKING_DISTANCE):
+        durations[(stop1, stop2)] = durations[(stop2, stop1)] = walking_time(distance)
+
+    transfers_path = f'{gtfs_dir}/transfers.txt'
+    if os.path.exists(transfers_path):
+        with open(transfers_path, mode='r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row.get('from_route_id') or row.get('to_route_id') or row.get('from_trip_id') or row.get('to_trip_id'):
+                    continue
+
+                from_id = parent_dict.get(row['from_stop_id'], row['from_stop_id']) # Map each platform to its parent station
+                to_id = parent_dict.get(row['to_stop_id'], row['to_stop_id'])
+                if from_id not in stop_dict or to_id not in stop_dict:
+                    continue
+
+                from_stop, to_stop = stop_dict[from_id], stop_dict[to_id]
+                pair = (from_stop.index_in_list, to_stop.index_in_list)
+                min_transfer_time = row.get('min_transfer_time')
+
+                if from_stop is to_stop:
+                    if min_transfer_time:
+                        from_stop.min_transfer_time = int(min_transfer_time)
+                elif row.get('transfer_type') == '3': # Transfer not possible
+                    durations.pop(pair, None)
+                    forbidden.add(pair)
+                elif min_transfer_time:
+                    durations[pair] = int(min_transfer_time)
+                elif pair not in durations:
+                    distance = haversine(from_stop.lat, from_stop.lon, to_stop.lat, to_stop.lon)
+                    durations[pair] = walking_time(distance)
+
+    return TransferGraph.from_durations(len(stop_list), close_footpaths(durations, forbidden))
+
+
+def close_footpaths(durations: Dict[Tuple[int, int], int], forbidden: Set[Tuple[int, int]],
+                    max_duration: int = MAX_CHAINED_WALKING_TIME) -> Dict[Tuple[int, int], int]:
+    """Transitive closure of the footpaths, with the shortest walking time between every pair of connected stations.
+        RAPTOR relies on it: footpaths are never chained, so a walk through several stations must be a footpath of its own.
+        Walks through several stations are only kept up to 'max_duration' seconds, as the direct footpaths are (see MAX_WALKING_DISTANCE):
+        without limit, chains of nearby stations would link stations an hour of walking apart. The direct footpaths are all kept.
+        The closure is then not transitive: RAPTOR walks from the arrival of each trip even if the stop is reached earlier by a walk
+        (see data_structure.Labels.trip_arrival).
+        Computed with a Dijkstra from every station having a footpath. Forbidden transfers stay forbidden."""
+    neighbours = defaultdict(list)
+    for (from_stop, to_stop), duration in durations.items():
+        neighbours[from_stop].append((to_stop, duration))
+
+    closed = {}
+    for source in neighbours:
+        best = {source: 0}
+        queue = [(0, source)]
+        while queue:
+            duration, stop = heapq.heappop(queue)
+            if duration > best[stop]:
+                continue
+            for neighbour, walk in neighbours.get(stop, ()):
+                if stop != source and duration + walk > max_duration:
+                    continue
+                if duration + walk < best.get(neighbour, duration + walk + 1):
+                    best[neighbour] = duration + walk
+                    heapq.heappush(queue, (duration + walk, neighbour))
+
+        for stop, duration in best.items():
+            if stop != source and (source, stop) not in forbidden:
+                closed[(source, stop)] = duration
+
+    return closed
+
+
+def load_gtfs_data(gtfs_dir: str) -> Timetable:
+    """Function to tranform GTFS data into lists of our RAPTOR custom objects, bundled in a Timetable index
     
-        Output:
+        Output: A Timetable object holding:
             - stop_list: A list of every stop in the dataset, initialized as Stop() objects. Every stop knows its index in the list
             - route_list: A list of every predefined route in the Network. Every route knows its index
                 CAUTION 1: Here we have a more strict definition for a route than the SNCF data. A route = the exact same sequence of stops.
                 It means a same route in GTFS can generate multiple routes in the list due to it not marking every stop.
                 CAUTION 2: It is here that we create the crucial 'stop_index_list' for each route.
+                CAUTION 3: Routes are then split into FIFO sub-routes (no overtaking), see split_fifo_routes().
             
             - stop_dict: A useful dictionnary to map each stop_id to the full object in the list.
+            - The lookup tables precomputed once for RAPTOR (stop -> [(route, rank of the stop in the route), ...]).
+            - calendar: The days on which each service runs. Every trip knows the index of its service (see timetable_for_day()).
+            - footpaths: The walking transfers between nearby stations and from transfers.txt (see build_footpaths()).
                 """
 
     stop_dict = {}
@@ -64,8 +297,8 @@ def load_gtfs_data(gtfs_dir: str) -> Tuple[List[Stop], List[Route], Dict[str, St
 
             if row['location_type'] == '1': # If it is a station, create a stop point
                 name = row['stop_name']
-                lat = row['stop_lat']
-                lon = row['stop_lon']
+                lat = float(row['stop_lat'])
+                lon = float(row['stop_lon'])
                 id = row['stop_id']
 
                 stop_dict[id] = Stop(name,id,lat,lon)
@@ -76,77 +309,84 @@ def load_gtfs_data(gtfs_dir: str) -> Tuple[List[Stop], List[Route], Dict[str, St
     stop_list = [stop for stop in stop_dict.values()]
     map_index(stop_list)
 
-    # Build all trips and routes
-    trips_builder = group_stop_times_by_trip(f'{gtfs_dir}/stop_times.txt')
-    route_dict = {}
+    calendar = load_calendar(gtfs_dir)
+    service_index = {service_id: i for i, service_id in enumerate(calendar.service_ids)} if calendar else {}
+
+    # Route and service of every trip: trips.txt is small, stop_times.txt is then streamed trip by trip
+    trip_routes = {}
+    trip_services = {}
 
     with open(f'{gtfs_dir}/trips.txt', mode='r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
 
         for row in reader:
+            trip_routes[row['trip_id']] = row['route_id']
 
-            route_id = row['route_id']
-            trip_id = row['trip_id']
-
-            stop_id_list = []
-            stop_index_list = []
-            dep_times = []
-            arr_times = []
-
-            for seq in trips_builder[trip_id]:
+            if calendar is not None:
+                service_id = row['service_id']
+                if service_id not in service_index: # service missing from the calendar: the trip never runs
+                    service_index[service_id] = len(calendar.days)
+                    calendar.service_ids.append(service_id)
+                    calendar.days.append(0)
+                trip_services[row['trip_id']] = service_index[service_id]
 
-                stop_id = seq['stop_id']
+    # Build all trips and routes
+    route_dict = {}
+    row_count = 0
+    start_time = time.perf_counter()
 
-                if stop_id in parent_dict:
-                    stop_id = parent_dict[stop_id]
+    for trip_id, stop_id_list, arr_times, dep_times, no_pickup, no_drop_off in read_trips(f'{gtfs_dir}/stop_times.txt'):
 
-                stop_id_list.append(stop_id)
+        row_count += len(stop_id_list)
 
-                if seq['pickup'] == 0:
-                    time = hms_to_minutes(seq['dep'])
-                    dep_times.append(time)
-                else:
-                    dep_times.append(0) # If pickup is not allowed, set board time to midnight = impossible to board
+        if trip_id not in trip_routes: # stop times of a trip missing from trips.txt
+            continue
 
-                if seq['dropoff'] == 1:
-                    arr_times.append(float('inf'))
-                else:
-                    time = hms_to_minutes(seq['arr'])
-                    arr_times.append(time) # if dropoff is not allowed, set arrival_time to infty = never arrives
-            
-            for stop_id in stop_id_list:
+        # Map each platform to its parent station
+        stop_id_list = [parent_dict.get(stop_id, stop_id) for stop_id in stop_id_list]
+        
+        # A route = a specific sequence of stops, with the same pickup/dropoff restrictions. We check it using a tuple as a hashable signature.
+        # Splitting on restrictions too ensures the earliest trip of a route is always the best one for the following stops.
+        route_signature = (tuple(stop_id_list), no_pickup, no_drop_off)
+        trip = Trip(trip_id,arr_times,dep_times,no_pickup,no_drop_off,trip_services.get(trip_id, 0))
 
-                stop_index = stop_dict[stop_id].index_in_list
-                stop_index_list.append(stop_index)
-            
-            route_signature = tuple(stop_id_list) # A route = a specific sequence of stops. We check it using a tuple as a hashable signature.
-            trip = Trip(trip_id,arr_times,dep_times)
+        if route_signature not in route_dict: # Keep track of every created route to avoid duplicates
+            stop_index_list = [stop_dict[stop_id].index_in_list for stop_id in stop_id_list]
+            route = Route(trip_routes[trip_id], stop_id_list,stop_index_list)
+            route.add_trip(trip)
+            route_dict[route_signature] = route
 
-            if route_signature not in route_dict: # Keep track of every created route to avoid duplicates
-                route = Route(route_id, stop_id_list,stop_index_list)
-                route.add_trip(trip)
-                route_dict[route_signature] = route
+        else:
+            route = route_dict[route_signature]
+            route.add_trip(trip)
 
-            else:
-                route = route_dict[route_signature]
-                route.add_trip(trip)
+    elapsed = time.perf_counter() - start_time
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kilobytes on Linux
+    print(f"{row_count} stop times read in {elapsed:.1f}s ({row_count / max(elapsed, 1e-9):.0f} rows/s), peak RSS {peak_rss:.0f} MB")
 
     route_list = []
+    split_count = 0
 
-    # CAUTION: Sort trips in a route by chronological order. This is important for the algorithm.
     for route in route_dict.values():
-        route.trips.sort(key=lambda x: x.departure_times[0])
-        route_list.append(route)
+        sub_routes = split_fifo_routes(route)
+        if len(sub_routes) > 1:
+            split_count += 1
+        route_list.extend(sub_routes)
     
     map_index(route_list)
+
+    print(f"{split_count} routes out of {len(route_dict)} were split into FIFO sub-routes ({len(route_list)} routes in total)")
+            
+    footpaths = build_footpaths(gtfs_dir, stop_list, stop_dict, parent_dict)
+    print(f"{len(footpaths.targets)} footpaths between stations")
             
-    return stop_list, route_list, stop_dict
+    return build_timetable(stop_list, route_list, stop_dict, calendar, footpaths)
             
 
 if __name__ == "__main__":
     gtfs_dir = os.path.dirname(__file__) + "/../gtfs_sncf"
-    stop_list, route_list = load_gtfs_data(gtfs_dir)
+    timetable = load_gtfs_data(gtfs_dir)
 
-    print(stop_list[0])
-    print(route_list[0])
+    print(timetable.stop_list[0])
+    print(timetable.route_list[0])
     
\ No newline at end of file
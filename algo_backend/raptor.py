@@ -3,177 +3,370 @@
 ### Following this article: https://www.microsoft.com/en-us/research/wp-content/uploads/2012/01/raptor_alenex.pdf
 ##########################################################
 
-from algo_backend.data_structure import Stop, Route, Trip, map_stop_to_routes
-from typing import Dict, List, Optional, Tuple
+from algo_backend.data_structure import Stop, Route, Timetable, TransferGraph, Labels, RaptorStats, NO_PARENT, UNREACHED
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Set, Tuple
 
-def earliest_trip_at_stop(route: Route, stop_rank: int, time_at_stop: float) -> Optional[Trip]:
+def earliest_trip_at_stop(route: Route, stop_rank: int, time_at_stop: int, upper: Optional[int] = None) -> Optional[int]:
     """Helper to determine the first trip that can be caught for a given stop and in the route and a given time. (defined as 'et' in the paper)
-        As the trips are ordered by departure time, a simple linear scan is sufficient. 
-        Outputs None if no such trip is found."""
+        As routes are FIFO (no trip overtakes another), the departure column of each rank is sorted and a binary search is sufficient.
+        'upper' restricts the search to the trips before this position: once aboard a trip, only an earlier one can improve it.
+        'time_at_stop' is on the time axis of the query: the time offset of the route is removed before searching its column.
+        Outputs the position of the trip in the route, or None if no such trip is found."""
 
-    for trip in route.trips:
-        train_leave_time = trip.departure_times[stop_rank]
+    column = route.departure_columns[stop_rank]
+    if upper is None:
+        upper = len(column)
 
-        if time_at_stop <= train_leave_time:
-            return trip 
-        
-    return None
+    position = bisect_left(column, time_at_stop - route.time_offset, 0, upper)
 
-def check_earlier_stops(queue: List[Tuple[Route,Stop]], route: Route, stop: Stop) -> Optional[List[Tuple[Route,Stop]]]:
-    """Helper to check if there is an earlier stop already in the queue. Avoids scanning the same route two times."""
-    for i, (route_in_Q, stop_in_Q) in enumerate(queue):
-        if route_in_Q.id == route.id:
+    no_pickup = route.no_pickup[stop_rank]
+    while position in no_pickup: # Skip the trips that do not allow boarding at this stop
+        position += 1
+
+    if position < upper:
+        return position
 
-            if route.stop_list.index(stop.id) < route_in_Q.stop_list.index(stop_in_Q.id):
-                queue[i] = (route,stop)
-            return queue
-    
     return None
 
-def RAPTOR(source_stop: Stop, target_stop: Stop, 
-           departure_time: float, 
-           stop_list: List[Stop], route_list: List[Route], max_rounds: int = 5) -> Tuple[List[List[int]], List[int], List[List[Dict]]]:
-    """Main function implementing the basic RAPTOR algorithm as defined in the paper
-        
-        Input:
-            - source_stop: The Stop object representing our departure point
-            - target_stop: The Stop object representing our destination. Is useful for optimization and pruning.
-                NOTE: As we do not prune for the moment, the argument is useless. It was left for reference and potential future improvements.
-            - departure time: In minutes from midnight
-            - stop_list, route_list: list of every object built from the GTFS database
-                Construction of both lists is provided in the preprocessing.py script.
-            - max_rounds: Maximum number of tranfer between trains to consider. Default is 5 to allow long itineraries.
-        
-        Output:
-            - tau_matrix: A matrix storing the best time we can reach a specific stop (by its index) at a given round. 
-            - tau_star: A list of the absolute best time we can reach a specific stop across all rounds
-            - parent: a matrix containing dictionnaries storing useful info to bactrack where we came from for each stop and at each round
-            """
+def latest_trip_at_stop(route: Route, stop_rank: int, time_at_stop: int, lower: Optional[int] = None) -> Optional[int]:
+    """Mirror of earliest_trip_at_stop for arrive-by queries: the last trip of the route arriving at this rank by the given time.
+        The arrival columns are sorted as well, so a binary search is sufficient.
+        'lower' restricts the search to the trips after this position: once aboard a trip (backwards), only a later one can improve it.
+        Outputs the position of the trip in the route, or None if no such trip is found."""
 
-    ### First part: Initialization
-    num_stops = len(stop_list)
-    tau_matrix = [[float('inf')] * (max_rounds + 1) for _ in range(num_stops)] # represents τi for each stop in the paper
-    tau_star = [float('inf') for _ in range(num_stops)]
+    column = route.arrival_columns[stop_rank]
+    if lower is None:
+        lower = -1
 
-    tau_matrix[source_stop.index_in_list][0] = departure_time #τ0(ps) = τ
-    tau_star[source_stop.index_in_list] = departure_time
+    position = bisect_right(column, time_at_stop - route.time_offset, lower + 1) - 1
 
-    parent = [[None] * (max_rounds + 1) for _ in range(num_stops)] # Store parent stop/trip for each better stop in order to backtrack the path
-    parent[source_stop.index_in_list][0] = { # Initialize first stop
-    "prev_stop": None,
-    "route_id": None,
-    "route": None,
-    "trip_id": None,
-    "board_stop": None,
-    "board_time": None
-}
+    no_drop_off = route.no_drop_off[stop_rank]
+    while position in no_drop_off: # Skip the trips that can not be left at this stop
+        position -= 1
 
-    stops_to_routes = map_stop_to_routes(stop_list,route_list)
+    if position > lower:
+        return position
 
-    route_queue = list()
-    marked_stops = set()
+    return None
 
-    marked_stops.add(source_stop.index_in_list)
+def collect_routes(marked_stops: Set[int], stop_route_ranks: List[List[Tuple[int,int]]], backward: bool = False) -> Dict[int,int]:
+    """Helper to build the queue of routes to scan during a round.
+        Each route traversing a marked stop is stored only once, with the earliest rank at which it can be boarded
+        (the latest rank with 'backward', for arrive-by queries scanning the routes in reverse).
+        Thanks to the precomputed (route, rank) pairs, this is linear in the number of marked stops.
+        Structure : { route_index: earliest marked rank }"""
+    queue = {}
+
+    for stop_index in marked_stops:
+        for route_index, rank in stop_route_ranks[stop_index]:
+            if backward:
+                if rank > queue.get(route_index, -1):
+                    queue[route_index] = rank
+            elif rank < queue.get(route_index, rank + 1): # Only keep the earliest stop of the route. Avoids scanning the same route two times.
+                queue[route_index] = rank
+
+    return queue
+
+def relax_footpaths(stops: Set[int], k: int, labels: Labels, footpaths: TransferGraph,
+                    target_index: Optional[int], target_bound: int, slack: int, reuse_labels: bool) -> Tuple[Set[int], int]:
+    """Footpath phase of round k: from every stop reached by a trip at this round, the stops nearby are reached by walking.
+        Footpaths are not chained: only the stops reached by a trip (or the source, at round 0) are walked from,
+        at the time they were reached by this trip (see Labels.trip_arrival). The same pruning rules as the trips apply.
+        Outputs the stops improved by a footpath and the updated target bound."""
+    width = labels.width
+    tau = labels.arrival
+    tau_star = labels.best
+    walk_from = labels.walk_from
+    offsets, targets, durations = footpaths.offsets, footpaths.targets, footpaths.durations
+    improved_stops = set()
+
+    # Departure times are read before any update. Walks only change the labels, never the arrivals of the trips
+    departure_times = labels.trip_arrival if k > 0 else tau
+    departures = [(stop_index, departure_times[stop_index * width + k]) for stop_index in stops]
+
+    for stop_index, departure_time in departures:
+        for i in range(offsets[stop_index], offsets[stop_index + 1]):
+            target = targets[i]
+            label = target * width + k
+            arrival_time = departure_time + durations[i]
+
+            improved = arrival_time < target_bound and arrival_time < tau[label]
+
+            if improved and target != target_index and k > 0: # Local pruning, as for the trips
+                improved = arrival_time < (min(tau[label - k:label]) if reuse_labels else tau_star[target])
+
+            if improved:
+                tau[label] = arrival_time
+                tau_star[target] = min(arrival_time, tau_star[target])
+                walk_from[label] = stop_index
+                improved_stops.add(target)
+
+                if target == target_index:
+                    target_bound = min(target_bound, arrival_time + slack)
+
+    return improved_stops, target_bound
+
+def scan_rounds(marked_stops: Set[int], labels: Labels, timetable: Timetable,
+                target_index: Optional[int] = None, slack: int = 0, reuse_labels: bool = False,
+                end_time: Optional[int] = None, stats: Optional[RaptorStats] = None):
+    """Round-based part of RAPTOR, updating the labels in place from the stops marked at round 0.
+        'target_index' enables target pruning (None to explore the whole network).
+        'reuse_labels' must be set when the labels come from previous departures (range queries): they are kept as upper bounds,
+        and a path is compared to the paths with at most the same number of trips.
+        'end_time' prunes every stop reached after it, as the target does: the network is only explored up to this time.
+        'stats' collects the counters of each round, if given (see data_structure.RaptorStats)."""
+    stop_list = timetable.stop_list
+    route_list = timetable.route_list
+    stop_route_ranks = timetable.stop_route_ranks
+    footpaths = timetable.footpaths
+
+    # Local references to the label buffers. The label of stop p at round k is at index p * width + k
+    width = labels.width
+    tau = labels.arrival
+    tau_star = labels.best
+    parent_route = labels.route
+    parent_trip = labels.trip
+    parent_rank = labels.board_rank
+    walk_from = labels.walk_from
+    trip_arrival = labels.trip_arrival
+
+    time_limit = end_time + 1 if end_time is not None else UNREACHED # Arrivals must be strictly earlier than the bounds
+
+    # The probes are only counted with stats: the loop calls a local name, bound to a counting function in that case
+    find_trip = earliest_trip_at_stop
+    if stats is not None:
+        stats.scans += 1
+        probes = [0]
+        def find_trip(route, rank, time_at_stop, upper):
+            probes[0] += 1
+            return earliest_trip_at_stop(route, rank, time_at_stop, upper)
+
+    # Round 0: walking from the source to the stations nearby
+    if footpaths is not None:
+        phase_start = time.perf_counter() if stats is not None else 0
+        target_bound = min(tau[target_index * width] + slack, time_limit) if target_index is not None else time_limit
+        walked_stops, _ = relax_footpaths(marked_stops, 0, labels, footpaths, target_index, target_bound, slack, reuse_labels)
+        marked_stops = marked_stops | walked_stops
+        if stats is not None:
+            stats.record(0, improved_labels=len(walked_stops), footpath_time=time.perf_counter() - phase_start)
 
     ### Second part: round-based network scanning
-    for k in range(1, max_rounds + 1):
-
-        route_queue.clear()
-
-        current_marked = marked_stops.copy()
-        marked_stops.clear()
-
-        for stop_index in current_marked: # For each marked stop (i.e stops we could reach at the previous round), store all routes traversing it in a queue
-
-            stop = stop_list[stop_index]
-
-            for route_index in stops_to_routes[stop_index]:
-
-                route = route_list[route_index]
-                update_queue = check_earlier_stops(route_queue,route,stop)
-
-                if type(update_queue) == list:
-                    route_queue = update_queue
-                
-                else:
-                    route_queue.append((route,stop))
+    for k in range(1, labels.max_rounds + 1):
+
+        # τ*(pt) + slack, best arrival allowed at any stop when pruning. Only paths with at most k trips are relevant for this round
+        target_bound = min(min(tau[target_index * width:target_index * width + k + 1]) + slack, time_limit) if target_index is not None else time_limit
+
+        # For each marked stop (i.e stops we could reach at the previous round), store all routes traversing it in a queue
+        phase_start = time.perf_counter() if stats is not None else 0
+        route_queue = collect_routes(marked_stops, stop_route_ranks)
+        if stats is not None:
+            stats.record(k, marked_stops=len(marked_stops), routes=len(route_queue),
+                         stop_visits=sum(len(route_list[route_index].stop_index_list) - rank for route_index, rank in route_queue.items()))
+        marked_stops = set()
+        reached_stops = set() # stops with a better arrival of a trip at this round, walked from
         
         ### Third Part: propagation across all reachable routes
-        for route, first_stop in route_queue:
-                    current_trip = None
-                    board_stop_index = None
+        for route_index, start_rank in route_queue.items():
+                    route = route_list[route_index]
+                    departure_columns = route.departure_columns
+                    arrival_columns = route.arrival_columns
+                    time_offset = route.time_offset # Non-zero for the previous/next day views of a service window
+                    current_trip = None # position of the trip in the route
                     board_stop_rank = None
 
-                    start_rank = route.stop_list.index(first_stop.id)
                     for rank in range(start_rank, len(route.stop_index_list)):
                         stop_index = route.stop_index_list[rank]
+                        label = stop_index * width + k
                         
                         if current_trip is not None:    # Traversing the earlieast trip and storing the arrival times to every stop it allows us to reach
-                            arrival_time = current_trip.arrival_times[rank]
-
-                            if arrival_time < tau_star[stop_index]: # Did not include pruning suggested in the paper in order to potentially find more alternative paths.
-                                tau_matrix[stop_index][k] = arrival_time
-                                tau_star[stop_index] = arrival_time
+                            arrival_time = arrival_columns[rank][current_trip] + time_offset
+
+                            # Target pruning if enabled: we can not improve the target going through this stop
+                            reached = arrival_time < target_bound and arrival_time < trip_arrival[label] and current_trip not in route.no_drop_off[rank]
+                            improved = reached and arrival_time < tau[label]
+
+                            if improved and stop_index != target_index: # With pruning, alternative paths reaching the target within the slack are kept
+                                # Local pruning: the stop must be reached earlier than with fewer trips.
+                                # Reused labels can be set at later rounds, so only the first k rounds are compared (τ* is their minimum otherwise)
+                                improved = arrival_time < (min(tau[label - k:label]) if reuse_labels else tau_star[stop_index])
+
+                            if reached and not improved:
+                                # The stop is reached earlier, maybe by a walk, which does not go on to the stops nearby: the closure of the footpaths
+                                # is limited (see preprocessing.close_footpaths). The trip is still walked from if no trip with fewer rounds arrives earlier
+                                reached = footpaths is not None and stop_index != target_index and arrival_time < min(trip_arrival[label - k:label])
+
+                            if reached:
+                                # Storing info to backtrack the itinerary later. The trip parent may then arrive earlier than a label it did not improve
+                                # (never at the target): the paths read through this label take the earlier trip, and wait longer at the stop
+                                trip_arrival[label] = arrival_time
+                                parent_route[label] = route_index
+                                parent_trip[label] = current_trip
+                                parent_rank[label] = board_stop_rank
+                                reached_stops.add(stop_index)
+
+                            if improved:
+                                tau[label] = arrival_time
+                                tau_star[stop_index] = min(arrival_time, tau_star[stop_index])
+                                walk_from[label] = NO_PARENT # Reached by this trip rather than by walking
                                 marked_stops.add(stop_index)
-                                
-                                parent[stop_index][k] = { # Storing info to backtrack the itinerary later
-                                    "route_id": route.id,
-                                    "trip_id": current_trip.id,
-                                    "board_stop": board_stop_index,
-                                    "board_time": current_trip.departure_times[board_stop_rank],
-                                    "arrival_time": arrival_time
-                                }
+
+                                if stop_index == target_index:
+                                    target_bound = min(target_bound, arrival_time + slack)
 
                         transfer_time = stop_list[stop_index].min_transfer_time if k > 1 else 0
-                        prev_time = tau_matrix[stop_index][k-1] + transfer_time
+                        prev_time = tau[label - 1] + transfer_time
 
-                        if current_trip is None or prev_time <= current_trip.departure_times[rank]: # Checking if an earliest trip can be caught at the stops.
-                            et = earliest_trip_at_stop(route, rank, prev_time)
+                        if prev_time >= target_bound: # Boarding here can not improve the target
+                            continue
+
+                        if current_trip is None or prev_time <= departure_columns[rank][current_trip] + time_offset: # Checking if an earliest trip can be caught at the stops.
+                            et = find_trip(route, rank, prev_time, current_trip) # Only trips before the current one can improve it
                             if et is not None:
-                                if current_trip is None or et.arrival_times[rank] < current_trip.arrival_times[rank]:
-                                    current_trip = et
-                                    board_stop_index = stop_index
-                                    board_stop_rank = rank
+                                current_trip = et
+                                board_stop_rank = rank
+
+        if stats is not None:
+            phase_end = time.perf_counter()
+            stats.record(k, trip_probes=probes[0], improved_labels=len(marked_stops), route_time=phase_end - phase_start)
+            probes[0] = 0
+
+        # Footpath phase: walking from the stops reached at this round
+        if footpaths is not None:
+            walked_stops, target_bound = relax_footpaths(reached_stops, k, labels, footpaths, target_index, target_bound, slack, reuse_labels)
+            marked_stops |= walked_stops
+            if stats is not None:
+                stats.record(k, improved_labels=len(walked_stops), footpath_time=time.perf_counter() - phase_end)
 
         # Stopping criterion: If no stops could be reached, this is the end of the network.
         if not marked_stops:
             break
 
-    return tau_matrix, tau_star, parent
 
+def RAPTOR(source_stop: Stop, target_stop: Stop, 
+           departure_time: int, 
+           timetable: Timetable, max_rounds: int = 5,
+           pruning: bool = False, slack: int = 0,
+           labels: Optional[Labels] = None, end_time: Optional[int] = None,
+           stats: Optional[RaptorStats] = None) -> Labels:
+    """Main function implementing the basic RAPTOR algorithm as defined in the paper
+        
+        Input:
+            - source_stop: The Stop object representing our departure point
+            - target_stop: The Stop object representing our destination. Is useful for optimization and pruning.
+                NOTE: It is only used when pruning is enabled, otherwise the whole network is explored.
+            - departure time: In seconds from midnight
+            - timetable: The network index built once from the GTFS database (stops, routes, trips and lookup tables)
+                Its construction is provided in the preprocessing.py script.
+            - max_rounds: Maximum number of tranfer between trains to consider. Default is 5 to allow long itineraries.
+            - pruning: Enables the target pruning of the paper: a stop is not improved if we reach it later than the target.
+                It does not change the labels of the target, but avoids exploring the whole country for each query.
+            - slack: In seconds, only used with pruning. Paths reaching the target up to 'slack' seconds after the best one are still kept
+                (one per round), so that alternative itineraries can be found.
+            - labels: Optional Labels buffers (with the same max_rounds) from a previous query, reset in place instead of allocating new ones.
+            - end_time: Optional, in seconds. The stops reached after it are left unreached, and the network is only explored up to this time.
+            - stats: Optional RaptorStats (see data_structure.py) adding up the counters of each round. Nothing is counted without it.
+        
+        Output: A Labels object (see data_structure.py) storing in flat buffers:
+            - arrival: The best time we can reach a specific stop (by its index) at a given round (τ matrix in the paper). 
+            - best: The absolute best time we can reach a specific stop across all rounds (τ*)
+            - route, trip, board_rank: The trip taken to reach each stop at each round, to bactrack where we came from
+            - walk_from: The stop walked from, for the labels reached by a footpath (if the timetable has footpaths)
+            """
+
+    ### First part: Initialization
+    if labels is None:
+        labels = Labels(len(timetable.stop_list), max_rounds)
+    else:
+        labels.reset()
+
+    labels.arrival[source_stop.index_in_list * labels.width] = departure_time #τ0(ps) = τ
+    labels.best[source_stop.index_in_list] = departure_time
+
+    target_index = target_stop.index_in_list if pruning else None
+    scan_rounds({source_stop.index_in_list}, labels, timetable, target_index, slack, end_time=end_time, stats=stats)
+
+    return labels
 
-def reconstruct_path(parent: List[List[Dict]], tau_matrix: List[List[int]], target_idx: int, k_round: int) -> List[Dict]:
-    """Function tranforming the raw output from the 'parent' matrix constucted by RAPTOR into the actual sequence of trip taken to reach the target."""
+
+def walking_time(timetable: Timetable, from_stop: int, to_stop: int) -> int:
+    """Helper to read the duration of a footpath in the transfer graph."""
+    footpaths = timetable.footpaths
+    for i in range(footpaths.offsets[from_stop], footpaths.offsets[from_stop + 1]):
+        if footpaths.targets[i] == to_stop:
+            return footpaths.durations[i]
+    raise KeyError(f"No footpath from stop {from_stop} to stop {to_stop}")
+
+
+def reconstruct_path(labels: Labels, timetable: Timetable, target_idx: int, k_round: int) -> List[Dict]:
+    """Function tranforming the raw parent buffers constucted by RAPTOR into the actual sequence of trip taken to reach the target.
+        Footpaths are segments with no route_id nor trip_id. They do not count as a round."""
     path = []
     current_stop = target_idx
     
     k = k_round
+    walked = False # The stop was reached by walking: it is left by its trip parent, footpaths are not chained
+
+    while True: # Travering the rounds backwards
+
+        label = current_stop * labels.width + k
+
+        if not walked and labels.walk_from[label] != NO_PARENT: # Reached by walking from another stop at the same round
+            from_stop = labels.walk_from[label]
+            arrival_time = labels.arrival[label]
+            path.append({
+                "stop": current_stop,
+                "route_id": None,
+                "trip_id": None,
+                "board_stop": from_stop,
+                "board_time": arrival_time - walking_time(timetable, from_stop, current_stop),
+                "arrival_time": arrival_time,
+            })
+            current_stop = from_stop
+            walked = True
+            continue
 
-    while k > 0: # Travering the rounds backwards
+        walked = False
+        if k == 0:
+            break
 
-        label = parent[current_stop][k]
+        route_index = labels.route[label]
         
-        if label is None: # If no parent this round, maybe the trip could have been caught one round earlier
+        if route_index == NO_PARENT: # If no parent this round, maybe the trip could have been caught one round earlier
             k = k - 1
             continue
+
+        route = timetable.route_list[route_index]
+        trip = labels.trip[label]
+        board_rank = labels.board_rank[label]
+        board_stop = route.stop_index_list[board_rank]
+        # The label may hold a better arrival by walking: the arrival of the trip is read in its column, at the first rank of the stop after boarding
+        alight_rank = next(rank for rank in range(board_rank + 1, len(route.stop_index_list)) if route.stop_index_list[rank] == current_stop)
             
         path.append({
             "stop": current_stop,
-            "route_id": label["route_id"],
-            "trip_id": label["trip_id"],
-            "board_stop": label["board_stop"], # This is where the backtracking really happens.
-            "board_time": label['board_time'],
-            "arrival_time": tau_matrix[current_stop][k],
+            "route_id": route.id,
+            "trip_id": route.trip_ids[trip],
+            "board_stop": board_stop, # This is where the backtracking really happens.
+            "board_time": route.departure_columns[board_rank][trip] + route.time_offset,
+            "arrival_time": route.arrival_columns[alight_rank][trip] + route.time_offset,
         })
 
-        current_stop = label["board_stop"] # Updating the location backards
+        current_stop = board_stop # Updating the location backards
         k = k - 1 # Since we did go back one trip ago, this FORCES changing to the earlier round.
 
     path.reverse()
     return path
 
 
-def get_unique_paths(parent, tau_matrix, target_idx, max_rounds):
+def path_signature(path: List[Dict]) -> Tuple:
+    """Helper identifying a path by the trips it takes. Footpaths have no trip: they are identified by the stops they link."""
+    return tuple(segment['trip_id'] if segment['trip_id'] is not None else (segment['board_stop'], segment['stop']) for segment in path)
+
+
+def get_unique_paths(labels: Labels, timetable: Timetable, target_idx: int, max_rounds: int) -> List[List[Dict]]:
     """Helper to retrieve all unique paths found by RAPTOR by calling our reconstruction function sequentially for each round.
         It allow us to find more complicated paths that can still be more optimal than a direct path."""
     
@@ -181,9 +374,9 @@ def get_unique_paths(parent, tau_matrix, target_idx, max_rounds):
     seen_trip_ids = set() # Avoids reconstructing the same path over and over. This is frequent whith direct TGV.
 
     for k in range(1, max_rounds + 1):
-        path = reconstruct_path(parent, tau_matrix, target_idx, k)
-        if path:
-            signature = tuple(segment['trip_id'] for segment in path)
+        path = reconstruct_path(labels, timetable, target_idx, k)
+        if any(segment['trip_id'] is not None for segment in path): # A journey takes at least one trip, not only footpaths
+            signature = path_signature(path)
             
             if signature not in seen_trip_ids:
                 unique_paths.append(path)
@@ -192,29 +385,347 @@ def get_unique_paths(parent, tau_matrix, target_idx, max_rounds):
     return unique_paths
 
 
+def reachable_stops(source_stop: Stop, departure_time: int, timetable: Timetable, max_rounds: int = 5,
+                    end_time: Optional[int] = None, labels: Optional[Labels] = None,
+                    stats: Optional[RaptorStats] = None) -> Tuple[array, array, array]:
+    """One-to-all query: every stop reachable from the source with at most 'max_rounds' trips (and by 'end_time' if given),
+        read from the labels of a single RAPTOR run without target.
+        Output: Three aligned typed arrays, rather than one object per stop: the indices of the stops reached,
+            their earliest arrival times and the number of trips taken to reach them that early (0 for the source and the walks from it)."""
+    labels = RAPTOR(source_stop, source_stop, departure_time, timetable, max_rounds=max_rounds, labels=labels, end_time=end_time, stats=stats)
+
+    stops = array('i')
+    arrivals = array('i')
+    trips = array('i')
+    for stop_index, best in enumerate(labels.best):
+        if best != UNREACHED:
+            stops.append(stop_index)
+            arrivals.append(best)
+            trips.append(labels.rounds(stop_index).index(best)) # First round reaching the stop at its best time
+
+    return stops, arrivals, trips
+
+
+def source_departures(source_stop: Stop, timetable: Timetable, start_time: int, end_time: int) -> List[int]:
+    """Helper listing every distinct departure time of a trip leaving the source stop in [start_time, end_time], latest first.
+        The trips leaving the stations within walking distance are included too, at the time one must leave the source to catch them."""
+    departures = set()
+
+    walks = [(source_stop.index_in_list, 0)] # (stop, walking time from the source)
+    if timetable.footpaths is not None:
+        walks.extend(timetable.footpaths[source_stop.index_in_list])
+
+    for stop_index, walk in walks:
+        for route_index, rank in timetable.stop_route_ranks[stop_index]:
+            route = timetable.route_list[route_index]
+            column = route.departure_columns[rank]
+            time_offset = route.time_offset - walk
+
+            for position in range(bisect_left(column, start_time - time_offset), bisect_right(column, end_time - time_offset)):
+                if position not in route.no_pickup[rank]:
+                    departures.add(column[position] + time_offset)
+
+    return sorted(departures, reverse=True)
+
+
+def range_RAPTOR(source_stop: Stop, target_stop: Stop,
+                 start_time: int, end_time: int,
+                 timetable: Timetable, max_rounds: int = 5,
+                 pruning: bool = False, slack: int = 0,
+                 labels: Optional[Labels] = None, stats: Optional[RaptorStats] = None) -> List[Dict]:
+    """Range query (rRAPTOR in the paper): finds the best paths for every departure in a time interval in a single pass.
+        The departures of the source are processed latest first, and the labels are NOT reset between two departures:
+        a path found for a later departure is still valid for an earlier one, so it only has to be improved.
+
+        Output: The Pareto profile (departure time x arrival time x transfers), ordered by departure time.
+            Each entry is a dictionnary with the departure and arrival times, the number of transfers and the path itself.
+            CAUTION: a path may leave later than the departure time being processed, so its departure is read on the path itself.
+            Paths leaving after end_time are not returned, but they still dominate the paths leaving earlier and arriving later.
+        'labels' are optional buffers to reuse, and 'stats' an optional RaptorStats adding up the counters of every departure, as in RAPTOR."""
+
+    if labels is None:
+        labels = Labels(len(timetable.stop_list), max_rounds)
+    else:
+        labels.reset()
+
+    source_index = source_stop.index_in_list
+    target_index = target_stop.index_in_list
+    target_labels = slice(target_index * labels.width, (target_index + 1) * labels.width)
+
+    profile = []
+    seen_trip_ids = set()
+
+    for departure_time in source_departures(source_stop, timetable, start_time, end_time):
+
+        labels.arrival[source_index * labels.width] = departure_time
+        labels.best[source_index] = departure_time
+
+        previous_labels = labels.arrival[target_labels]
+        scan_rounds({source_index}, labels, timetable, target_index if pruning else None, slack, reuse_labels=True, stats=stats)
+        new_labels = labels.arrival[target_labels]
+
+        for k in range(1, max_rounds + 1):
+            if new_labels[k] < previous_labels[k]: # A better path was found for this departure
+                path = reconstruct_path(labels, timetable, target_index, k)
+                signature = path_signature(path)
+
+                if signature not in seen_trip_ids and path[0]['board_time'] <= end_time:
+                    seen_trip_ids.add(signature)
+                    profile.append({
+                        "departure_time": path[0]['board_time'],
+                        "arrival_time": path[-1]['arrival_time'],
+                        "transfers": sum(1 for segment in path if segment['trip_id'] is not None) - 1, # footpaths are not counted
+                        "path": path
+                    })
+
+    profile.sort(key=lambda entry: (entry["departure_time"], entry["transfers"]))
+    return profile
+
+
+TIME_WINDOW = 3 * 3600 # in seconds, default length of the interval searched by paths_in_time_range
+
+
 def paths_in_time_range(departure_time: int, source_stop: Stop, target_stop: Stop, 
-                        stop_list: List[Stop], route_list: List[Route], rounds: int = 5,
-                        consecutive_paths: int  = 5): # By default 5 consecutive paths
-    """Helper to call the RAPTOR function sequentially in order to find similar paths in a time interval.
-        Each time, the algorithm is called 2 minutes later from the moment the last found path left the departure station."""
+                        timetable: Timetable, rounds: int = 5,
+                        consecutive_paths: Optional[int] = 5, # By default 5 consecutive departures
+                        pruning: bool = False, slack: int = 0,
+                        end_time: Optional[int] = None, stats: Optional[RaptorStats] = None) -> List[List[Dict]]:
+    """Helper to find the best paths leaving in a time interval, with a single range query (see range_RAPTOR).
+        If no end_time is given, the interval lasts TIME_WINDOW seconds. If it contains no path, it is moved to the next path found later.
+        With a service window (see data_structure.service_window), this next path may leave the next morning.
+        Only the paths of the 'consecutive_paths' earliest departures are kept (all of them if None).
+        'pruning', 'slack' and 'stats' are passed to RAPTOR (see its documentation)."""
+
+    window_end = end_time if end_time is not None else departure_time + TIME_WINDOW
+    labels = Labels(len(timetable.stop_list), rounds) # Shared by every query below
+
+    profile = range_RAPTOR(source_stop,target_stop,departure_time,window_end,timetable,max_rounds=rounds,pruning=pruning,slack=slack,labels=labels,stats=stats)
+
+    if not profile and end_time is None:
+        # If no paths are found, a single query finds the next one later in the day, and the interval starts from its departure.
+        RAPTOR(source_stop,target_stop,window_end,timetable,max_rounds=rounds,pruning=pruning,slack=slack,labels=labels,stats=stats)
+        next_paths = get_unique_paths(labels,timetable,target_stop.index_in_list,rounds)
+
+        if not next_paths: # If no paths are found, that means we reached the end of the service of the timetable.
+            return []
+
+        departure_time = min(path[0]['board_time'] for path in next_paths)
+        profile = range_RAPTOR(source_stop,target_stop,departure_time,departure_time + TIME_WINDOW,timetable,max_rounds=rounds,pruning=pruning,slack=slack,labels=labels,stats=stats)
+
+    departures = sorted({entry["departure_time"] for entry in profile})
+    if consecutive_paths is not None:
+        departures = departures[:consecutive_paths]
+    kept_departures = set(departures)
+
+    return [entry["path"] for entry in profile if entry["departure_time"] in kept_departures]
+
+
+###############################################
+### Arrive-by queries (RAPTOR run backwards) ###
+###############################################
+# The search starts from the target at the requested arrival time and computes, for every stop, the latest departure to reach it in time.
+# Labels store the opposite of these departure times: the latest departure is the smallest label, so that the Labels buffers,
+# the UNREACHED sentinel and the pruning rules of the forward search are used unchanged. Routes are scanned from their last rank,
+# with their arrival columns, and footpaths are walked backwards. The timetable is the same as for the forward search.
+
+def scan_rounds_backward(marked_stops: Set[int], labels: Labels, timetable: Timetable,
+                         target_index: Optional[int] = None, slack: int = 0):
+    """Backward counterpart of scan_rounds, updating the labels in place from the stops marked at round 0.
+        'target_index' is the origin of the journey, and enables target pruning (None to explore the whole network).
+        The parents of a label are the trip taken from the stop and the rank where it is left, or the stop walked to."""
+    stop_list = timetable.stop_list
+    route_list = timetable.route_list
+    stop_route_ranks = timetable.stop_route_ranks
+    footpaths = timetable.footpaths.reverse() if timetable.footpaths is not None else None
+
+    width = labels.width
+    tau = labels.arrival # Opposite of the latest departure times
+    tau_star = labels.best
+    parent_route = labels.route
+    parent_trip = labels.trip
+    parent_rank = labels.board_rank
+    walk_from = labels.walk_from
+    trip_arrival = labels.trip_arrival # Opposite of the departures of the trips
+
+    # Round 0: walking to the target from the stations nearby
+    if footpaths is not None:
+        target_bound = tau[target_index * width] + slack if target_index is not None else UNREACHED
+        walked_stops, _ = relax_footpaths(marked_stops, 0, labels, footpaths, target_index, target_bound, slack, False)
+        marked_stops = marked_stops | walked_stops
+
+    for k in range(1, labels.max_rounds + 1):
+
+        target_bound = min(tau[target_index * width:target_index * width + k + 1]) + slack if target_index is not None else UNREACHED
+
+        route_queue = collect_routes(marked_stops, stop_route_ranks, backward=True)
+        marked_stops = set()
+        reached_stops = set()
+
+        for route_index, start_rank in route_queue.items():
+                    route = route_list[route_index]
+                    departure_columns = route.departure_columns
+                    arrival_columns = route.arrival_columns
+                    time_offset = route.time_offset
+                    current_trip = None
+                    alight_stop_rank = None
 
-    paths = []
+                    for rank in range(start_rank, -1, -1):
+                        stop_index = route.stop_index_list[rank]
+                        label = stop_index * width + k
 
-    for _ in range(consecutive_paths):
+                        if current_trip is not None: # Latest departure from this stop to catch the current trip
+                            departure_label = -(departure_columns[rank][current_trip] + time_offset)
 
-        new_paths = []
+                            reached = departure_label < target_bound and departure_label < trip_arrival[label] and current_trip not in route.no_pickup[rank]
+                            improved = reached and departure_label < tau[label]
 
-        tau, tau_star, parent = RAPTOR(source_stop,target_stop,departure_time,stop_list,route_list,max_rounds=rounds)
-    
-        new_paths = get_unique_paths(parent,tau,target_stop.index_in_list,rounds)
+                            if improved and stop_index != target_index: # Local pruning
+                                improved = departure_label < tau_star[stop_index]
+
+                            if reached and not improved: # Walked from only, as in scan_rounds
+                                reached = footpaths is not None and stop_index != target_index and departure_label < min(trip_arrival[label - k:label])
+
+                            if reached:
+                                trip_arrival[label] = departure_label
+                                parent_route[label] = route_index
+                                parent_trip[label] = current_trip
+                                parent_rank[label] = alight_stop_rank
+                                reached_stops.add(stop_index)
+
+                            if improved:
+                                tau[label] = departure_label
+                                tau_star[stop_index] = min(departure_label, tau_star[stop_index])
+                                walk_from[label] = NO_PARENT
+                                marked_stops.add(stop_index)
+
+                                if stop_index == target_index:
+                                    target_bound = min(target_bound, departure_label + slack)
+
+                        # Latest arrival at this stop allowing to leave it in time at the previous round
+                        transfer_time = stop_list[stop_index].min_transfer_time if k > 1 else 0
+                        next_label = tau[label - 1] + transfer_time
+
+                        if next_label >= target_bound:
+                            continue
+
+                        if current_trip is None or -next_label >= arrival_columns[rank][current_trip] + time_offset: # Checking if a later trip can be caught
+                            lt = latest_trip_at_stop(route, rank, -next_label, current_trip) # Only trips after the current one can improve it
+                            if lt is not None:
+                                current_trip = lt
+                                alight_stop_rank = rank
+
+        if footpaths is not None:
+            walked_stops, target_bound = relax_footpaths(reached_stops, k, labels, footpaths, target_index, target_bound, slack, False)
+            marked_stops |= walked_stops
+
+        if not marked_stops:
+            break
+
+
+def reverse_RAPTOR(source_stop: Stop, target_stop: Stop,
+                   arrival_time: int,
+                   timetable: Timetable, max_rounds: int = 5,
+                   pruning: bool = False, slack: int = 0,
+                   labels: Optional[Labels] = None) -> Labels:
+    """Arrive-by query: RAPTOR run backwards from the target, to find the latest departures reaching it by 'arrival_time'.
+        Same inputs as RAPTOR ('source_stop' is only used when pruning is enabled).
 
-        if not new_paths: # If no paths are found, that means we reached the end of the service for this specific day.
+        Output: A Labels object, where 'arrival' stores the OPPOSITE of the latest departure time from each stop at each round
+            (the number of trips taken to reach the target), and 'best' the opposite of the latest departure across all rounds.
+            The parents point towards the target: the trip taken from the stop and the rank where it is left, or the stop walked to."""
+
+    if labels is None:
+        labels = Labels(len(timetable.stop_list), max_rounds)
+    else:
+        labels.reset()
+
+    labels.arrival[target_stop.index_in_list * labels.width] = -arrival_time
+    labels.best[target_stop.index_in_list] = -arrival_time
+
+    source_index = source_stop.index_in_list if pruning else None
+    scan_rounds_backward({target_stop.index_in_list}, labels, timetable, source_index, slack)
+
+    return labels
+
+
+def reconstruct_path_backward(labels: Labels, timetable: Timetable, source_idx: int, k_round: int) -> List[Dict]:
+    """Counterpart of reconstruct_path for the labels of reverse_RAPTOR: the parents are followed from the source to the target,
+        so the segments come in the order of the journey."""
+    path = []
+    current_stop = source_idx
+
+    k = k_round
+    walked = False
+
+    while True:
+
+        label = current_stop * labels.width + k
+
+        if not walked and labels.walk_from[label] != NO_PARENT: # Walking to another stop, left at the same round
+            to_stop = labels.walk_from[label]
+            departure_time = -labels.arrival[label]
+            path.append({
+                "stop": to_stop,
+                "route_id": None,
+                "trip_id": None,
+                "board_stop": current_stop,
+                "board_time": departure_time,
+                "arrival_time": departure_time + walking_time(timetable, current_stop, to_stop),
+            })
+            current_stop = to_stop
+            walked = True
+            continue
+
+        walked = False
+        if k == 0:
             break
-       
-        paths.extend(new_paths)
 
-        boarding_time = new_paths[0][0].get('board_time')
+        route_index = labels.route[label]
+
+        if route_index == NO_PARENT:
+            k = k - 1
+            continue
 
-        departure_time = boarding_time + 2
+        route = timetable.route_list[route_index]
+        trip = labels.trip[label]
+        alight_rank = labels.board_rank[label]
+        alight_stop = route.stop_index_list[alight_rank]
+        # The trip is boarded at the last rank of the stop before the one where it is left
+        board_rank = next(rank for rank in range(alight_rank - 1, -1, -1) if route.stop_index_list[rank] == current_stop)
 
-    return paths
+        path.append({
+            "stop": alight_stop,
+            "route_id": route.id,
+            "trip_id": route.trip_ids[trip],
+            "board_stop": current_stop,
+            "board_time": route.departure_columns[board_rank][trip] + route.time_offset,
+            "arrival_time": route.arrival_columns[alight_rank][trip] + route.time_offset,
+        })
+
+        current_stop = alight_stop
+        k = k - 1
+
+    return path
+
+
+def paths_arriving_by(arrival_time: int, source_stop: Stop, target_stop: Stop,
+                      timetable: Timetable, rounds: int = 5,
+                      pruning: bool = False, slack: int = 0) -> List[List[Dict]]:
+    """Helper to find the paths reaching the target by 'arrival_time' and leaving as late as possible, with a single reverse_RAPTOR.
+        As in get_unique_paths, one path is reconstructed per number of trips, and the duplicates are removed."""
+
+    labels = reverse_RAPTOR(source_stop, target_stop, arrival_time, timetable, max_rounds=rounds, pruning=pruning, slack=slack)
+
+    unique_paths = []
+    seen_trip_ids = set()
+
+    for k in range(1, rounds + 1):
+        path = reconstruct_path_backward(labels, timetable, source_stop.index_in_list, k)
+        if any(segment['trip_id'] is not None for segment in path):
+            signature = path_signature(path)
+
+            if signature not in seen_trip_ids:
+                unique_paths.append(path)
+                seen_trip_ids.add(signature)
+
+    return unique_paths
@@ -0,0 +1,363 @@
+##################################################################
+### Journey searches of the server, run on a pool of processes ###
+##################################################################
+
+import asyncio
+import multiprocessing
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .cache import LRUCache
+from .data_structure import Stop, Timetable, RaptorStats, service_window
+from .mcraptor import McRAPTOR
+from .postprocessing import rank_by_time, jsonify_paths
+from .raptor import paths_in_time_range, paths_arriving_by, reachable_stops, source_departures, TIME_WINDOW
+from .snapshot import load_snapshot
+from .source_tree import SourceTree
+
+CACHE_BUCKET = 300 # in seconds, the searches leaving in the same 5 minutes share their cached results
+CONSECUTIVE_PATHS = 5 # departures returned by a search without end time
+SNAPSHOT_CACHE_SIZE = 2 # snapshots kept mapped by a worker process: the current one and the previous one, used by the requests started before a swap
+SOURCE_TREE_CACHE_SIZE = 64 # source trees kept by a process (under 1 MB each on a network of 3000 stations)
+SOURCE_TREE_TTL = 600 # in seconds
+SOURCE_TREE_MAX_DEPARTURES = 24 # no tree for the sources with more departures in the interval: a tree costs one scan of the network per departure
+
+# Source trees of this process, by (service window, source, start and end of the interval). The window is identified by its id:
+# a tree holds its window, which can not be freed and its id reused while the tree is cached. A key searched once is stored with False,
+# then with the future of its tree, built by a single background thread (None if the source has too many departures)
+_source_trees = LRUCache(SOURCE_TREE_CACHE_SIZE, SOURCE_TREE_TTL)
+_source_trees_lock = threading.Lock() # Searches run on several threads when there is no process pool
+_tree_builder = ThreadPoolExecutor(1, thread_name_prefix="source-tree")
+
+
+def search(timetable: Timetable, timings: Optional[Dict[str, float]] = None, **query) -> List[Dict]:
+    """Best journeys of a query (see search_paths), formatted for the API (see postprocessing.jsonify_paths).
+        'timings', if given, is filled with the duration (in seconds) of each stage: 'raptor', 'rank' and 'jsonify'."""
+    paths = search_paths(timetable, timings=timings, **query)
+    formatted = time.perf_counter()
+    journeys = jsonify_paths(paths, timetable.stop_list)
+    if timings is not None:
+        timings["jsonify"] = time.perf_counter() - formatted
+    return journeys
+
+
+def search_paths(timetable: Timetable, source_index: int, target_index: int, day: date, departure_time: int, end_time: Optional[int] = None,
+                 arrive_by: bool = False, train_types: Optional[Sequence[str]] = None, multicriteria: bool = False,
+                 timings: Optional[Dict[str, float]] = None, stats: Optional[RaptorStats] = None,
+                 consecutive_paths: int = CONSECUTIVE_PATHS) -> List[List[Dict]]:
+    """Best paths between two stops (indices in timetable.stop_list), ranked by arrival time.
+        Times are in seconds from midnight of 'day'. Depending on the options:
+            - arrive_by: latest departures reaching the target by 'departure_time' (reverse search)
+            - train_types or multicriteria: Pareto set of the journeys leaving from 'departure_time' (McRAPTOR), restricted to these kinds of trains
+            - end_time: every best journey leaving between 'departure_time' and 'end_time'
+            - otherwise, the best journeys of the next 'consecutive_paths' departures from 'departure_time'
+        'timings', if given, is filled with the duration (in seconds) of each stage: 'raptor' and 'rank'.
+        'stats', if given, collects the counters of the RAPTOR scans (see data_structure.RaptorStats). Arrive-by and McRAPTOR searches are not counted,
+        nor the searches answered by a source tree (see tree_paths), nor the building of the trees."""
+    start = time.perf_counter()
+    source = timetable.stop_list[source_index]
+    target = timetable.stop_list[target_index]
+
+    # Only the trips running on the requested day are scanned, along with the night trips of the day before
+    # and the trips of the next day, so that a search late in the evening carries on the next morning
+    window = service_window(timetable, day)
+
+    if arrive_by:
+        paths = paths_arriving_by(departure_time, source, target, window, pruning=True)
+    elif train_types is not None or multicriteria:
+        paths = [journey["path"] for journey in McRAPTOR(source, target, departure_time, window, train_types=train_types)]
+    else:
+        paths = tree_paths(window, source, target, departure_time, end_time, consecutive_paths=consecutive_paths)
+        if paths is None and end_time is None:
+            paths = paths_in_time_range(departure_time, source, target, window, pruning=True, consecutive_paths=consecutive_paths, stats=stats)
+        elif paths is None: # every departure of the interval is kept
+            paths = paths_in_time_range(departure_time, source, target, window, pruning=True, consecutive_paths=None, end_time=end_time, stats=stats)
+
+    searched = time.perf_counter()
+    paths = rank_by_time(paths)
+
+    if timings is not None:
+        timings.update(raptor=searched - start, rank=time.perf_counter() - searched)
+    return paths
+
+
+def isochrone_stops(timetable: Timetable, source_index: int, day: date, departure_time: int, max_rounds: int = 5, end_time: Optional[int] = None,
+                    timings: Optional[Dict[str, float]] = None, stats: Optional[RaptorStats] = None) -> Tuple[array, array, array]:
+    """Stops reachable from a source on the service window of 'day' (see raptor.reachable_stops), with the arguments of search_paths:
+        times in seconds from midnight of 'day', duration of the RAPTOR run in 'timings' ('raptor')."""
+    start = time.perf_counter()
+    source = timetable.stop_list[source_index]
+    reached = reachable_stops(source, departure_time, service_window(timetable, day), max_rounds=max_rounds, end_time=end_time, stats=stats)
+    if timings is not None:
+        timings["raptor"] = time.perf_counter() - start
+    return reached
+
+
+def build_tree(source: Stop, start_time: int, end_time: int, window: Timetable) -> Optional[SourceTree]:
+    """Source tree over [start_time, end_time], or None if the source has more than SOURCE_TREE_MAX_DEPARTURES departures in the interval."""
+    if len(source_departures(source, window, start_time, end_time)) > SOURCE_TREE_MAX_DEPARTURES:
+        return None
+    return SourceTree(source, start_time, end_time, window)
+
+
+def tree_paths(window: Timetable, source: Stop, target: Stop, departure_time: int, end_time: Optional[int] = None,
+               bucket: int = CACHE_BUCKET, consecutive_paths: int = CONSECUTIVE_PATHS) -> Optional[List[List[Dict]]]:
+    """Paths of paths_in_time_range read from a source tree (see source_tree.SourceTree), shared by the searches from the same source to any target.
+        A tree gives the same paths as the search only if it ends with the interval of the search: the departures after its end would dominate
+        some paths, and the tree would miss the paths leaving later than its own end. With an end time, the tree covers [bucket start, end_time],
+        shared by the searches of the bucket. Otherwise the interval ends TIME_WINDOW seconds after the departure, and the tree is only shared
+        by the searches leaving at the same time.
+        The second search of a key has its tree built in the background, once: a search never waits for a tree, nor pays for it.
+        Outputs None if the tree is not built (yet), or if it has no path while the search must go on later than its interval."""
+    if end_time is not None:
+        start, end = departure_time // bucket * bucket, end_time
+    else:
+        start, end = departure_time, departure_time + TIME_WINDOW
+    key = (id(window), source.index_in_list, start, end)
+
+    with _source_trees_lock:
+        tree = _source_trees.get(key)
+        if tree is None: # first search of the key: a tree is only built for the second one
+            _source_trees.put(key, False)
+            return None
+        if tree is False:
+            _source_trees.put(key, _tree_builder.submit(build_tree, source, start, end, window))
+            return None
+
+    if not tree.done() or tree.exception() is not None or tree.result() is None:
+        return None
+
+    paths = tree.result().paths(target, departure_time, consecutive_paths=None if end_time is not None else consecutive_paths, end_time=end_time)
+    return paths if paths or end_time is not None else None
+
+
+def bucket_query(query: Dict, bucket: int = CACHE_BUCKET) -> Tuple[Tuple, Dict]:
+    """Search run for the bucket of a query, whose results are cached and shared by every query of the bucket (see requested_paths),
+        with its key in the cache: the departure time is rounded down to a multiple of 'bucket' seconds, and the search for the next departures
+        asks for twice as many, so that enough of them are left for the queries later in the bucket.
+        Only range queries (see raptor.range_RAPTOR) are shared by a bucket, and their end time is kept as is: a later end would let later journeys
+        dominate the requested ones. Arrive-by and McRAPTOR queries keep their time: walking all the way to the target would dominate
+        different trains from another time, so the results of the bucket could hide some of the requested ones.
+        Output: (key, query of the bucket)"""
+    rounded = dict(query)
+    if not query.get("arrive_by") and query.get("train_types") is None and not query.get("multicriteria"):
+        rounded["departure_time"] = query["departure_time"] // bucket * bucket
+        if query.get("end_time") is None:
+            rounded["consecutive_paths"] = 2 * query.get("consecutive_paths", CONSECUTIVE_PATHS)
+
+    train_types = tuple(sorted(query["train_types"])) if query.get("train_types") is not None else None
+    key = (query["source_index"], query["target_index"], query["day"], rounded["departure_time"], query.get("end_time"),
+           bool(query.get("arrive_by")), train_types, bool(query.get("multicriteria")))
+    return key, rounded
+
+
+def requested_paths(paths: List[List[Dict]], query: Dict, rounded: Dict) -> Optional[List[List[Dict]]]:
+    """Results of a query read from the results of its bucket (searched with the 'rounded' query, see bucket_query),
+        or None if they may differ from the results of the query itself, which must then be searched:
+            - with an end time, the paths leaving between the requested times
+            - otherwise, the paths of the next 'consecutive_paths' departures from the requested time. They hold if there are that many
+              of them in the bucket, or if the bucket starts at the requested time.
+        The paths are filtered before being formatted: jsonify_paths drops the paths taking a train already taken by a previous one."""
+    if rounded == query: # the bucket is the query itself, as for arrive-by and McRAPTOR queries
+        return paths
+
+    requested = [path for path in paths if path[0]['board_time'] >= query["departure_time"]]
+    if query.get("end_time") is not None:
+        return [path for path in requested if path[0]['board_time'] <= query["end_time"]]
+
+    consecutive_paths = query.get("consecutive_paths", CONSECUTIVE_PATHS)
+    departures = sorted({path[0]['board_time'] for path in requested})[:consecutive_paths]
+    if len(departures) < consecutive_paths and rounded["departure_time"] != query["departure_time"]:
+        return None
+    kept_departures = set(departures)
+    return [path for path in requested if path[0]['board_time'] in kept_departures]
+
+
+# Snapshots mapped by a worker process, by path, most recently used last
+_snapshots: OrderedDict = OrderedDict()
+
+
+def _snapshot(path: str) -> Timetable:
+    timetable = _snapshots.get(path)
+    if timetable is None:
+        timetable = _snapshots[path] = load_snapshot(path)
+        if len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+    else:
+        _snapshots.move_to_end(path)
+    return timetable
+
+
+def _timed_search(timetable: Optional[Timetable], snapshot_path: Optional[str], deadline: float, query: Dict,
+                  collect_stats: bool = False, function: Callable = search_paths) -> Tuple[Any, float, float, Dict, Optional[RaptorStats]]:
+    """Runs search_paths (or 'function', taking the same keyword arguments) if its deadline has not passed while it was queued.
+        The timetable is mapped from its snapshot in worker processes.
+        Output: (results, or None if the deadline passed, start time, end time, durations of the stages, RAPTOR counters if collected)"""
+    started = time.time()
+    timings = {}
+    if started > deadline:
+        return None, started, started, timings, None
+    if timetable is None:
+        timetable = _snapshot(snapshot_path)
+    stats = RaptorStats() if collect_stats else None
+    return function(timetable, timings=timings, stats=stats, **query), started, time.time(), timings, stats
+
+
+class Overloaded(Exception):
+    """Raised when too many searches are already waiting for a process."""
+
+
+class SearchMetrics:
+    """Counters of the searches, with the queue waits and compute times (in seconds) of the last 'window' ones."""
+
+    def __init__(self, window: int = 1000):
+        self.completed = 0
+        self.rejected = 0 # queue full
+        self.timeouts = 0 # deadline passed, in the queue or while computing
+        self.queue_wait = deque(maxlen=window)
+        self.compute = deque(maxlen=window)
+
+    def record(self, queue_wait: float, compute: float):
+        self.completed += 1
+        self.queue_wait.append(queue_wait)
+        self.compute.append(compute)
+
+    @staticmethod
+    def percentiles(values: Sequence[float]) -> Dict[str, float]:
+        """p50, p95, p99 and max of the values, in milliseconds."""
+        if not values:
+            return {}
+        ordered = sorted(values)
+        last = len(ordered) - 1
+        return {name: round(ordered[round(q * last)] * 1000, 2) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1))}
+
+    def summary(self) -> Dict:
+        return {"completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "queue_wait_ms": self.percentiles(self.queue_wait),
+                "compute_ms": self.percentiles(self.compute)}
+
+
+class SearchPool:
+    """Runs the searches of an asyncio server on 'workers' processes, so that they neither block the event loop nor share the GIL.
+        The worker processes map the snapshot the timetable was loaded from (see coordinator.py), nothing but the query and the results is sent.
+        A timetable not loaded from a snapshot, or 'workers' = 0, runs the searches on a pool of threads instead.
+        Each server process has its own pool: with several of them, 'workers' is the share of the CPUs of one process, not the total.
+
+        Load shedding: beyond 'max_pending' searches waiting or running, new ones are rejected at once (Overloaded),
+        and a search not over within 'timeout' seconds raises TimeoutError. A search still queued at its deadline is dropped without being computed,
+        so that the queue drains quickly after a burst instead of computing answers nobody waits for anymore.
+        A running search can not be stopped: it keeps its slot until it is over, so that 'max_pending' still bounds the searches computing after a timeout.
+
+        With a 'cache', the results of a search are reused by the next queries of the same bucket (see bucket_query) without going through the pool.
+        The cache is emptied when the timetable version changes.
+
+        The counters of the RAPTOR scans (see data_structure.RaptorStats) are collected for the searches asking for them,
+        and for a fraction 'stats_sample' of the others, and added up in 'raptor_stats' ('stats_searches' searches)."""
+
+    def __init__(self, workers: int, max_pending: int, timeout: float, cache: Optional[LRUCache] = None, bucket: int = CACHE_BUCKET,
+                 stats_sample: float = 0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.metrics = SearchMetrics()
+        self.cache = cache
+        self.bucket = bucket
+        self.cache_version = None # timetable version of the cached results
+        self.stats_sample = stats_sample
+        self.raptor_stats = RaptorStats()
+        self.stats_searches = 0
+        # Processes are spawned rather than forked: the server runs threads (scheduler, thread pool) that a fork would copy in an unknown state
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) if workers > 0 else None
+        self.threads = ThreadPoolExecutor(thread_name_prefix="search") # searches run without process
+        self.pending_lock = threading.Lock()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.threads.shutdown(wait=False, cancel_futures=True)
+
+    async def search(self, timetable: Timetable, trace: Optional[Dict] = None, collect_stats: bool = False, **query) -> List[Dict]:
+        """Same as search(), but awaitable. Raises Overloaded if too many searches are pending, TimeoutError past the deadline.
+            'trace', if given, is filled with how the search went: 'cache' ('hit' or 'miss'), the duration of the formatting ('jsonify'),
+            and unless the results were cached, the time waited for a process ('queue_wait') and the durations of the stages of search_paths() (in seconds).
+            With 'collect_stats', it also gets the counters of the RAPTOR scans ('raptor_stats'), unless the results were cached.
+            The paths are cached before being formatted: the journeys of a query are formatted from its own paths only, as search() does."""
+        trace = trace if trace is not None else {}
+        if self.cache is None:
+            paths = await self.run(timetable, query, trace, collect_stats)
+        else:
+            if timetable.version != self.cache_version:
+                self.cache.clear()
+                self.cache_version = timetable.version
+
+            key, rounded = bucket_query(query, self.bucket)
+            bucket_paths = self.cache.get(key)
+            trace["cache"] = "miss" if bucket_paths is None else "hit"
+            if bucket_paths is None:
+                bucket_paths = await self.run(timetable, rounded, trace, collect_stats)
+                if timetable.version == self.cache_version: # unless the version changed meanwhile
+                    self.cache.put(key, bucket_paths)
+
+            paths = requested_paths(bucket_paths, query, rounded)
+            if paths is None: # the results of the bucket may not be those of the query
+                paths = await self.run(timetable, query, trace, collect_stats)
+
+        formatted = time.perf_counter()
+        journeys = jsonify_paths(paths, timetable.stop_list)
+        trace["jsonify"] = time.perf_counter() - formatted
+        return journeys
+
+    def _release(self, future: Future):
+        with self.pending_lock: # called by the thread the search ran on, or the thread managing the processes
+            self.pending -= 1
+
+    async def isochrone(self, timetable: Timetable, trace: Optional[Dict] = None, **query) -> Tuple[array, array, array]:
+        """Same as isochrone_stops(), but awaitable, with the deadline and load shedding of the searches (see search())."""
+        return await self.run(timetable, query, trace, function=isochrone_stops)
+
+    async def run(self, timetable: Timetable, query: Dict, trace: Optional[Dict] = None, collect_stats: bool = False,
+                  function: Callable = search_paths) -> Any:
+        """Runs search_paths() (or 'function', see _timed_search) on the pool, without the cache."""
+        if self.pending >= self.max_pending:
+            self.metrics.rejected += 1
+            raise Overloaded(f"{self.pending} searches pending")
+
+        submitted = time.time()
+        deadline = submitted + self.timeout
+        sampled = collect_stats or random.random() < self.stats_sample
+        if self.executor is not None and timetable.snapshot_path is not None:
+            future = self.executor.submit(_timed_search, None, timetable.snapshot_path, deadline, query, sampled, function)
+        else:
+            future = self.threads.submit(_timed_search, timetable, None, deadline, query, sampled, function)
+
+        # A search keeps its slot until it is over: only a search still queued can be cancelled, a running one goes on after its timeout
+        with self.pending_lock:
+            self.pending += 1
+        future.add_done_callback(self._release)
+        try:
+            results, started, finished, timings, stats = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout) # cancels the search if still queued
+        except asyncio.TimeoutError:
+            results = None
+
+        if results is None:
+            self.metrics.timeouts += 1
+            raise TimeoutError(f"search not over after {self.timeout}s")
+
+        self.metrics.record(started - submitted, finished - started)
+        if stats is not None:
+            self.raptor_stats.merge(stats)
+            self.stats_searches += 1
+        if trace is not None:
+            trace.update(timings, queue_wait=started - submitted)
+            if collect_stats:
+                trace["raptor_stats"] = stats
+        return results
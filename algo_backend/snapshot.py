@@ -0,0 +1,325 @@
+#############################################################################
+### Compiled binary timetable, memory-mapped instead of parsing the GTFS ###
+#############################################################################
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date
+from typing import Dict, List, Optional
+
+from .data_structure import Stop, Route, Timetable, ServiceCalendar, StopRouteIndex, TransferGraph, map_index
+from .preprocessing import load_gtfs_data
+
+"""File layout:
+    - 4 bytes: magic number b'BRTT'
+    - 4 bytes: format version (unsigned int, little endian)
+    - 4 bytes: length of the JSON header (unsigned int, little endian)
+    - JSON header: GTFS version, byte order, and the (offset, length) of every section in the file
+    - Sections, aligned on 8 bytes: int32 and float64 arrays (native byte order) and '\\n'-separated UTF-8 strings
+
+    Every int32 section is used in place through a memoryview on the mapped file: loading a snapshot costs a few list constructions
+    (stops, route objects, trip ids) but no parsing of the times."""
+
+MAGIC = b'BRTT'
+FORMAT_VERSION = 5 # also bumped when the preprocessing changes, so that the snapshots are built again
+SNAPSHOT_NAME = 'timetable.bin'
+
+# GTFS files the timetable is built from: any change in them triggers a rebuild of the snapshot
+SOURCE_FILES = ('feed_info.txt', 'stops.txt', 'trips.txt', 'stop_times.txt', 'calendar.txt', 'calendar_dates.txt', 'transfers.txt')
+
+
+def file_digest(path: str) -> str:
+    """SHA-1 of the content of a file, read by chunks."""
+    digest = hashlib.sha1()
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def gtfs_version(gtfs_dir: str) -> str:
+    """Version of the GTFS data: feed_version and revisions from feed_info.txt, plus the size and content hash of the source files.
+        The modification times are left out: a new download of the same data gets new ones, but must not rebuild the snapshot."""
+    parts = []
+
+    feed_info = os.path.join(gtfs_dir, 'feed_info.txt')
+    if os.path.exists(feed_info):
+        with open(feed_info, mode='r', encoding='utf-8') as f:
+            header = f.readline().strip().split(',')
+            values = f.readline().strip().split(',')
+        info = dict(zip(header, values))
+        parts.extend(info.get(key, '') for key in ('feed_version', 'conv_rev', 'plan_rev'))
+
+    for name in SOURCE_FILES:
+        path = os.path.join(gtfs_dir, name)
+        if os.path.exists(path):
+            parts.append(f'{name}:{os.path.getsize(path)}:{file_digest(path)}')
+
+    return '|'.join(parts)
+
+
+def write_snapshot(timetable: Timetable, path: str):
+    """Compiles a timetable into the binary format. The file is written next to its destination then renamed, so a reader never sees a partial file."""
+    stop_list = timetable.stop_list
+    route_list = timetable.route_list
+
+    sections = {}
+
+    # Stops
+    sections['stop_ids'] = '\n'.join(stop.id for stop in stop_list).encode('utf-8')
+    sections['stop_names'] = '\n'.join(stop.name for stop in stop_list).encode('utf-8')
+    sections['stop_lats'] = array('d', (stop.lat for stop in stop_list))
+    sections['stop_lons'] = array('d', (stop.lon for stop in stop_list))
+    sections['stop_transfer_times'] = array('i', (stop.min_transfer_time for stop in stop_list))
+
+    # Routes: stops, trips and time columns (all departure columns, then all arrival columns, rank by rank)
+    route_stop_offsets = array('i', [0])
+    route_stops = array('i')
+    route_trip_offsets = array('i', [0])
+    route_time_offsets = array('i', [0])
+    times = array('i')
+    restrictions = array('i') # (route, rank, position, kind) with kind 0 for no pickup, 1 for no drop-off
+    trip_ids = []
+    trip_services = array('i')
+
+    for route in route_list:
+        route_stops.extend(route.stop_index_list)
+        route_stop_offsets.append(len(route_stops))
+
+        trip_ids.extend(route.trip_ids)
+        trip_services.extend(route.trip_services)
+        route_trip_offsets.append(len(trip_ids))
+
+        for column in route.departure_columns:
+            times.extend(column)
+        for column in route.arrival_columns:
+            times.extend(column)
+        route_time_offsets.append(len(times))
+
+        for kind, blocked in enumerate((route.no_pickup, route.no_drop_off)):
+            for rank, positions in enumerate(blocked):
+                for position in sorted(positions):
+                    restrictions.extend((route.index_in_list, rank, position, kind))
+
+    sections['route_ids'] = '\n'.join(route.id for route in route_list).encode('utf-8')
+    sections['route_stop_offsets'] = route_stop_offsets
+    sections['route_stops'] = route_stops
+    sections['route_trip_offsets'] = route_trip_offsets
+    sections['route_time_offsets'] = route_time_offsets
+    sections['times'] = times
+    sections['restrictions'] = restrictions
+    sections['trip_ids'] = '\n'.join(trip_ids).encode('utf-8')
+    sections['trip_services'] = trip_services
+
+    # Calendar: the bitset of each service is stored on a fixed number of bytes
+    calendar = timetable.calendar
+    if calendar is not None:
+        day_bytes = (calendar.num_days + 7) // 8
+        sections['service_ids'] = '\n'.join(calendar.service_ids).encode('utf-8')
+        sections['service_days'] = b''.join(days.to_bytes(day_bytes, 'little') for days in calendar.days)
+
+    # Stop -> (route, rank) index, in CSR form
+    stop_route_offsets = array('i', [0])
+    stop_route_routes = array('i')
+    stop_route_ranks = array('i')
+    for pairs in timetable.stop_route_ranks:
+        for route_index, rank in pairs:
+            stop_route_routes.append(route_index)
+            stop_route_ranks.append(rank)
+        stop_route_offsets.append(len(stop_route_routes))
+
+    sections['stop_route_offsets'] = stop_route_offsets
+    sections['stop_route_routes'] = stop_route_routes
+    sections['stop_route_ranks'] = stop_route_ranks
+
+    # Footpaths, already in CSR form
+    footpaths = timetable.footpaths
+    if footpaths is not None:
+        sections['footpath_offsets'] = array('i', footpaths.offsets)
+        sections['footpath_targets'] = array('i', footpaths.targets)
+        sections['footpath_durations'] = array('i', footpaths.durations)
+
+    # Layout: header first, then every section aligned on 8 bytes
+    payloads = {name: (data.tobytes() if isinstance(data, array) else data) for name, data in sections.items()}
+
+    def build_header(data_start: int) -> bytes:
+        layout = {}
+        offset = data_start
+        for name, payload in payloads.items():
+            layout[name] = (offset, len(payload))
+            offset += len(payload) + (-len(payload) % 8)
+        header = {
+            'version': timetable.version,
+            'byteorder': sys.byteorder,
+            'num_stops': len(stop_list),
+            'num_routes': len(route_list),
+            'calendar': [calendar.start_date.isoformat(), calendar.num_days] if calendar is not None else None,
+            'sections': layout
+        }
+        return json.dumps(header).encode('utf-8')
+
+    # The header length depends on the offsets it contains: iterate until it is stable
+    header = build_header(0)
+    while True:
+        data_start = 12 + len(header) + (-(12 + len(header)) % 8)
+        new_header = build_header(data_start)
+        if len(new_header) == len(header):
+            header = new_header
+            break
+        header = new_header
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode='wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(b'\0' * (data_start - 12 - len(header)))
+        for payload in payloads.values():
+            f.write(payload)
+            f.write(b'\0' * (-len(payload) % 8))
+
+    os.replace(tmp_path, path)
+
+
+def read_header(path: str) -> Optional[Dict]:
+    """Reads the JSON header of a snapshot. Outputs None if the file is missing, or was written in another format or byte order."""
+    if not os.path.exists(path):
+        return None
+
+    with open(path, mode='rb') as f:
+        start = f.read(12)
+        if len(start) < 12 or start[:4] != MAGIC:
+            return None
+
+        format_version, header_length = struct.unpack('<II', start[4:])
+        if format_version != FORMAT_VERSION:
+            return None
+
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    if header['byteorder'] != sys.byteorder:
+        return None
+
+    return header
+
+
+def load_snapshot(path: str) -> Timetable:
+    """Memory-maps a snapshot and rebuilds the Timetable around it.
+        Route columns are zero-copy int32 views on the mapped file, shared with every other process mapping the same file."""
+    header = read_header(path)
+    if header is None:
+        raise ValueError(f"{path} is not a valid timetable snapshot")
+
+    with open(path, mode='rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data = memoryview(buffer)
+    layout = header['sections']
+
+    def ints(name: str) -> memoryview:
+        offset, length = layout[name]
+        return data[offset:offset + length].cast('i')
+
+    def floats(name: str) -> memoryview:
+        offset, length = layout[name]
+        return data[offset:offset + length].cast('d')
+
+    def strings(name: str) -> List[str]:
+        offset, length = layout[name]
+        if length == 0:
+            return []
+        return bytes(data[offset:offset + length]).decode('utf-8').split('\n')
+
+    # Stops
+    stop_transfer_times = ints('stop_transfer_times')
+    stop_list = [Stop(name, id, lat, lon, min_transfer_time)
+                 for name, id, lat, lon, min_transfer_time in zip(strings('stop_names'), strings('stop_ids'),
+                                                                  floats('stop_lats'), floats('stop_lons'), stop_transfer_times)]
+    map_index(stop_list)
+    stop_dict = {stop.id: stop for stop in stop_list}
+
+    # Routes
+    route_ids = strings('route_ids')
+    route_stop_offsets = ints('route_stop_offsets')
+    route_stops = ints('route_stops')
+    route_trip_offsets = ints('route_trip_offsets')
+    route_time_offsets = ints('route_time_offsets')
+    times = ints('times')
+    trip_ids = strings('trip_ids')
+    trip_services = ints('trip_services')
+
+    route_list = []
+    for route_index, route_id in enumerate(route_ids):
+        stop_index_list = route_stops[route_stop_offsets[route_index]:route_stop_offsets[route_index + 1]]
+        num_ranks = len(stop_index_list)
+        first_trip, last_trip = route_trip_offsets[route_index], route_trip_offsets[route_index + 1]
+        num_trips = last_trip - first_trip
+
+        route = Route(route_id, [stop_list[stop_index].id for stop_index in stop_index_list], stop_index_list, route_index)
+        route.trip_ids = trip_ids[first_trip:last_trip]
+        route.trip_services = trip_services[first_trip:last_trip]
+
+        start = route_time_offsets[route_index]
+        columns = [times[start + i * num_trips:start + (i + 1) * num_trips] for i in range(2 * num_ranks)]
+        route.departure_columns = columns[:num_ranks]
+        route.arrival_columns = columns[num_ranks:]
+
+        route.no_pickup = [frozenset()] * num_ranks
+        route.no_drop_off = [frozenset()] * num_ranks
+        route_list.append(route)
+
+    restrictions = ints('restrictions')
+    blocked = {} # (route, rank, kind) -> positions
+    for i in range(0, len(restrictions), 4):
+        route_index, rank, position, kind = restrictions[i:i + 4]
+        blocked.setdefault((route_index, rank, kind), set()).add(position)
+    for (route_index, rank, kind), positions in blocked.items():
+        route = route_list[route_index]
+        (route.no_pickup if kind == 0 else route.no_drop_off)[rank] = frozenset(positions)
+
+    stop_route_ranks = StopRouteIndex(ints('stop_route_offsets'), ints('stop_route_routes'), ints('stop_route_ranks'))
+
+    calendar = None
+    if header['calendar'] is not None:
+        start_date, num_days = header['calendar']
+        day_bytes = (num_days + 7) // 8
+        offset, length = layout['service_days']
+        days = [int.from_bytes(data[start:start + day_bytes], 'little') for start in range(offset, offset + length, day_bytes)]
+        calendar = ServiceCalendar(date.fromisoformat(start_date), num_days, strings('service_ids'), days)
+
+    footpaths = None
+    if 'footpath_offsets' in layout:
+        footpaths = TransferGraph(ints('footpath_offsets'), ints('footpath_targets'), ints('footpath_durations'))
+
+    return Timetable(stop_list, route_list, stop_dict,
+                     stop_route_ranks=stop_route_ranks, version=header['version'], buffer=buffer, snapshot_path=path,
+                     calendar=calendar, footpaths=footpaths)
+
+
+def load_timetable(gtfs_dir: str, snapshot_path: Optional[str] = None) -> Timetable:
+    """Loads the timetable from its snapshot, or rebuilds the snapshot from the GTFS data if it is missing or outdated.
+        By default, the snapshot is stored in the GTFS directory, so it is deleted along with the data it was built from."""
+    if snapshot_path is None:
+        snapshot_path = os.path.join(gtfs_dir, SNAPSHOT_NAME)
+
+    version = gtfs_version(gtfs_dir)
+    header = read_header(snapshot_path)
+
+    if header is None or header['version'] != version:
+        timetable = load_gtfs_data(gtfs_dir)
+        timetable.version = version
+        write_snapshot(timetable, snapshot_path)
+
+    return load_snapshot(snapshot_path)
+
+
+if __name__ == "__main__":
+    gtfs_dir = os.path.dirname(__file__) + "/../gtfs_sncf"
+    timetable = load_timetable(gtfs_dir)
+
+    print(f"Timetable {timetable.version}: {len(timetable.stop_list)} stops, {len(timetable.route_list)} routes")
@@ -11,6 +11,24 @@ import shutil
 url = "https://eu.ftp.opendatasoft.com/sncf/plandata/Export_OpenData_SNCF_GTFS_NewTripId.zip"
 dir = "gtfs_sncf"
 
+def extract_zip(content, target_dir):
+    '''Extrait une archive dans un dossier temporaire, puis remplace le dossier cible :
+    les anciennes données restent complètes jusqu'au remplacement, et ne sont pas perdues si l'extraction échoue'''
+    tmp_dir = target_dir + ".tmp"
+    old_dir = target_dir + ".old"
+    for d in (tmp_dir, old_dir):
+        if os.path.exists(d):
+            shutil.rmtree(d)
+
+    with zipfile.ZipFile(io.BytesIO(content)) as z:
+        z.extractall(tmp_dir)
+
+    if os.path.exists(target_dir):
+        os.rename(target_dir, old_dir)
+    os.rename(tmp_dir, target_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
 def download_and_extract_gtfs(url):
     '''Télécharge et extrait les données GTFS '''
     
@@ -18,13 +36,7 @@ def download_and_extract_gtfs(url):
         response = requests.get(url)
         response.raise_for_status() 
 
-        # Suppression des anciennes données
-        if os.path.exists(dir):
-            shutil.rmtree(dir)
-        os.makedirs(dir)
-
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            z.extractall(dir)
+        extract_zip(response.content, dir)
             
     except Exception as e:
         print(f"Erreur : {e}\n")
@@ -47,13 +59,7 @@ def update_idh_data():
         response = requests.get(URL_IDH, timeout=60)
         response.raise_for_status()
 
-        if os.path.exists(dir):
-            shutil.rmtree(dir)
-        os.makedirs(dir)
-
-
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            z.extractall(dir)
+        extract_zip(response.content, dir)
             
     except Exception as e:
         print(f"Erreur : {e}")
@@ -0,0 +1,146 @@
+#################################################################
+### Range query from a source to every stop, reused by target ###
+#################################################################
+
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+from .data_structure import Stop, Timetable, Labels, RaptorStats, UNREACHED, NO_PARENT
+from .raptor import scan_rounds, source_departures, reconstruct_path, path_signature
+
+"""range_RAPTOR only keeps the profile of its target, although its labels hold the paths to every stop reached on the way.
+    A SourceTree runs the same range query without target, and records the history of the labels: for each departure of the source
+    (latest first), the labels it improved, with their parents. The labels as they were after any departure can then be read back,
+    and the profile of any target is rebuilt with reconstruct_path, exactly as range_RAPTOR would have found it, without scanning the network again.
+
+    Without target pruning, a tree costs about twice a query with pruning: it pays off from the second target asked from the same source."""
+
+
+class LabelColumn:
+    """One buffer of the labels (arrival times or parents), as it was after a given departure: read-only, indexed like the buffers of Labels."""
+
+    def __init__(self, tree: 'SourceTree', values: array, initial: int, iteration: int):
+        self.tree = tree
+        self.values = values
+        self.initial = initial
+        self.iteration = iteration
+
+    def __getitem__(self, label: int) -> int:
+        tree = self.tree
+        start, end = tree.offsets[label], tree.offsets[label + 1]
+        position = bisect_right(tree.iterations, self.iteration, start, end) - 1 # Last change of the label up to this departure
+        return self.values[position] if position >= start else self.initial
+
+
+class LabelsAt:
+    """Labels of a SourceTree after one of its departures, readable by reconstruct_path as a Labels object."""
+
+    def __init__(self, tree: 'SourceTree', iteration: int):
+        self.width = tree.width
+        self.max_rounds = tree.max_rounds
+        self.arrival = LabelColumn(tree, tree.arrival, UNREACHED, iteration)
+        self.route = LabelColumn(tree, tree.route, NO_PARENT, iteration)
+        self.trip = LabelColumn(tree, tree.trip, NO_PARENT, iteration)
+        self.board_rank = LabelColumn(tree, tree.board_rank, NO_PARENT, iteration)
+        self.walk_from = LabelColumn(tree, tree.walk_from, NO_PARENT, iteration)
+
+
+class SourceTree:
+    """Range query from a source over [start_time, end_time] (see raptor.range_RAPTOR), without target.
+        The changes of the labels are stored in typed arrays sorted by label, then by departure (0 for the latest one):
+        the changes of label l are at positions offsets[l] to offsets[l+1].
+        'stats', if given, collects the counters of the scans (see data_structure.RaptorStats)."""
+
+    def __init__(self, source_stop: Stop, start_time: int, end_time: int, timetable: Timetable, max_rounds: int = 5,
+                 stats: Optional[RaptorStats] = None):
+        self.timetable = timetable
+        self.source_index = source_stop.index_in_list
+        self.start_time = start_time
+        self.end_time = end_time
+        self.max_rounds = max_rounds
+        self.departures = source_departures(source_stop, timetable, start_time, end_time)
+
+        labels = Labels(len(timetable.stop_list), max_rounds)
+        self.width = labels.width
+        tau = labels.arrival
+
+        changes = [] # (label, departure, arrival, route, trip, board rank, walk from)
+        previous = array('i', tau)
+        trip_arrival = labels.trip_arrival
+        previous_trips = array('i', trip_arrival)
+        for iteration, departure_time in enumerate(self.departures):
+            tau[self.source_index * labels.width] = departure_time
+            labels.best[self.source_index] = departure_time
+            scan_rounds({self.source_index}, labels, timetable, reuse_labels=True, stats=stats)
+
+            # A label changes along with its parents: they are copied now, before the next departures overwrite them.
+            # The trip parent of a label also changes on its own, when a trip is only walked from (see raptor.scan_rounds)
+            changes.extend((label, iteration, tau[label], labels.route[label], labels.trip[label], labels.board_rank[label], labels.walk_from[label])
+                           for label in range(len(tau)) if tau[label] != previous[label] or trip_arrival[label] != previous_trips[label])
+            previous[:] = tau
+            previous_trips[:] = trip_arrival
+
+        changes.sort() # By label, then by departure
+        self.iterations = array('i', (change[1] for change in changes))
+        self.arrival = array('i', (change[2] for change in changes))
+        self.route = array('i', (change[3] for change in changes))
+        self.trip = array('i', (change[4] for change in changes))
+        self.board_rank = array('i', (change[5] for change in changes))
+        self.walk_from = array('i', (change[6] for change in changes))
+
+        self.offsets = array('i', [0]) * (len(tau) + 1)
+        for change in changes:
+            self.offsets[change[0] + 1] += 1
+        for label in range(len(tau)):
+            self.offsets[label + 1] += self.offsets[label]
+
+    def __len__(self) -> int:
+        """Number of label changes stored."""
+        return len(self.iterations)
+
+    def profile(self, target_stop: Stop, start_time: Optional[int] = None, end_time: Optional[int] = None) -> List[Dict]:
+        """Pareto profile of a target, as output by range_RAPTOR over the interval of the tree.
+            Only the paths leaving in [start_time, end_time] are kept (the whole interval of the tree by default)."""
+        start_time = self.start_time if start_time is None else start_time
+        end_time = self.end_time if end_time is None else end_time
+        target_index = target_stop.index_in_list
+
+        # The target improved at round k for a departure if its label k got an earlier arrival during the scan of this departure
+        improvements = []
+        for k in range(1, self.max_rounds + 1):
+            start, end = self.offsets[target_index * self.width + k], self.offsets[target_index * self.width + k + 1]
+            improvements.extend((self.iterations[position], k) for position in range(start, end)
+                                if self.arrival[position] != (self.arrival[position - 1] if position > start else UNREACHED))
+        improvements.sort()
+
+        profile = []
+        seen_trip_ids = set()
+        for iteration, k in improvements:
+            path = reconstruct_path(LabelsAt(self, iteration), self.timetable, target_index, k)
+            signature = path_signature(path)
+
+            if signature not in seen_trip_ids and path[0]['board_time'] <= self.end_time:
+                seen_trip_ids.add(signature)
+                if start_time <= path[0]['board_time'] <= end_time:
+                    profile.append({
+                        "departure_time": path[0]['board_time'],
+                        "arrival_time": path[-1]['arrival_time'],
+                        "transfers": sum(1 for segment in path if segment['trip_id'] is not None) - 1, # footpaths are not counted
+                        "path": path
+                    })
+
+        profile.sort(key=lambda entry: (entry["departure_time"], entry["transfers"]))
+        return profile
+
+    def paths(self, target_stop: Stop, departure_time: int, consecutive_paths: Optional[int] = 5, end_time: Optional[int] = None) -> List[List[Dict]]:
+        """Same as raptor.paths_in_time_range, for the departure times covered by the tree: the paths of the 'consecutive_paths' earliest departures
+            leaving in [departure_time, end_time] (until the end of the tree by default). Empty if there is none: the next ones are not searched."""
+        profile = self.profile(target_stop, departure_time, end_time)
+
+        departures = sorted({entry["departure_time"] for entry in profile})
+        if consecutive_paths is not None:
+            departures = departures[:consecutive_paths]
+        kept_departures = set(departures)
+
+        return [entry["path"] for entry in profile if entry["departure_time"] in kept_departures]
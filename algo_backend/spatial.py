@@ -0,0 +1,110 @@
+############################################################
+### Spatial index over the stops (grid of lat/lon cells) ###
+############################################################
+
+import math
+from array import array
+from typing import Dict, List, Tuple
+
+from .data_structure import Stop
+
+EARTH_RADIUS = 6371000 # in meters
+CELL_SIZE = 0.02 # in degrees, about 2 km in latitude
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance in meters between two points given in degrees, as the crow flies."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class StopGrid:
+    """Spatial index built once over the coordinates of the stops, to answer radius and nearest stop queries
+        without scanning every stop: the stops are bucketed in square cells of CELL_SIZE degrees,
+        and a query only computes the distance to the stops of the cells overlapping its bounding box."""
+
+    def __init__(self, stop_list: List[Stop], cell_size: float = CELL_SIZE):
+        self.cell_size = cell_size
+        self.lats = array('d', (stop.lat for stop in stop_list))
+        self.lons = array('d', (stop.lon for stop in stop_list))
+
+        self.cells: Dict[Tuple[int, int], List[int]] = {} # (row, column) -> indices of the stops in the cell
+        for stop_index, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            self.cells.setdefault(self.cell(lat, lon), []).append(stop_index)
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def within(self, lat: float, lon: float, radius: float) -> List[Tuple[int, float]]:
+        """Stops closer than 'radius' meters from a point.
+            Output: [(stop index, distance in meters), ...] ordered by distance"""
+        d_lat = math.degrees(radius / EARTH_RADIUS)
+        # Longitude degrees shrink with the latitude: the bounding box is widened accordingly (up to the whole world near the poles)
+        cos_lat = math.cos(math.radians(min(abs(lat) + d_lat, 90)))
+        d_lon = math.degrees(radius / (EARTH_RADIUS * cos_lat)) if cos_lat > 1e-9 else 180
+
+        min_row, min_col = self.cell(lat - d_lat, lon - d_lon)
+        max_row, max_col = self.cell(lat + d_lat, lon + d_lon)
+
+        found = []
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self.cells): # Large radius: scanning the cells is cheaper
+            candidates = (stop_index for stops in self.cells.values() for stop_index in stops)
+        else:
+            candidates = (stop_index
+                          for row in range(min_row, max_row + 1)
+                          for col in range(min_col, max_col + 1)
+                          for stop_index in self.cells.get((row, col), ()))
+
+        for stop_index in candidates:
+            distance = haversine(lat, lon, self.lats[stop_index], self.lons[stop_index])
+            if distance <= radius:
+                found.append((stop_index, distance))
+
+        found.sort(key=lambda x: x[1])
+        return found
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[int, float]]:
+        """The k stops nearest to a point. The cells are visited ring by ring around the cell of the point,
+            until no unvisited cell can hold a stop closer than the k-th found. Far from every stop, all of them are scanned instead.
+            Output: [(stop index, distance in meters), ...] ordered by distance"""
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+
+        row, col = self.cell(lat, lon)
+        cell_meters = math.radians(self.cell_size) * EARTH_RADIUS # height of a cell
+        found = []
+        ring = 0
+
+        while (2 * ring + 1) ** 2 <= len(self.cells):
+            if ring == 0:
+                ring_cells = [(row, col)]
+            else:
+                ring_cells = ([(row - ring, c) for c in range(col - ring, col + ring + 1)]
+                              + [(row + ring, c) for c in range(col - ring, col + ring + 1)]
+                              + [(r, col - ring) for r in range(row - ring + 1, row + ring)]
+                              + [(r, col + ring) for r in range(row - ring + 1, row + ring)])
+
+            for cell in ring_cells:
+                for stop_index in self.cells.get(cell, ()):
+                    found.append((stop_index, haversine(lat, lon, self.lats[stop_index], self.lons[stop_index])))
+
+            found.sort(key=lambda x: x[1])
+            del found[k:]
+
+            # Any stop outside the visited rings is at least 'ring' cells away. Cells are narrower in longitude, the farther from the equator
+            cos_lat = math.cos(math.radians(min(abs(lat) + (ring + 1) * self.cell_size, 90)))
+            if len(found) == k and found[-1][1] <= ring * cell_meters * cos_lat:
+                return found
+
+            ring += 1
+
+        found = [(stop_index, haversine(lat, lon, self.lats[stop_index], self.lons[stop_index])) for stop_index in range(len(self))]
+        found.sort(key=lambda x: x[1])
+        return found[:k]
@@ -0,0 +1,19 @@
+import time
+from algo_backend.cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1 # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("c") == 3
+    assert (cache.hits, cache.misses, len(cache)) == (2, 1, 2)
+
+def test_ttl():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.02)
+    assert cache.get("a") is None and len(cache) == 0
@@ -0,0 +1,46 @@
+import os
+import pytest
+from algo_backend import coordinator
+from algo_backend.coordinator import Coordinator, publish_snapshot, current_snapshot, attach_snapshot
+from algo_backend.mock_dataset import build_mock_data
+
+
+@pytest.fixture
+def gtfs(monkeypatch):
+    # Stands for the GTFS directory: its version is set by the test, the timetable is the mock one
+    state = {"version": "v1", "builds": 0}
+    def load_gtfs_data(gtfs_dir):
+        state["builds"] += 1
+        return build_mock_data()["timetable"]
+    monkeypatch.setattr(coordinator, "gtfs_version", lambda gtfs_dir: state["version"])
+    monkeypatch.setattr(coordinator, "load_gtfs_data", load_gtfs_data)
+    return state
+
+def test_single_coordinator(tmp_path):
+    first, second = Coordinator(str(tmp_path)), Coordinator(str(tmp_path))
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    first.lock_file.close() # as when the coordinator process exits
+    assert second.try_acquire()
+
+def test_publish_and_attach(gtfs, tmp_path):
+    snapshot_dir = str(tmp_path)
+    assert attach_snapshot(snapshot_dir) is None
+
+    path = publish_snapshot("gtfs", snapshot_dir)
+    assert current_snapshot(snapshot_dir) == path
+    timetable = attach_snapshot(snapshot_dir)
+    assert timetable.version == "v1" and len(timetable.stop_list) == 8
+    # Same version: neither rebuilt nor reloaded
+    publish_snapshot("gtfs", snapshot_dir)
+    assert gtfs["builds"] == 1
+    assert attach_snapshot(snapshot_dir, timetable) is timetable
+
+    gtfs["version"] = "v2"
+    new_path = publish_snapshot("gtfs", snapshot_dir)
+    assert attach_snapshot(snapshot_dir, timetable).version == "v2"
+    # The previous snapshot is kept for the workers still using it, older ones are deleted
+    gtfs["version"] = "v3"
+    publish_snapshot("gtfs", snapshot_dir)
+    assert not os.path.exists(path) and os.path.exists(new_path)
+    assert timetable.stop_list[0].id == "A" # still readable once its file is deleted
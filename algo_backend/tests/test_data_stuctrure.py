@@ -1,5 +1,6 @@
 import pytest
 
+from datetime import date
 from algo_backend.data_structure import *
 
 @pytest.fixture
@@ -52,3 +53,49 @@ def test_trip_linked_to_route(setup_data):
 def test_stop_index_list(setup_data):
     _, _, route, _ = setup_data
     assert route.stop_index_list == [0,1,2]
+
+def test_build_timetable(setup_data):
+    stop_list, route_list, _, _ = setup_data
+    timetable = build_timetable(stop_list, route_list)
+    assert timetable.stop_route_ranks[2] == [(0, 2)]
+    assert timetable.stop_dict["B"] is stop_list[1]
+
+def test_labels_reset():
+    labels = Labels(num_stops=3, max_rounds=2)
+    assert len(labels.arrival) == 9 and len(labels.best) == 3
+    arrival_buffer = labels.arrival
+    labels.arrival[4] = 10
+    labels.route[4] = 0
+    assert labels.rounds(1)[1] == 10
+    labels.reset()
+    assert labels.arrival is arrival_buffer # reset in place
+    assert labels.rounds(1)[1] == UNREACHED and labels.route[4] == NO_PARENT
+
+def test_timetable_for_day(setup_data):
+    stop_list, route_list, route, _ = setup_data
+    route.add_trip(Trip(id="T2", arrival_times=[30,40,50], departure_times=[30,41,51], no_pickup=(1,), service=1))
+    calendar = ServiceCalendar(start_date=date(2026,1,5), num_days=2, service_ids=["WEEK", "MONDAY"], days=[0b11, 0b01])
+    timetable = build_timetable(stop_list, route_list, calendar=calendar)
+
+    monday = timetable_for_day(timetable, date(2026,1,5))
+    assert monday.route_list[0] is route # every trip runs: the route is not copied
+    tuesday = timetable_for_day(timetable, date(2026,1,6))
+    assert tuesday.route_list[0].trip_ids == ["T1"]
+    assert list(tuesday.route_list[0].departure_columns[1]) == [11]
+    assert tuesday.route_list[0].no_pickup[1] == frozenset()
+    assert timetable_for_day(timetable, date(2026,1,6)) is tuesday # cached
+    assert timetable_for_day(timetable, date(2026,2,1)).route_list[0].trip_ids == [] # outside of the calendar
+
+def test_day_views_threads(setup_data):
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import timedelta
+    stop_list, route_list, _, _ = setup_data
+    calendar = ServiceCalendar(start_date=date(2026,1,5), num_days=30, service_ids=["DAILY"], days=[(1 << 30) - 1])
+    timetable = build_timetable(stop_list, route_list, calendar=calendar)
+
+    # more days than the cache keeps, from several threads: each one gets the window of its own day, built once
+    days = [date(2026,1,5) + timedelta(days=i % 20) for i in range(400)]
+    with ThreadPoolExecutor(8) as threads:
+        windows = list(threads.map(lambda day: service_window(timetable, day), days))
+    assert all(window.day == day for window, day in zip(windows, days))
+    assert len(timetable.day_views) == DAY_VIEW_CACHE_SIZE
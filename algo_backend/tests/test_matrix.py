@@ -0,0 +1,32 @@
+import pytest
+from algo_backend.matrix import travel_time_matrix, write_npy, NO_PATH
+from algo_backend.mock_dataset import build_mock_data
+from array import array
+
+
+@pytest.fixture
+def dataset():
+    return build_mock_data()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_travel_time_matrix(dataset, workers):
+    # From A and E to D and H, leaving at 0 and 11 minutes
+    matrix = travel_time_matrix(dataset["timetable"], [0, 4], [3, 7], [0, 11 * 60], workers=workers)
+    assert list(matrix) == [
+        24 * 60, NO_PATH, 24 * 60, NO_PATH, # A -> D with R2 then R3, E -> D with R3, both arriving at 24 minutes. H is never reached
+        13 * 60, NO_PATH, 13 * 60, NO_PATH # The second trip of R2 still connects with R3 at F
+    ]
+
+def test_max_duration(dataset):
+    matrix = travel_time_matrix(dataset["timetable"], [0], [3, 5], [0], max_duration=20 * 60, workers=1)
+    assert list(matrix) == [NO_PATH, 14 * 60]
+
+def test_write_npy(tmp_path):
+    file_path = tmp_path / "matrix.npy"
+    write_npy(file_path, array('i', range(6)), (1, 2, 3))
+    content = file_path.read_bytes()
+    header_length = int.from_bytes(content[8:10], "little")
+    assert content[:8] == b"\x93NUMPY\x01\x00" and (10 + header_length) % 64 == 0
+    assert "'shape': (1, 2, 3)" in content[10:10 + header_length].decode("latin1")
+    assert array('i', content[10 + header_length:]) == array('i', range(6))
@@ -0,0 +1,66 @@
+import pytest
+from algo_backend.mcraptor import McRAPTOR, WalkingTime, boardable_trips, trips_by_train_type, train_types_mask
+from algo_backend.mock_dataset import build_mock_data, build_walk_data
+from algo_backend.data_structure import TransferGraph
+
+
+@pytest.fixture
+def dataset():
+    dataset = build_mock_data()
+    route1, route2, route3 = dataset["timetable"].route_list
+    # Kinds of trains are read in the trip ids: R1_T1 is a OUIGO, the others are TER
+    route1.trip_ids = ["R1_T1:OGO:", "R1_T2:TER:"]
+    route2.trip_ids = ["R2_T1:TER:", "R2_T2:TER:"]
+    route3.trip_ids = ["R3_T1:TER:"]
+    return dataset
+
+
+def run_mcraptor(dataset, source_id, target_id, departure_time, **kwargs):
+    stops = dataset["stop_list"]
+
+    source = next(s for s in stops if s.id == source_id)
+    target = next(s for s in stops if s.id == target_id)
+
+    return McRAPTOR(source, target, departure_time, dataset["timetable"], **kwargs)
+
+def test_same_as_raptor(dataset):
+    # Without additional criteria, one journey per number of trips improving the arrival time (see test_raptor.test_faster_trip)
+    journeys = run_mcraptor(dataset, "A", "D", departure_time=0, criteria=())
+    assert [(journey["arrival_time"], journey["transfers"]) for journey in journeys] == [(24 * 60, 1), (40 * 60, 0)]
+
+def test_pareto_train_types(dataset):
+    # The direct TER arrives later than the direct OUIGO, but is kept as it avoids the OUIGO
+    journeys = run_mcraptor(dataset, "A", "D", departure_time=0)
+    assert [(journey["arrival_time"], journey["criteria"]["train_types"]) for journey in journeys] == [
+        (24 * 60, ["TER"]), (40 * 60, ["OUIGO"]), (50 * 60, ["TER"])]
+    # The fastest one, with TER only, takes one more train
+    assert journeys[2]["transfers"] == 0 and journeys[0]["transfers"] == 1
+
+def test_train_types_filter(dataset):
+    journeys = run_mcraptor(dataset, "A", "D", departure_time=0, max_rounds=1, train_types={"OUIGO"})
+    assert [segment["trip_id"] for segment in journeys[0]["path"]] == ["R1_T1:OGO:"]
+    assert run_mcraptor(dataset, "A", "D", departure_time=0, train_types={"Intercités"}) == []
+
+def test_boardable_trips(dataset):
+    # Only the earliest trip of each kind: R2_T2 is a TER as well, but leaves after R2_T1
+    route1, route2, _ = dataset["timetable"].route_list
+    assert boardable_trips(route1, 0, 0, trips_by_train_type(route1, None)) == [0, 1]
+    assert boardable_trips(route1, 0, 0, trips_by_train_type(route1, train_types_mask({"TER"}))) == [1]
+    assert boardable_trips(route2, 0, 0, trips_by_train_type(route2, None)) == [0]
+    assert boardable_trips(route2, 0, 11 * 60, trips_by_train_type(route2, None)) == [1]
+
+def test_walking_time(dataset):
+    timetable = dataset["timetable"]
+    timetable.footpaths = TransferGraph.from_durations(len(timetable.stop_list), {(6, 3): 3 * 60}) # 3 minutes walk from G to D
+    journeys = run_mcraptor(dataset, "A", "D", departure_time=0, criteria=(WalkingTime(),))
+    # Walking from G reaches D first, the journeys with R3 or R1 arrive later without walking
+    assert [(journey["arrival_time"], journey["criteria"]["walking_time"]) for journey in journeys] == [(19 * 60, 180), (24 * 60, 0), (40 * 60, 0)]
+    assert [(segment["trip_id"], segment["board_stop"], segment["stop"]) for segment in journeys[0]["path"]] == [("R2_T1:TER:", 0, 6), (None, 6, 3)]
+
+def test_trip_then_walk():
+    # B is reached earlier by walking from A, but only the trip to B goes on to C (see mock_dataset.build_walk_data)
+    dataset = build_walk_data()
+    stops = dataset["stop_list"]
+    journeys = McRAPTOR(stops[0], stops[4], 9 * 3600, dataset["timetable"]) # the walk to B takes the same kinds of trains as the trip
+    assert [(journey["arrival_time"], [segment["trip_id"] for segment in journey["path"]]) for journey in journeys] == [
+        (10 * 3600 + 10 * 60, ["SX_T1", "XB_T1", None])]
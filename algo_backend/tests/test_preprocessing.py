@@ -0,0 +1,83 @@
+import pytest
+from algo_backend.data_structure import Route, Trip
+from datetime import date
+from algo_backend.preprocessing import split_fifo_routes, overtakes, read_trips, load_calendar, close_footpaths
+
+@pytest.fixture
+def route():
+    route = Route(id="R1", stop_list=["A","B","C"], stop_index_list=[0,1,2])
+    route.add_trip(Trip(id="IC", arrival_times=[10,40,80], departure_times=[10,41,81])) # slow train
+    route.add_trip(Trip(id="TGV", arrival_times=[20,30,50], departure_times=[20,31,51])) # leaves later, arrives first
+    route.add_trip(Trip(id="TER", arrival_times=[60,90,120], departure_times=[60,91,121]))
+    return route
+
+def test_overtaking(route):
+    ic, tgv, ter = route.trips
+    assert overtakes(tgv, ic)
+    assert not overtakes(ter, ic)
+
+def test_fifo_split(route):
+    sub_routes = split_fifo_routes(route)
+    assert len(sub_routes) == 2
+    assert [trip.id for trip in sub_routes[0].trips] == ["IC", "TER"]
+    assert [trip.id for trip in sub_routes[1].trips] == ["TGV"]
+    assert all(sub_route.id == "R1" and sub_route.stop_index_list == [0,1,2] for sub_route in sub_routes)
+
+def write_stop_times(tmp_path, rows):
+    path = tmp_path / "stop_times.txt"
+    path.write_text("trip_id,arrival_time,departure_time,stop_id,stop_sequence,pickup_type,drop_off_type\n" + "\n".join(rows) + "\n")
+    return str(path)
+
+def test_read_trips(tmp_path):
+    path = write_stop_times(tmp_path, [
+        "T1,08:10:00,08:11:00,B,2,0,0",
+        "T1,08:00:00,08:00:00,A,1,0,1",
+        "T2,09:00:00,09:00:00,A,1,1,0",
+        "T2,09:10:00,09:10:00,C,2,0,0",
+    ])
+    trips = list(read_trips(path))
+    assert [trip[0] for trip in trips] == ["T1", "T2"]
+    trip_id, stop_ids, arr_times, dep_times, no_pickup, no_drop_off = trips[0]
+    assert stop_ids == ["A", "B"] # ordered by stop_sequence
+    assert list(arr_times) == [28800, 29400] and list(dep_times) == [28800, 29460]
+    assert no_pickup == () and no_drop_off == (0,)
+    assert trips[1][4] == (0,)
+
+def test_read_trips_not_grouped(tmp_path):
+    path = write_stop_times(tmp_path, [
+        "T1,08:00:00,08:00:00,A,1,0,0",
+        "T2,09:00:00,09:00:00,A,1,0,0",
+        "T1,08:10:00,08:10:00,B,2,0,0",
+    ])
+    with pytest.raises(ValueError):
+        list(read_trips(path))
+
+def test_load_calendar(tmp_path):
+    (tmp_path / "calendar.txt").write_text(
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+        "WEEK,1,1,1,1,1,0,0,20260105,20260111\n")
+    (tmp_path / "calendar_dates.txt").write_text(
+        "service_id,date,exception_type\n"
+        "WEEK,20260106,2\n"
+        "EXTRA,20260110,1\n")
+    calendar = load_calendar(str(tmp_path))
+    assert calendar.start_date == date(2026,1,5) and calendar.num_days == 7
+    assert calendar.service_ids == ["WEEK", "EXTRA"]
+    assert calendar.active_services(date(2026,1,5)) == [True, False]
+    assert calendar.active_services(date(2026,1,6)) == [False, False] # removed by calendar_dates
+    assert calendar.active_services(date(2026,1,10)) == [False, True] # saturday, added by calendar_dates
+    assert calendar.active_services(date(2026,2,1)) == [False, False]
+
+def test_close_footpaths():
+    durations = {(0, 1): 300, (1, 0): 300, (1, 2): 400, (2, 1): 400, (0, 2): 900}
+    closed = close_footpaths(durations, forbidden={(2, 0)})
+    assert closed[(0, 2)] == 700 # walking through station 1 is shorter
+    assert (2, 0) not in closed
+    assert closed[(1, 2)] == 400
+
+def test_close_footpaths_limit():
+    durations = {(0, 1): 500, (1, 2): 500, (2, 3): 300, (3, 4): 1200}
+    closed = close_footpaths(durations, forbidden=set(), max_duration=900)
+    assert closed[(1, 3)] == 800
+    assert (0, 2) not in closed and (0, 3) not in closed # chained walks longer than the limit
+    assert closed[(3, 4)] == 1200 and (2, 4) not in closed # direct footpaths are kept
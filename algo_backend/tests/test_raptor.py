@@ -1,6 +1,9 @@
 import pytest
-from algo_backend.raptor import RAPTOR, get_unique_paths 
-from algo_backend.mock_dataset import build_mock_data
+from algo_backend.raptor import RAPTOR, get_unique_paths, collect_routes, earliest_trip_at_stop, range_RAPTOR, paths_in_time_range, \
+    latest_trip_at_stop, reverse_RAPTOR, paths_arriving_by, reachable_stops
+from algo_backend.mock_dataset import build_mock_data, build_walk_data
+from algo_backend.data_structure import UNREACHED, DAY, TransferGraph, RaptorStats, service_window
+from datetime import date
 
 
 @pytest.fixture
@@ -8,44 +11,142 @@ def dataset():
     return build_mock_data()
 
 
-def run_raptor(dataset, source_id, target_id, departure_time, max_rounds=6):
+def run_raptor(dataset, source_id, target_id, departure_time, max_rounds=6, **kwargs):
     stops = dataset["stop_list"]
-    routes = dataset["route_list"]
 
     source = next(s for s in stops if s.id == source_id)
     target = next(s for s in stops if s.id == target_id)
 
-    tau_matrix, tau_star, parent = RAPTOR(
+    labels = RAPTOR(
         source_stop=source,
         target_stop=target,
         departure_time=departure_time,
-        stop_list=stops,
-        route_list=routes,
-        max_rounds=max_rounds
+        timetable=dataset["timetable"],
+        max_rounds=max_rounds,
+        **kwargs
     )
-    return tau_matrix, tau_star, parent
+    return labels
 
 # Direct trip via R1
 def test_direct_trip(dataset):
-    tau, tau_star, parent = run_raptor(dataset, "A", "D", departure_time=0)
-    assert tau[3][1] == 40 # Result for stop D at round 1 is arrival time = 40
+    labels = run_raptor(dataset, "A", "D", departure_time=0)
+    assert labels.rounds(3)[1] == 40 * 60 # Result for stop D at round 1 is arrival time = 40 minutes
 
 def test_multiple_trips(dataset):
-    tau, tau_star, parent = run_raptor(dataset, "A", "D", departure_time=0)
-    tauD = sorted(tau[3])
-    assert tauD[0] != float('inf') and tauD[1] != float('inf')
+    labels = run_raptor(dataset, "A", "D", departure_time=0)
+    tauD = sorted(labels.rounds(3))
+    assert tauD[0] != UNREACHED and tauD[1] != UNREACHED
 
 def test_faster_trip(dataset):
-    tau, tau_star, parent = run_raptor(dataset, "A", "D", departure_time=0)
-    tauD = tau[3]
+    labels = run_raptor(dataset, "A", "D", departure_time=0)
+    tauD = labels.rounds(3)
     tauD_star = min(tauD)
-    assert tauD_star == 24 and tauD.index(tauD_star) == 2 # Best time is achieved in 24 minutes at round 2
+    assert tauD_star == 24 * 60 and tauD.index(tauD_star) == 2 # Best time is achieved in 24 minutes at round 2
 
 def test_impossible_trip(dataset):
-    tau, tau_star, parent = run_raptor(dataset, "B", "G", departure_time=0) # B -> D is impossible 
-    assert all(time == float('inf') for time in tau[6])
+    labels = run_raptor(dataset, "B", "G", departure_time=0) # B -> D is impossible 
+    assert all(time == UNREACHED for time in labels.rounds(6))
 
 def test_backtracking(dataset):
-    tau, tau_star, parent = run_raptor(dataset, "A", "D", departure_time=0)
-    paths = get_unique_paths(parent,tau,3,5)
-    assert paths[0] == [{'stop': 3, 'route_id': 'R1', 'trip_id': 'R1_T1', 'board_stop': 0, 'board_time': 10, 'arrival_time': 40}]
+    labels = run_raptor(dataset, "A", "D", departure_time=0)
+    paths = get_unique_paths(labels,dataset["timetable"],3,5)
+    assert paths[0] == [{'stop': 3, 'route_id': 'R1', 'trip_id': 'R1_T1', 'board_stop': 0, 'board_time': 600, 'arrival_time': 2400}]
+
+def test_route_queue(dataset):
+    timetable = dataset["timetable"]
+    # E and F are both on R2 and R3: each route is queued once, from its earliest marked stop
+    queue = collect_routes({5, 4}, timetable.stop_route_ranks)
+    assert queue == {1: 1, 2: 1}
+
+def test_earliest_trip(dataset):
+    route1 = dataset["route_list"][0] # R1 trips leave A at 10 and 20
+    assert earliest_trip_at_stop(route1, 0, 15 * 60) == 1
+    assert earliest_trip_at_stop(route1, 0, 10 * 60) == 0
+    assert earliest_trip_at_stop(route1, 0, 25 * 60) is None
+    assert earliest_trip_at_stop(route1, 0, 15 * 60, upper=1) is None # Only trips before the current one are searched
+
+def test_target_pruning(dataset):
+    labels = run_raptor(dataset, "H", "E", departure_time=0, pruning=True)
+    assert labels.best[4] == 14 * 60
+    assert labels.best[5] == UNREACHED # F is reached after E: pruned
+    labels = run_raptor(dataset, "H", "E", departure_time=0)
+    assert labels.best[5] == 18 * 60
+
+def test_pruning_keeps_paths(dataset):
+    labels = run_raptor(dataset, "A", "D", departure_time=0, pruning=True)
+    pruned_paths = get_unique_paths(labels,dataset["timetable"],3,5)
+    labels = run_raptor(dataset, "A", "D", departure_time=0)
+    assert pruned_paths == get_unique_paths(labels,dataset["timetable"],3,5)
+
+def test_range_query(dataset):
+    stops = dataset["stop_list"]
+    profile = range_RAPTOR(stops[0], stops[3], 0, 30 * 60, dataset["timetable"])
+    assert [(entry["departure_time"] // 60, entry["arrival_time"] // 60, entry["transfers"]) for entry in profile] == [(10, 40, 0), (12, 24, 1), (20, 50, 0)]
+
+def test_paths_in_time_range(dataset):
+    stops = dataset["stop_list"]
+    paths = paths_in_time_range(0, stops[0], stops[3], dataset["timetable"], consecutive_paths=2)
+    assert [path[0]['board_time'] for path in paths] == [600, 720]
+
+def test_raptor_stats(dataset):
+    stops = dataset["stop_list"]
+    stats = RaptorStats()
+    profile = range_RAPTOR(stops[0], stops[3], 0, 30 * 60, dataset["timetable"], stats=stats)
+    assert profile == range_RAPTOR(stops[0], stops[3], 0, 30 * 60, dataset["timetable"])
+    totals = stats.totals()
+    assert stats.scans == 3 and stats.rounds[1]["marked_stops"] == 3 # one scan per departure of the source
+    assert totals["routes"] > 0 and totals["trip_probes"] > 0 and totals["improved_labels"] > 0
+
+def test_service_window(dataset):
+    stops = dataset["stop_list"]
+    window = service_window(dataset["timetable"], date(2026,1,5))
+    assert len(window.route_list) == 3 * len(dataset["route_list"])
+    # Late in the evening, the search carries on with the trips of the next morning
+    paths = paths_in_time_range(23 * 3600, stops[0], stops[3], window, consecutive_paths=1)
+    assert [(path[0]['board_time'], path[-1]['arrival_time']) for path in paths] == [(DAY + 10 * 60, DAY + 40 * 60)]
+    assert paths_in_time_range(23 * 3600, stops[0], stops[3], dataset["timetable"]) == []
+
+def test_footpaths(dataset):
+    timetable = dataset["timetable"]
+    timetable.footpaths = TransferGraph.from_durations(len(timetable.stop_list), {(6, 3): 3 * 60}) # 3 minutes walk from G to D
+    labels = run_raptor(dataset, "A", "D", departure_time=0)
+    assert labels.rounds(3)[1] == 19 * 60 # R2 to G (16 minutes), then walk to D
+    path = get_unique_paths(labels, timetable, 3, 5)[0]
+    assert [(segment['trip_id'], segment['board_stop'], segment['stop']) for segment in path] == [("R2_T1", 0, 6), (None, 6, 3)]
+    assert path[1]['board_time'] == 16 * 60
+
+def test_latest_trip(dataset):
+    route1 = dataset["timetable"].route_list[0]
+    assert latest_trip_at_stop(route1, 3, 45 * 60) == 0 # R1_T1 reaches D at 40 minutes, R1_T2 at 50
+    assert latest_trip_at_stop(route1, 3, 50 * 60) == 1
+    assert latest_trip_at_stop(route1, 3, 39 * 60) is None
+
+def test_arrive_by(dataset):
+    stops = dataset["stop_list"]
+    labels = reverse_RAPTOR(stops[0], stops[3], 40 * 60, dataset["timetable"])
+    # Labels store the opposite of the latest departures: leaving A at 10 minutes with R1, or at 12 minutes with R2 then R3
+    assert list(labels.rounds(0)[1:3]) == [-10 * 60, -12 * 60]
+    paths = paths_arriving_by(40 * 60, stops[0], stops[3], dataset["timetable"], pruning=True)
+    assert [[segment['trip_id'] for segment in path] for path in paths] == [["R1_T1"], ["R2_T2", "R3_T1"]]
+    assert paths[1][0]['board_time'] == 12 * 60 and paths[1][-1]['arrival_time'] == 24 * 60
+
+def test_reachable_stops(dataset):
+    stops, arrivals, trips = reachable_stops(dataset["stop_list"][0], 0, dataset["timetable"])
+    reached = dict(zip(stops, zip(arrivals, trips)))
+    assert reached[0] == (0, 0) and reached[3] == (24 * 60, 2) and 7 not in reached # D with R2 then R3, H is never reached
+    # Only the stops reached within 15 minutes
+    stops, arrivals, trips = reachable_stops(dataset["stop_list"][0], 0, dataset["timetable"], end_time=15 * 60)
+    assert list(stops) == [0, 4, 5] and list(arrivals) == [0, 12 * 60, 14 * 60]
+
+@pytest.mark.parametrize("pruning", [False, True])
+def test_trip_then_walk(pruning):
+    # B is reached earlier by walking from A, but only the trip to B goes on to C (see build_walk_data)
+    dataset = build_walk_data()
+    stops, timetable = dataset["stop_list"], dataset["timetable"]
+    assert (0, 4) not in [(stop, target) for stop in range(5) for target, _ in timetable.footpaths[stop]] # no walk from A to C
+    labels = RAPTOR(stops[0], stops[4], 9 * 3600, timetable, pruning=pruning)
+    assert labels.best[4] == 10 * 3600 + 10 * 60
+    paths = paths_in_time_range(9 * 3600, stops[0], stops[4], timetable, pruning=pruning)
+    assert [[segment['trip_id'] for segment in path] for path in paths] == [["SX_T1", "XB_T1", None]]
+    paths = paths_arriving_by(10 * 3600 + 10 * 60, stops[0], stops[4], timetable, pruning=pruning)
+    assert [[segment['trip_id'] for segment in path] for path in paths] == [["SX_T1", "XB_T1", None]]
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from datetime import date
+from algo_backend.search import search, bucket_query, tree_paths, SearchPool, Overloaded, _source_trees
+from algo_backend.source_tree import SourceTree
+from algo_backend.raptor import paths_in_time_range
+from algo_backend.data_structure import Trip, build_timetable, service_window
+from algo_backend.postprocessing import rank_by_time, jsonify_paths
+from algo_backend.cache import LRUCache
+from algo_backend.mock_dataset import build_mock_data, minutes
+from algo_backend.snapshot import write_snapshot, load_snapshot
+
+
+@pytest.fixture
+def timetable(tmp_path):
+    timetable = build_mock_data()["timetable"]
+    timetable.version = "mock"
+    write_snapshot(timetable, str(tmp_path / "timetable.bin"))
+    return load_snapshot(str(tmp_path / "timetable.bin"))
+
+QUERY = dict(source_index=0, target_index=3, day=date(2026, 1, 5), departure_time=0)
+
+def test_search(timetable):
+    journeys = search(timetable, **QUERY)
+    assert [(journey["departure_stop"], journey["arrival_stop"]) for journey in journeys] == [("Stop A", "Stop D")] * len(journeys)
+    assert journeys[0]["segments"][-1]["arrival_time"] == 24 # minutes, see test_raptor.test_faster_trip
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_pool(timetable, workers):
+    pool = SearchPool(workers, max_pending=4, timeout=30)
+    trace = {}
+    try:
+        journeys = asyncio.run(pool.search(timetable, trace, **QUERY))
+    finally:
+        pool.close()
+    assert journeys == search(timetable, **QUERY)
+    assert pool.metrics.completed == 1 and pool.pending == 0
+    assert sorted(trace) == ["jsonify", "queue_wait", "rank", "raptor"]
+
+def test_pool_stats(timetable):
+    pool = SearchPool(0, max_pending=4, timeout=30)
+    trace = {}
+    asyncio.run(pool.search(timetable, **QUERY))
+    asyncio.run(pool.search(timetable, trace, collect_stats=True, **QUERY))
+    assert pool.stats_searches == 1 and trace["raptor_stats"].scans == pool.raptor_stats.scans > 0
+
+def test_isochrone(timetable):
+    pool = SearchPool(0, max_pending=4, timeout=30)
+    stops, arrivals, trips = asyncio.run(pool.isochrone(timetable, source_index=0, day=QUERY["day"], departure_time=0))
+    pool.close()
+    assert 3 in stops and arrivals[list(stops).index(3)] == 24 * 60 # see test_search
+
+def test_load_shedding(timetable):
+    pool = SearchPool(0, max_pending=0, timeout=30)
+    with pytest.raises(Overloaded):
+        asyncio.run(pool.search(timetable, **QUERY))
+
+def test_timeout_keeps_slot(timetable):
+    over = threading.Event()
+    pool = SearchPool(0, max_pending=1, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        asyncio.run(pool.run(timetable, QUERY, function=lambda timetable, **kwargs: over.wait() and []))
+    # the search still runs after its timeout: no other one is admitted until it is over
+    with pytest.raises(Overloaded):
+        asyncio.run(pool.search(timetable, **QUERY))
+    assert (pool.metrics.timeouts, pool.metrics.rejected, pool.pending) == (1, 1, 1)
+    over.set()
+    for _ in range(100):
+        if pool.pending == 0:
+            break
+        time.sleep(0.01)
+    assert pool.pending == 0
+    pool.close()
+
+def test_bucket_query():
+    key, rounded = bucket_query(dict(QUERY, departure_time=299))
+    assert rounded["departure_time"] == 0 and key == bucket_query(QUERY)[0]
+    assert rounded["consecutive_paths"] == 10 # enough departures left for the queries later in the bucket
+    key, rounded = bucket_query(dict(QUERY, departure_time=299, arrive_by=True))
+    assert rounded["departure_time"] == 299 and key != bucket_query(dict(QUERY, departure_time=299))[0]
+
+def test_cached_search(timetable):
+    pool = SearchPool(0, max_pending=4, timeout=30, cache=LRUCache(16), bucket=900)
+    journeys = asyncio.run(pool.search(timetable, **QUERY))
+    assert journeys == search(timetable, **QUERY)
+    # Same bucket of 15 minutes: read from the cache, the journey leaving at 10 minutes is dropped
+    later = asyncio.run(pool.search(timetable, **dict(QUERY, departure_time=11 * 60)))
+    assert sorted(journey["segments"][0]["board_time"] for journey in journeys) == [10, 12]
+    assert later == search(timetable, **dict(QUERY, departure_time=11 * 60))
+    assert pool.cache.hits == 1 and pool.cache.misses == 1
+
+    timetable.version = "new data"
+    asyncio.run(pool.search(timetable, **QUERY))
+    assert (pool.cache.misses, len(pool.cache)) == (2, 1)
+
+@pytest.mark.parametrize("options", [{}, {"end_time": 3600}, {"arrive_by": True}, {"multicriteria": True}])
+def test_cached_search_in_bucket(timetable, options):
+    pool = SearchPool(0, max_pending=4, timeout=30, cache=LRUCache(16), bucket=3600)
+    for minutes in (0, 5, 11, 13, 25, 45):
+        query = dict(QUERY, departure_time=minutes * 60, **options)
+        assert asyncio.run(pool.search(timetable, **query)) == search(timetable, **query)
+
+def built_trees():
+    """Waits for the source trees being built in the background."""
+    futures = [entry for _, entry in _source_trees.entries.values() if entry is not False]
+    return [future.result() for future in futures]
+
+def test_source_tree_reuse(timetable):
+    _source_trees.clear()
+    hits = _source_trees.hits
+    source = timetable.stop_list[0]
+    for target_index in (3, 4, 3): # the tree of the source is built after the second search, and used by the third one
+        target = timetable.stop_list[target_index]
+        expected = jsonify_paths(rank_by_time(paths_in_time_range(0, source, target, timetable, pruning=True)), timetable.stop_list)
+        assert search(timetable, **dict(QUERY, target_index=target_index)) == expected
+        built_trees()
+    assert _source_trees.hits == hits + 2 and any(isinstance(tree, SourceTree) for tree in built_trees())
+
+@pytest.mark.parametrize("end_time", [None, 3600])
+def test_tree_paths(timetable, end_time):
+    _source_trees.clear()
+    window = service_window(timetable, QUERY["day"])
+    source = window.stop_list[0]
+    for departure_time in (0, 11 * 60):
+        assert tree_paths(window, source, source, departure_time, end_time) is None # first search: no tree
+        assert tree_paths(window, source, source, departure_time, end_time) is None # second one: built in the background
+        built_trees()
+        for target in window.stop_list[1:]:
+            expected = paths_in_time_range(departure_time, source, target, window, pruning=True, end_time=end_time,
+                                           consecutive_paths=None if end_time is not None else 5)
+            paths = tree_paths(window, source, target, departure_time, end_time)
+            assert paths == expected or (paths is None and end_time is None and expected == []) # None: no path in the tree, see search()
+
+@pytest.mark.parametrize("end_time", [None, 3 * 3600 + 4 * 60])
+def test_tree_paths_within_bucket(end_time):
+    # A departure off the bucket boundaries: the trip leaving 3 hours and 2 minutes after the start of the bucket is still in its interval
+    dataset = build_mock_data()
+    dataset["route_list"][0].add_trip(Trip(id="R1_T3", departure_times=minutes(182, 190, 200, 210), arrival_times=minutes(182, 190, 200, 210)))
+    timetable = build_timetable(dataset["stop_list"], dataset["route_list"])
+    _source_trees.clear()
+    window = service_window(timetable, QUERY["day"])
+    source, target = window.stop_list[0], window.stop_list[3]
+    for _ in range(2):
+        tree_paths(window, source, target, 4 * 60, end_time)
+    built_trees()
+    expected = paths_in_time_range(4 * 60, source, target, window, pruning=True, end_time=end_time,
+                                   consecutive_paths=None if end_time is not None else 5)
+    assert "R1_T3" in {segment['trip_id'] for path in expected for segment in path}
+    assert tree_paths(window, source, target, 4 * 60, end_time) == expected
+
+def test_tree_built_once(timetable):
+    _source_trees.clear()
+    window = service_window(timetable, QUERY["day"])
+    source, target = window.stop_list[0], window.stop_list[3]
+    tree_paths(window, source, target, 0)
+    with ThreadPoolExecutor(8) as threads: # concurrent second searches
+        list(threads.map(lambda _: tree_paths(window, source, target, 0), range(8)))
+    assert len(built_trees()) == 1
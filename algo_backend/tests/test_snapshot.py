@@ -0,0 +1,43 @@
+import os
+import pytest
+from algo_backend.raptor import range_RAPTOR
+from algo_backend.mock_dataset import build_mock_data
+from algo_backend.snapshot import write_snapshot, load_snapshot, gtfs_version
+
+
+@pytest.fixture
+def dataset():
+    return build_mock_data()
+
+@pytest.fixture
+def snapshot(dataset, tmp_path):
+    path = str(tmp_path / "timetable.bin")
+    dataset["timetable"].version = "mock"
+    write_snapshot(dataset["timetable"], path)
+    return load_snapshot(path)
+
+def test_snapshot_round_trip(dataset, snapshot):
+    timetable = dataset["timetable"]
+    assert snapshot.version == "mock"
+    assert [stop.id for stop in snapshot.stop_list] == [stop.id for stop in timetable.stop_list]
+    for route, loaded in zip(timetable.route_list, snapshot.route_list):
+        assert list(loaded.stop_index_list) == list(route.stop_index_list)
+        assert [list(column) for column in loaded.departure_columns] == [list(column) for column in route.departure_columns]
+        assert [list(column) for column in loaded.arrival_columns] == [list(column) for column in route.arrival_columns]
+        assert loaded.trip_ids == route.trip_ids
+    assert all(snapshot.stop_route_ranks[i] == timetable.stop_route_ranks[i] for i in range(len(timetable.stop_list)))
+
+def test_snapshot_queries(dataset, snapshot):
+    timetable = dataset["timetable"]
+    source, target = timetable.stop_dict["A"], timetable.stop_dict["D"]
+    expected = range_RAPTOR(source, target, 0, 3600, timetable)
+    assert range_RAPTOR(snapshot.stop_dict["A"], snapshot.stop_dict["D"], 0, 3600, snapshot) == expected
+
+def test_gtfs_version(tmp_path):
+    # Same content downloaded again: same version, whatever the modification times
+    (tmp_path / "stops.txt").write_text("stop_id,stop_name\nA,Stop A\n")
+    version = gtfs_version(str(tmp_path))
+    os.utime(tmp_path / "stops.txt", (0, 0))
+    assert gtfs_version(str(tmp_path)) == version
+    (tmp_path / "stops.txt").write_text("stop_id,stop_name\nB,Stop A\n")
+    assert gtfs_version(str(tmp_path)) != version
@@ -0,0 +1,27 @@
+import io
+import pytest
+import os
+import zipfile
+from algo_backend.sncf_data import extract_zip
+
+
+def zip_content(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        for name, text in files.items():
+            z.writestr(name, text)
+    return buffer.getvalue()
+
+def test_extract_replaces_directory(tmp_path):
+    target = str(tmp_path / "gtfs")
+    extract_zip(zip_content({"stops.txt": "v1", "old.txt": "v1"}), target)
+    extract_zip(zip_content({"stops.txt": "v2"}), target)
+    assert sorted(os.listdir(target)) == ["stops.txt"]
+    assert sorted(os.listdir(tmp_path)) == ["gtfs"]
+
+def test_failed_extraction_keeps_data(tmp_path):
+    target = str(tmp_path / "gtfs")
+    extract_zip(zip_content({"stops.txt": "v1"}), target)
+    with pytest.raises(zipfile.BadZipFile):
+        extract_zip(b"not a zip file", target)
+    assert open(os.path.join(target, "stops.txt")).read() == "v1"
@@ -0,0 +1,31 @@
+import pytest
+from algo_backend.raptor import paths_in_time_range
+from algo_backend.source_tree import SourceTree
+from algo_backend.mock_dataset import build_mock_data
+from algo_backend.data_structure import TransferGraph
+
+
+@pytest.fixture
+def timetable():
+    return build_mock_data()["timetable"]
+
+def test_same_as_range_queries(timetable):
+    source = timetable.stop_dict["A"]
+    tree = SourceTree(source, 0, 3600, timetable)
+    for target in timetable.stop_list:
+        if target is not source:
+            assert tree.paths(target, 0) == paths_in_time_range(0, source, target, timetable, pruning=True)
+
+def test_later_departure(timetable):
+    # The paths leaving before the requested time are left out
+    source, target = timetable.stop_dict["A"], timetable.stop_dict["D"]
+    tree = SourceTree(source, 0, 3600, timetable)
+    assert tree.paths(target, 11 * 60) == paths_in_time_range(11 * 60, source, target, timetable, pruning=True, end_time=3600)
+
+def test_footpaths(timetable):
+    timetable.footpaths = TransferGraph.from_durations(len(timetable.stop_list), {(6, 3): 3 * 60}) # 3 minutes walk from G to D
+    source = timetable.stop_dict["A"]
+    tree = SourceTree(source, 0, 3600, timetable)
+    for target in timetable.stop_list:
+        if target is not source:
+            assert tree.paths(target, 0) == paths_in_time_range(0, source, target, timetable, pruning=True)
@@ -0,0 +1,28 @@
+import pytest
+from algo_backend.data_structure import Stop
+from algo_backend.spatial import StopGrid, haversine
+
+
+@pytest.fixture
+def grid():
+    stops = [
+        Stop(name="Paris Gare de Lyon", id="A", lat=48.8443, lon=2.3744),
+        Stop(name="Paris Austerlitz", id="B", lat=48.8420, lon=2.3655),
+        Stop(name="Paris Nord", id="C", lat=48.8809, lon=2.3553),
+        Stop(name="Lyon Part Dieu", id="D", lat=45.7606, lon=4.8593),
+    ]
+    return StopGrid(stops)
+
+def test_haversine():
+    assert haversine(48.8443, 2.3744, 45.7606, 4.8593) == pytest.approx(391000, rel=0.01) # Paris - Lyon
+
+def test_within(grid):
+    found = grid.within(48.8443, 2.3744, 1000)
+    assert [stop_index for stop_index, _ in found] == [0, 1]
+    assert found[0][1] == 0
+    assert [stop_index for stop_index, _ in grid.within(48.8443, 2.3744, 5000)] == [0, 1, 2]
+
+def test_nearest(grid):
+    assert [stop_index for stop_index, _ in grid.nearest(45.75, 4.85)] == [3]
+    assert [stop_index for stop_index, _ in grid.nearest(48.85, 2.36, k=2)] == [1, 0]
+    assert len(grid.nearest(0, 0, k=10)) == 4
@@ -12,10 +12,13 @@
  * @example
  * convertHHMM(630) // retourne "10:30"
  * convertHHMM(65)  // retourne "01:05"
+ * convertHHMM(1510) // retourne "01:10" (lendemain)
+ * convertHHMM(-30)  // retourne "23:30" (veille)
  */
 export function convertHHMM(totalMinutes) {
-    const hours = Math.floor(totalMinutes/60);
-    const minutes = totalMinutes %60;
+    // les heures après minuit sont comptées au-delà de 24h, celles de la veille en négatif
+    const hours = ((Math.floor(totalMinutes/60) % 24) + 24) % 24;
+    const minutes = ((totalMinutes % 60) + 60) % 60;
 
     const hh = String(hours).padStart(2,'0');
     const mm = String(minutes).padStart(2,'0');
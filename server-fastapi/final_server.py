@@ -1,20 +1,28 @@
 # Mock server
 
 import os 
+import json
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, TypedDict, List, Tuple, Any
-from pprint import pprint
+from typing import Dict, TypedDict, NotRequired, List, Tuple, Any, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.responses import RedirectResponse
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from algo_backend.raptor import paths_in_time_range
-from algo_backend.postprocessing import rank_by_time, jsonify_paths
-from algo_backend.preprocessing import load_gtfs_data
+from algo_backend.search import SearchPool, Overloaded
+from algo_backend.cache import LRUCache
+from algo_backend.coordinator import Coordinator, publish_snapshot, attach_snapshot
+from algo_backend.data_structure import Timetable, Stop, service_window
+from algo_backend.postprocessing import TRAIN_TYPES
+from algo_backend.spatial import StopGrid
 from algo_backend.sncf_data import download_and_extract_gtfs
 
 #------Define API instance------#
@@ -32,51 +40,218 @@ app.add_middleware(
 
 # path to GTFS data files
 gtfs_dir = 'gtfs_sncf'
+# snapshots du réseau, partagés par tous les workers (voir algo_backend.coordinator)
+snapshot_dir = 'snapshots'
 url = "https://eu.ftp.opendatasoft.com/sncf/plandata/Export_OpenData_SNCF_GTFS_NewTripId.zip"
 
-# Initialization of data variables
-stop_list = []
-route_list = []
-stop_dict = {}
-stop_name_to_index_dict = {}
-stop_names = []
+# pool de processus des recherches (voir algo_backend.search.SearchPool), un par worker uvicorn :
+# SEARCH_WORKERS et SEARCH_QUEUE_LIMIT valent pour chaque worker, les CPU sont partagés entre les WEB_CONCURRENCY workers
+WEB_CONCURRENCY = max(int(os.environ.get("WEB_CONCURRENCY", 1)), 1) # nombre de workers uvicorn (lu aussi par uvicorn)
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1))) # 0 : recherches dans les threads du serveur
+SEARCH_TIMEOUT = float(os.environ.get("SEARCH_TIMEOUT", 10)) # en secondes
+SEARCH_QUEUE_LIMIT = int(os.environ.get("SEARCH_QUEUE_LIMIT", 4 * max(SEARCH_WORKERS, 1))) # recherches en attente ou en cours
+# cache des résultats, par gare de départ et d'arrivée, jour et tranche de SEARCH_CACHE_BUCKET secondes
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 4096)) # 0 : pas de cache
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 3600)) # en secondes
+SEARCH_CACHE_BUCKET = int(os.environ.get("SEARCH_CACHE_BUCKET", 300)) # en secondes
+# fraction des recherches dont les compteurs RAPTOR sont ajoutés à /metrics (en plus des requêtes avec 'debug')
+RAPTOR_STATS_SAMPLE = float(os.environ.get("RAPTOR_STATS_SAMPLE", 0.01))
+search_pool = None
+
+@dataclass(frozen=True)
+class Dataset:
+    """
+    Everything the endpoints read from the GTFS data, built in the background
+    and swapped in with a single assignment: a request holds the dataset it
+    started with, and the previous one is freed (along with its memory-mapped
+    snapshot) once the last request using it returns.
+    """
+    timetable: Timetable # network index shared by every RAPTOR query
+    stop_name_to_index_dict: Dict[str, int]
+    stop_names: List[str] # sorted
+    stop_grid: StopGrid # spatial index over the stations
+    version: str # version of the GTFS data, see algo_backend.snapshot.gtfs_version
+    loaded_at: datetime
+
+    @property
+    def stop_list(self) -> List[Stop]:
+        return self.timetable.stop_list
+
+dataset: Optional[Dataset] = None # None tant que le premier chargement n'est pas terminé
+load_state = {"state": "starting", "error": None} # starting, loading, ready ou error
+load_lock = threading.Lock() # un seul chargement à la fois dans un worker
+coordinator = None # seul le worker qui détient le verrou télécharge les données
+
+def build_dataset(timetable: Timetable) -> Dataset:
+    """
+    Precompute everything the endpoints need around a timetable
+    """
+    # précalcul des trajets du jour et des jours voisins (vues mises en cache)
+    service_window(timetable, datetime.now().date())
+    stop_name_to_index_dict = {stop.name: stop.index_in_list for stop in timetable.stop_list}
+    return Dataset(timetable=timetable,
+                   stop_name_to_index_dict=stop_name_to_index_dict,
+                   stop_names=sorted(stop_name_to_index_dict),
+                   stop_grid=StopGrid(timetable.stop_list),
+                   version=timetable.version,
+                   loaded_at=datetime.now())
+
+def current_dataset() -> Dataset:
+    """
+    The dataset of the request, or a 503 error while the first load is running
+    """
+    network = dataset
+    if network is None:
+        raise HTTPException(status_code=503, detail="Données en cours de chargement")
+    return network
 
 # update the data 
 def update_and_load_data():
     """
-    Download and reload GTFS data
+    Download GTFS data and publish its snapshot to every worker (coordinator only)
     """
-    global stop_list, route_list, stop_dict, stop_name_to_index_dict, stop_names
+    if not coordinator.try_acquire():
+        return
+    
+    if dataset is None:
+        attach_data() # snapshot d'un lancement précédent, servi pendant le téléchargement
     
     print(f"[{datetime.now()}] Démarrage de la mise à jour des données...")
     
     try:
         download_and_extract_gtfs(url)
-        new_s_list, new_r_list, new_s_dict = load_gtfs_data(gtfs_dir)
-        
-        stop_list = new_s_list
-        route_list = new_r_list
-        stop_dict = new_s_dict
-        stop_name_to_index_dict = {stop.name: stop.index_in_list for stop in stop_list}
-        stop_names = list(stop_name_to_index_dict.keys())
-        
+        # snapshot binaire reconstruit seulement si les données GTFS ont changé
+        publish_snapshot(gtfs_dir, snapshot_dir)
         print(f"[{datetime.now()}] mise à jour terminée")
         
     except Exception as e:
         print(f"erreur : {e}")
+        if dataset is None:
+            load_state.update(state="error", error=str(e))
+
+    attach_data()
+
+def attach_data():
+    """
+    Map the current snapshot, if it changed since the last call, and swap the dataset
+    """
+    global dataset
+    
+    with load_lock:
+        try:
+            current = dataset.timetable if dataset is not None else None
+            new_timetable = attach_snapshot(snapshot_dir, current)
+            if new_timetable is None or new_timetable is current:
+                return
+            if dataset is None:
+                load_state.update(state="loading", error=None)
+            
+            dataset = build_dataset(new_timetable)
+            load_state.update(state="ready", error=None)
+            print(f"[{datetime.now()}] nouveau snapshot chargé (pid {os.getpid()})")
+            
+        except Exception as e:
+            print(f"erreur : {e}")
+            if dataset is None:
+                load_state.update(state="error", error=str(e))
+
+def follow_snapshot():
+    """
+    Switch to the last published snapshot. The worker which becomes the
+    coordinator (at startup, or when the previous one exited) updates the data first
+    """
+    if not coordinator.owned and coordinator.try_acquire():
+        update_and_load_data()
+    else:
+        attach_data()
 
 # --- chargement au démarrage de l'app ---
 @app.on_event("startup")
 def startup_event():
-    update_and_load_data()
+    global coordinator, search_pool
+    coordinator = Coordinator(snapshot_dir)
+    cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL) if SEARCH_CACHE_SIZE > 0 else None
+    search_pool = SearchPool(SEARCH_WORKERS, SEARCH_QUEUE_LIMIT, SEARCH_TIMEOUT, cache, SEARCH_CACHE_BUCKET, RAPTOR_STATS_SAMPLE)
     
-    # mise à jour planifiée
     scheduler = BackgroundScheduler()
-    # mise à jour tous les jours à 4h
+    # premier chargement en arrière-plan : l'application répond tout de suite (voir /health)
+    scheduler.add_job(follow_snapshot, next_run_time=datetime.now())
+    # mise à jour tous les jours à 4h (coordinateur seulement)
     scheduler.add_job(update_and_load_data, 'cron', hour=4, minute=0)
+    # changement de snapshot dans chaque worker
+    scheduler.add_job(follow_snapshot, 'interval', seconds=10)
     scheduler.start()
     print("planificateur démarré")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    search_pool.close()
+
+
+@app.get("/health")
+def health() -> Dict[str, Any]:
+    """
+    Liveness and readiness of the server, answered even while the data loads.
+
+    Returns:
+        dict: A JSON response containing:
+            - status (str): Always 'ok' once the server runs.
+            - ready (bool): Whether the GTFS data is loaded and searches can be served.
+            - state (str): 'starting', 'loading', 'ready' or 'error' (first load failed).
+            - error (str): The error of the failed first load, if any.
+            - version (str): Version of the GTFS data served, if loaded.
+            - loaded_at (str): When this version was loaded, if loaded.
+    """
+    network = dataset
+    return {
+        "status": "ok",
+        "ready": network is not None,
+        "state": load_state["state"],
+        "error": load_state["error"],
+        "version": network.version if network is not None else None,
+        "loaded_at": network.loaded_at.isoformat() if network is not None else None
+    }
+
+@app.get("/ready")
+def ready() -> Dict[str, Any]:
+    """
+    Readiness probe: 503 until the GTFS data is loaded.
+
+    Returns:
+        dict: The /health response, with a 200 status code once ready.
+    """
+    current_dataset()
+    return health()
+
+@app.get("/metrics")
+def metrics() -> Dict[str, Any]:
+    """
+    Load of the search pool of this worker process.
+
+    Returns:
+        dict: A JSON response containing:
+            - status (str): The success status of the request.
+            - workers (int): Processes of the search pool.
+            - pending (int): Searches waiting for a process or running.
+            - search (dict): Searches and isochrones completed, rejected
+              (queue full) and timed out, with the percentiles (p50, p95,
+              p99, max) of their queue wait and compute time in
+              milliseconds, over the last 1000 searches.
+            - cache (dict): Size, hits, misses and hit rate of the result
+              cache, None if disabled.
+            - raptor (dict): Counters of the RAPTOR scans (stops marked,
+              routes scanned, trips probed, labels improved, time of each
+              phase in milliseconds), summed over the 'searches' sampled
+              (RAPTOR_STATS_SAMPLE) or run with 'debug', in total and by round.
+    """
+    return {
+        "status": "success",
+        "workers": search_pool.workers,
+        "pending": search_pool.pending,
+        "search": search_pool.metrics.summary(),
+        "cache": search_pool.cache.stats() if search_pool.cache is not None else None,
+        "raptor": {"searches": search_pool.stats_searches, **search_pool.raptor_stats.as_dict()}
+    }
 
 @app.get("/result.html")
 async def redirect_result() -> FileResponse:
@@ -103,11 +278,154 @@ def get_stations() -> Dict[str, Any]:
     """
     return {
         "status": "success",
-        "stations": sorted(stop_names)
+        "stations": current_dataset().stop_names
+    }
+
+@app.get("/stations/nearby")
+def get_nearby_stations(lat: float, lon: float, radius: Optional[float] = None, limit: int = 5) -> Dict[str, Any]:
+    """
+    Finds the stations around a point, using the spatial index built at load time.
+
+    Args:
+        lat (float): Latitude of the point, in degrees.
+        lon (float): Longitude of the point, in degrees.
+        radius (float, optional): Search radius in meters. If omitted, the
+            'limit' nearest stations are returned whatever their distance.
+        limit (int): Maximum number of stations returned. Defaults to 5.
+
+    Returns:
+        dict: A JSON response containing:
+            - status (str): The success status of the request.
+            - stations (List[dict]): The stations ordered by distance, with
+              their name, coordinates and distance (in meters) to the point.
+    """
+    network = current_dataset()
+    if radius is None:
+        found = network.stop_grid.nearest(lat, lon, limit)
+    else:
+        found = network.stop_grid.within(lat, lon, radius)[:limit]
+
+    return {
+        "status": "success",
+        "stations": [{"name": network.stop_list[stop_index].name,
+                      "lat": network.stop_list[stop_index].lat,
+                      "lon": network.stop_list[stop_index].lon,
+                      "distance": round(distance)} for stop_index, distance in found]
+    }
+
+def parse_date(value: Any, field: str) -> datetime:
+    """
+    Date and time of a request, eg. '2025-12-27T08:00'. Raises a 400 error
+    if it can not be parsed.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"'{field}' n'est pas une date valide")
+
+def stop_index_of(network, name: Any) -> int:
+    """
+    Index of a station in the list of stations of the dataset. Raises a 404
+    error if there is no station of this name.
+    """
+    try:
+        return network.stop_name_to_index_dict[name]
+    except (KeyError, TypeError):
+        raise HTTPException(status_code=404, detail=f"Gare inconnue : {name}")
+
+def end_time_of(start: datetime, date_fin: Optional[str]) -> Optional[int]:
+    """
+    End of a departure interval given as a date and time, in seconds from
+    midnight of the departure day: a 'date_fin' on the next day ends past
+    86400. Raises a 400 error if it is before the departure.
+    """
+    if not date_fin:
+        return None
+    end = parse_date(date_fin, 'date_fin')
+    if end < start:
+        raise HTTPException(status_code=400, detail="'date_fin' est antérieure à 'date'")
+    return (end.date() - start.date()).days * 86400 + end.hour * 3600 + end.minute * 60 + end.second
+
+@app.get("/isochrone")
+async def get_isochrone(depart: str, date: str, date_fin: Optional[str] = None, correspondances: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Finds every station reachable from a departure station, with a single
+    RAPTOR run over the whole network ("where can I go from Bordeaux by 10:00").
+
+    Args:
+        depart (str): Name of the departure station.
+        date (str): Departure date and time, eg. '2025-12-27T08:00'.
+        date_fin (str, optional): Only the stations reached by this date
+            and time are returned.
+        correspondances (int, optional): Maximum number of transfers.
+            Defaults to 4.
+
+    The RAPTOR run goes through the search pool, with the deadline and load
+    shedding of /search (503 or 504 errors), but without cache. An unknown
+    station gets a 404 error, and a date that can not be parsed a 400 error.
+
+    Returns:
+        dict: A JSON response containing aligned arrays (one entry per
+            station reached) rather than one object per station:
+            - status (str): The success status of the request.
+            - stations (List[str]): Names of the stations reached.
+            - lat, lon (List[float]): Their coordinates.
+            - arrival_time (List[float]): Earliest arrival, in minutes from
+              midnight of the departure day (as in /search).
+            - transfers (List[int]): Transfers needed to arrive that early.
+    """
+    start = parse_date(date, 'date')
+    departure_time = start.hour * 3600 + start.minute * 60 + start.second
+    end_time = end_time_of(start, date_fin)
+
+    network = current_dataset()
+    source_index = stop_index_of(network, depart)
+    max_rounds = correspondances + 1 if correspondances is not None else 5
+    try:
+        stops, arrivals, trips = await search_pool.isochrone(network.timetable,
+                                                             source_index=source_index,
+                                                             day=start.date(),
+                                                             departure_time=departure_time,
+                                                             max_rounds=max_rounds,
+                                                             end_time=end_time)
+    except Overloaded:
+        raise HTTPException(status_code=503, detail="Serveur surchargé, réessayez plus tard")
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Recherche trop longue")
+
+    return {
+        "status": "success",
+        "stations": [network.stop_list[stop_index].name for stop_index in stops],
+        "lat": [network.stop_list[stop_index].lat for stop_index in stops],
+        "lon": [network.stop_list[stop_index].lon for stop_index in stops],
+        "arrival_time": [arrival / 60 for arrival in arrivals],
+        "transfers": [max(trip_count - 1, 0) for trip_count in trips]
     }
 
 #------ Research ------#
 
+# une ligne JSON par recherche : gares, durée de chaque étape, nombre de trajets
+# (la requête et la réponse complètes au niveau DEBUG, ou pour une fraction SEARCH_LOG_SAMPLE des recherches)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+search_logger = logging.getLogger("bestrail.search")
+SEARCH_LOG_SAMPLE = float(os.environ.get("SEARCH_LOG_SAMPLE", 0))
+
+def log_search(record: Dict[str, Any], data: dict, results: Optional[dict]):
+    """
+    Log one line per search. Durations are converted to milliseconds; the
+    end of the departure interval stays in seconds from midnight of the
+    departure day, as the search gets it.
+    """
+    if not search_logger.isEnabledFor(logging.INFO):
+        return
+    line = {key: round(value * 1000, 2) if isinstance(value, float) else value for key, value in record.items()}
+    search_logger.info(json.dumps(line, ensure_ascii=False))
+    
+    debug = search_logger.isEnabledFor(logging.DEBUG)
+    if debug or random.random() < SEARCH_LOG_SAMPLE:
+        search_logger.log(logging.DEBUG if debug else logging.INFO,
+                          json.dumps({"requete": data, "reponse": results}, ensure_ascii=False, default=str))
+
 # Define Object Types to be able to check them 
 Segment = TypedDict("Segment", {
     "from": str,
@@ -128,9 +446,10 @@ class ApiResponse(TypedDict):
     status: str
     message: str
     trajets: List[Trajet]
+    debug: NotRequired[Dict[str, Any]] # only with 'debug': true
 
 @app.post("/search")
-def recherche(data: dict) -> ApiResponse:
+async def recherche(data: dict) -> ApiResponse:
     """Apply the RAPTOR algorithm to find the best paths between
     the departure point and the arrival point selected by the user
     on the webpage.
@@ -140,51 +459,96 @@ def recherche(data: dict) -> ApiResponse:
                     eg. {'depart': Paris Gare de Lyon, 
                          'arrivee': 'Lyon Part Dieu', 
                          'date': '2025:27:12'}.
+                    An optional 'date_fin' (same format) asks for all the
+                    best paths leaving between 'date' and 'date_fin'.
+                    With 'arriver_avant': true, 'date' is the latest
+                    arrival time instead of the departure time.
+                    An optional 'types_trains' (eg. ['TER']) restricts the
+                    trains taken to these kinds (400 error if one is not in
+                    postprocessing.TRAIN_TYPES), and 'multicritere': true
+                    returns every trade-off between arrival time, number of
+                    transfers and kinds of trains (McRAPTOR).
+                    With 'debug': true, the response gets a 'debug' block
+                    with the duration of each stage and the counters of the
+                    RAPTOR scans (None if the results were cached).
+
+    Searches run on a pool of processes per server worker (SEARCH_WORKERS,
+    the CPUs divided by the WEB_CONCURRENCY workers by default). A search
+    not over within SEARCH_TIMEOUT seconds gets a 504 error, and beyond
+    SEARCH_QUEUE_LIMIT searches pending, new ones get a 503 error at once
+    (see /metrics). Results are cached until the next data update: the
+    searches leaving in the same SEARCH_CACHE_BUCKET seconds share the
+    results of a single search, and get the same journeys as without the
+    cache. Arrive-by and McRAPTOR searches are only shared by identical
+    queries.
+
+    Each search is logged on one line (see log_search).
 
     Returns:
         ApiResponse: Object from the ApiResponse class defined above.
     """
-    print(f"Données reçues : {data} \n")
-    
-    source = data['depart']
-    target = data['arrivee']
-    date = data['date']
-    date = datetime.fromisoformat(date) # transform to datetime format
-    departure_time = float(date.hour * 60 + date.minute + date.second / 60) # convert into minutes from 0:00
-    
-    # Associate station name with its index in the list of stations
-    source_index_in_list = stop_name_to_index_dict[source]
-    target_index_in_list = stop_name_to_index_dict[target]
-    # Get the Stop objects
-    source_stop = stop_list[source_index_in_list]
-    target_stop = stop_list[target_index_in_list]
-    print(f"SOURCE STOP NAME : {source_stop.name}")
-    print(f"TARGET STOP NAME : {target_stop.name}\n")
-    
-    # Run the RAPTOR algorithm
-    paths = paths_in_time_range(departure_time,source_stop,target_stop,stop_list,route_list)
-    # logs
-    print("############------------------PATHS : \n")
-    pprint(paths)
-    print('\n')
-    
-    paths = rank_by_time(paths)
-    # logs
-    print("############------------------RANKED PATHS : \n")
-    pprint(paths)
-    print('\n')
-    
-    # format the results
-    jsonified_paths = jsonify_paths(paths, stop_list)
-    results = {"status": "success",
-               "message": "Données bien reçues et traitées !",
-               'trajets': jsonified_paths}
-    # logs
-    print("############__________________JSONIFIED PATHS : \n")
-    pprint(jsonified_paths)
-    print('\n')
-    print(f"Données envoyées : \n")
-    pprint(results)
+    start = time.perf_counter()
+    status = 500
+    trace = {} # how the search went, filled by the search pool
+    record = {"depart": data.get('depart'), "arrivee": data.get('arrivee'), "date": data.get('date')}
+    try:
+        network = current_dataset() # same data for the whole request, even if it is updated meanwhile
+        
+        source = data['depart']
+        target = data['arrivee']
+        date = data['date']
+        date = parse_date(date, 'date') # transform to datetime format
+        departure_time = date.hour * 3600 + date.minute * 60 + date.second # convert into seconds from 0:00
+
+        # optional end of the departure interval, on the same day or the next ones
+        end_time = end_time_of(date, data.get('date_fin'))
+
+        # optional kinds of trains to take, among TRAIN_TYPES
+        train_types = data.get('types_trains') or None
+        if train_types is not None and (not isinstance(train_types, list) or not set(train_types) <= set(TRAIN_TYPES)):
+            raise HTTPException(status_code=400, detail=f"'types_trains' doit être une liste parmi : {', '.join(TRAIN_TYPES)}")
+        record["end_time"] = end_time
+        
+        # Associate station name with its index in the list of stations
+        source_index_in_list = stop_index_of(network, source)
+        target_index_in_list = stop_index_of(network, target)
+        record["parse"] = time.perf_counter() - start
+        
+        # Run the RAPTOR algorithm in a process of the pool, within the deadline
+        try:
+            jsonified_paths = await search_pool.search(network.timetable, trace,
+                                                       source_index=source_index_in_list,
+                                                       target_index=target_index_in_list,
+                                                       day=date.date(),
+                                                       departure_time=departure_time,
+                                                       end_time=end_time,
+                                                       arrive_by=bool(data.get('arriver_avant')),
+                                                       train_types=train_types,
+                                                       multicriteria=bool(data.get('multicritere')),
+                                                       collect_stats=bool(data.get('debug')))
+        except Overloaded:
+            raise HTTPException(status_code=503, detail="Serveur surchargé, réessayez plus tard")
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail="Recherche trop longue")
+        
+        results = {"status": "success",
+                   "message": "Données bien reçues et traitées !",
+                   'trajets': jsonified_paths}
+        if data.get('debug'):
+            stats = trace.get("raptor_stats")
+            results["debug"] = {"trace": {key: round(value * 1000, 2) if isinstance(value, float) else value
+                                          for key, value in trace.items() if key != "raptor_stats"},
+                                "raptor": stats.as_dict() if stats is not None else None}
+        status = 200
+        record["trajets"] = len(jsonified_paths)
+        
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    finally:
+        trace.pop("raptor_stats", None) # in the debug block and /metrics only
+        record.update(trace, status=status, total=time.perf_counter() - start)
+        log_search(record, data, results if status == 200 else None)
     
     return results
 